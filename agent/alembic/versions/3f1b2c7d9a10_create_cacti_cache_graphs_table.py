@@ -0,0 +1,44 @@
+"""create cacti_cache_graphs table
+
+Revision ID: 3f1b2c7d9a10
+Revises: fc92fa8ed02b
+Create Date: 2026-10-18 10:12:41.512308
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1b2c7d9a10'
+down_revision = 'fc92fa8ed02b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'cacti_cache_graphs',
+        sa.Column('pipeline_id', sa.String, primary_key=True),
+        sa.Column('graph_id', sa.Integer, primary_key=True),
+        sa.Column('host_id', sa.String),
+        sa.Column('data', sa.JSON, nullable=False),
+    )
+    op.create_index('ix_cacti_cache_graphs_pipeline_id_host_id', 'cacti_cache_graphs', ['pipeline_id', 'host_id'])
+    # move graphs of existing caches from the json blob to the new table
+    op.execute("""
+        INSERT INTO cacti_cache_graphs (pipeline_id, graph_id, host_id, data)
+        SELECT c.pipeline_id, g.key::integer, g.value->>'host_id', g.value
+        FROM cacti_cache c, json_each(c.data->'graphs') g
+    """)
+    op.execute("UPDATE cacti_cache SET data = (data::jsonb - 'graphs')::json")
+
+
+def downgrade():
+    op.execute("""
+        UPDATE cacti_cache c SET data = (c.data::jsonb || jsonb_build_object('graphs', COALESCE(
+            (SELECT jsonb_object_agg(g.graph_id::text, g.data::jsonb) FROM cacti_cache_graphs g WHERE g.pipeline_id = c.pipeline_id),
+            '{}'::jsonb
+        )))::json
+    """)
+    op.drop_table('cacti_cache_graphs')
@@ -1,13 +1,41 @@
-from flask import jsonify, Blueprint, request
+import json
+
+from typing import Iterable, Iterator
+from flask import jsonify, Blueprint, request, Response, stream_with_context
 from agent import pipeline, data_extractor
 from agent.api.routes import needs_pipeline
+from agent.modules import logger
 
 cacti_source_ = Blueprint('cacti_source', __name__)
 
+logger_ = logger.get_logger(__name__)
+
+FORMAT_JSON = 'json'
+FORMAT_NDJSON = 'ndjson'
+
+# number of metrics serialized into one chunk of the response
+CHUNK_SIZE = 1000
+
 
 @cacti_source_.route('/data_extractor/cacti/<pipeline_id>', methods=['GET'])
 @needs_pipeline
 def read(pipeline_id: str):
+    # metrics are streamed as they are built, either as a json array (default) or as newline delimited json
+    # if `format=ndjson` is passed. Optional `limit` and `cursor` params return metrics of a page of `limit` graph
+    # items starting from the `cursor` position, the `X-Next-Cursor` header contains the cursor of the next page
+    # and is absent on the last one. `graph_ids` is an optional comma separated list of graphs to extract.
+    # If extraction fails after the response has started, the response ends with an `{"error": ...}` element,
+    # as the last line of ndjson or the last element of the json array
+    format_ = request.args.get('format', FORMAT_JSON)
+    if format_ not in [FORMAT_JSON, FORMAT_NDJSON]:
+        return jsonify(f'Unsupported format `{format_}`, use one of: {FORMAT_JSON}, {FORMAT_NDJSON}'), 400
+    try:
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+        graph_ids = [int(id_) for id_ in request.args['graph_ids'].split(',')] if 'graph_ids' in request.args else None
+    except ValueError:
+        return jsonify('`cursor`, `limit` and `graph_ids` must be integers'), 400
+
     pipeline_ = pipeline.repository.get_by_id(pipeline_id)
     try:
         metrics = data_extractor.cacti.extract_metrics(
@@ -15,7 +43,48 @@ def read(pipeline_id: str):
             str(request.args['start']),
             str(request.args['end']),
             str(request.args['step']),
+            graph_ids,
+            cursor,
+            limit,
         )
     except data_extractor.cacti.ArchiveNotExistsException:
         return jsonify(''), 204
-    return jsonify(metrics)
+
+    headers = {'X-Next-Cursor': str(metrics.next_cursor)} if metrics.next_cursor is not None else {}
+    if format_ == FORMAT_NDJSON:
+        return Response(stream_with_context(_to_ndjson(metrics)), mimetype='application/x-ndjson', headers=headers)
+    return Response(stream_with_context(_to_json_array(metrics)), mimetype='application/json', headers=headers)
+
+
+def _to_json_array(metrics: Iterable[data_extractor.cacti.metric.Metric]) -> Iterator[str]:
+    yield '['
+    separator = ''
+    try:
+        for chunk in _chunks(metrics):
+            yield separator + ','.join(chunk)
+            separator = ','
+    except Exception as e:
+        # the status is already sent, the error is the last element of the array
+        logger_.exception('Failed to extract Cacti metrics')
+        yield separator + json.dumps({'error': str(e)})
+    yield ']'
+
+
+def _to_ndjson(metrics: Iterable[data_extractor.cacti.metric.Metric]) -> Iterator[str]:
+    try:
+        for chunk in _chunks(metrics):
+            yield '\n'.join(chunk) + '\n'
+    except Exception as e:
+        logger_.exception('Failed to extract Cacti metrics')
+        yield json.dumps({'error': str(e)}) + '\n'
+
+
+def _chunks(metrics: Iterable[data_extractor.cacti.metric.Metric]) -> Iterator[list]:
+    chunk = []
+    for metric in metrics:
+        chunk.append(json.dumps(metric.to_dict()))
+        if len(chunk) == CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
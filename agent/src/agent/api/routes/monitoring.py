@@ -1,4 +1,3 @@
-import requests
 import urllib.parse
 
 from flask import jsonify, Blueprint, request
@@ -13,21 +12,7 @@ monitoring_bp = Blueprint('monitoring', __name__)
 @monitoring_bp.route('/metrics', methods=['GET'])
 def metrics():
     monitoring_.pull_latest()
-    return generate_latest(registry=monitoring_.metrics.registry)
-
-
-def _send_to_anodot(data: list, url: str, proxy_obj: proxy.Proxy):
-    errors = []
-    res = requests.post(url, json=data, proxies=proxy.get_config(proxy_obj))
-    if res.status_code != 200:
-        errors.append(f'Error {res.status_code} from {url}')
-
-    if res.text:
-        res_json = res.json()
-        if res_json['errors']:
-            errors.append(str(res_json['errors']))
-
-    return errors
+    return generate_latest(registry=monitoring_.metrics.get_registry())
 
 
 @monitoring_bp.route('/monitoring', methods=['GET'])
@@ -44,12 +29,12 @@ def monitoring():
     if constants.MONITORING_SEND_TO_CLIENT:
         url = urllib.parse.urljoin(monitoring_url,
                                    f'api/v1/metrics?token={destination_.token}&protocol={destination_.PROTOCOL_20}')
-        errors += _send_to_anodot(data, url, destination_.proxy)
+        errors += monitoring_.sender.send(data, url, proxy.get_config(destination_.proxy))
 
     if constants.MONITORING_SEND_TO_ANODOT:
         url = urllib.parse.urljoin(monitoring_url,
                                    f'api/v1/agents?token={destination_.token}&protocol={destination_.PROTOCOL_20}')
-        errors += _send_to_anodot(data, url, destination_.proxy)
+        errors += monitoring_.sender.send(data, url, proxy.get_config(destination_.proxy))
 
     if errors:
         raise Exception('Errors from anodot: ' + str(errors))
@@ -73,5 +58,16 @@ def scheduled_script_error(script_name):
 
 @monitoring_bp.route('/monitoring/scheduled_script_execution_time/<script_name>', methods=['POST'])
 def scheduled_script_execution_time(script_name):
-    monitoring_.metrics.SCHEDULED_SCRIPT_EXECUTION_TIME.labels(script_name).set(request.json['duration'])
+    metrics = monitoring_.metrics
+    metrics.set_gauge(metrics.SCHEDULED_SCRIPT_EXECUTION_TIME, request.json['duration'], script_name)
+    return jsonify('')
+
+
+@monitoring_bp.route('/monitoring/cacti_cache_refresh/<pipeline_id>', methods=['POST'])
+def cacti_cache_refresh(pipeline_id):
+    refresh_type = 'full' if request.json['full'] else 'incremental'
+    metrics = monitoring_.metrics
+    metrics.set_gauge(metrics.CACTI_CACHE_REFRESH_TIME, request.json['duration'], pipeline_id, refresh_type)
+    metrics.set_gauge(metrics.CACTI_CACHE_REFRESH_DELTA_SIZE, request.json['graphs'], pipeline_id, 'graphs')
+    metrics.set_gauge(metrics.CACTI_CACHE_REFRESH_DELTA_SIZE, request.json['hosts'], pipeline_id, 'hosts')
     return jsonify('')
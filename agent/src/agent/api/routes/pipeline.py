@@ -148,7 +148,7 @@ def pipeline_status_change(pipeline_id: str):
     pipeline_.status = data['pipeline_status']
     pipeline.repository.save(pipeline_)
     labels = (pipeline_.streamsets.url, pipeline_.name, pipeline_.source.type)
-    monitoring.metrics.PIPELINE_STATUS.labels(*labels).state(pipeline_.status)
+    monitoring.metrics.set_pipeline_status(labels, pipeline_.status)
     return jsonify('')
 
 
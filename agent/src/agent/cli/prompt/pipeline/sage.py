@@ -16,6 +16,7 @@ class SagePrompter(SchemalessPrompter):
         self.set_dimensions()
         self.prompt_static_dimensions()
         self.prompt_tags()
+        self.prompt_query_windows()
 
     def set_query(self):
         self.config['query_file'] = click.prompt('Query file path', type=click.Path(exists=True, dir_okay=False),
@@ -26,3 +27,10 @@ class SagePrompter(SchemalessPrompter):
     def set_dimensions(self):
         self.config['dimensions'] = self.prompt_dimensions('Dimensions',
                                                            default_value=self.default_config.get('dimensions', []))
+
+    def prompt_query_windows(self):
+        query_windows = self.default_config.get('query_windows', 1)
+        if self.advanced:
+            query_windows = click.prompt('Number of windows an interval is split into to query them concurrently',
+                                         type=click.IntRange(1), default=query_windows)
+        self.config['query_windows'] = query_windows
@@ -1,5 +1,7 @@
 import click
 
+from agent.modules.tools import infinite_retry
+from agent.pipeline.validators import solarwinds_query
 from agent.cli.prompt.pipeline.schemaless import SchemalessPrompter
 
 
@@ -9,6 +11,7 @@ class SolarWindsPrompter(SchemalessPrompter):
         self.prompt_delay()
         self.prompt_days_to_backfill()
         self.prompt_interval()
+        self.prompt_query_threads()
         self.prompt_timestamp()
         # todo we don't need to ask "is static" and "values array path" in set_values(), split that function
         self.set_values()
@@ -23,3 +26,14 @@ class SolarWindsPrompter(SchemalessPrompter):
             type=click.STRING,
             default=self.default_config.get('query')
         )
+
+    @infinite_retry
+    def prompt_query_threads(self):
+        query_threads = self.default_config.get('query_threads', 1)
+        if self.advanced:
+            query_threads = click.prompt('Number of intervals to query concurrently when the pipeline is behind',
+                                         type=click.IntRange(1), default=query_threads)
+            errors = solarwinds_query.get_errors(self.config['query'], query_threads)
+            if errors:
+                raise click.UsageError(' '.join(errors))
+        self.config['query_threads'] = query_threads
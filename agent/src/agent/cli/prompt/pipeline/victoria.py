@@ -10,6 +10,8 @@ class VictoriaPrompter(Prompter):
         self.prompt_days_to_backfill()
         self.prompt_interval()
         self.prompt_delay()
+        self.prompt_max_points_per_request()
+        self.prompt_shards()
         self.config['timestamp'] = {}
         self.config['timestamp']['type'] = 'unix'
         self.prompt_static_dimensions()
@@ -26,3 +28,26 @@ class VictoriaPrompter(Prompter):
         if self.advanced:
             self.config['aggregated_metric_name'] = \
                 click.prompt('Aggregated metric name', type=click.STRING, default=aggregated_metric_name)
+
+    def prompt_max_points_per_request(self):
+        max_points_per_request = self.default_config.get('max_points_per_request', 1)
+        if self.advanced:
+            max_points_per_request = click.prompt(
+                'Max number of intervals to query at once when the pipeline is behind, 1 to query them one by one',
+                type=click.IntRange(1),
+                default=max_points_per_request,
+            )
+        self.config['max_points_per_request'] = max_points_per_request
+
+    def prompt_shards(self):
+        shards = self.default_config.get('shards', [])
+        if self.advanced:
+            # selectors can contain spaces and commas, so they are separated by semicolons
+            shards = click.prompt(
+                'Series selectors to split the query into shards that are queried concurrently, separated by `;`. '
+                'Leave empty to query all series at once',
+                type=click.STRING,
+                default=';'.join(shards),
+            )
+            shards = [shard.strip() for shard in shards.split(';') if shard.strip()]
+        self.config['shards'] = shards
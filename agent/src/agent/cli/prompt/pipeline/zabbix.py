@@ -28,11 +28,32 @@ class ZabbixPrompter(SchemalessPrompter):
     def prompt_batch_sizes(self):
         items_batch_size = self.default_config.get('batch_size', 1000)
         histories_batch_size = self.default_config.get('histories_batch_size', 100)
+        query_threads = self.default_config.get('query_threads', 1)
+        metadata_ttl = self.default_config.get('metadata_ttl', 0)
+        catch_up_max_records = self.default_config.get('catch_up_max_records', 0)
         if self.advanced:
             items_batch_size = click.prompt('Items batch size', type=click.INT, default=items_batch_size)
             histories_batch_size = click.prompt('Histories batch size', type=click.INT, default=histories_batch_size)
+            query_threads = click.prompt('Number of concurrent Zabbix API requests', type=click.IntRange(1),
+                                         default=query_threads)
+            # new items appear up to metadata_ttl seconds late, with a positive ttl only details of new items
+            # are requested and details of existing ones are refreshed when the pipeline restarts
+            metadata_ttl = click.prompt(
+                'Hosts and items refresh interval in seconds, new items appear after up to this delay. '
+                '0 to refresh all items every interval, otherwise only details of new items are requested',
+                type=click.IntRange(0),
+                default=metadata_ttl,
+            )
+            catch_up_max_records = click.prompt(
+                'Max number of records to request at once when the pipeline is behind, 0 to disable catch-up',
+                type=click.IntRange(0),
+                default=catch_up_max_records,
+            )
         self.config['batch_size'] = items_batch_size
         self.config['histories_batch_size'] = histories_batch_size
+        self.config['query_threads'] = query_threads
+        self.config['metadata_ttl'] = metadata_ttl
+        self.config['catch_up_max_records'] = catch_up_max_records
 
     @infinite_retry
     def set_values(self):
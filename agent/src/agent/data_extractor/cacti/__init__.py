@@ -1,3 +1,9 @@
 from .cacti import extract_metrics, ArchiveNotExistsException
 from . import repository
+from . import archive
 from . import cacher
+from . import dimensions
+from . import fetcher
+from . import lru
+from . import planner
+from . import xport
@@ -0,0 +1,103 @@
+import fcntl
+import json
+import os
+import shutil
+import tarfile
+import time
+
+from typing import Optional
+
+# the archive is unpacked into a new generation directory, members that didn't change since the previous generation
+# are hard linked from it and only changed members are extracted. The target is a symlink that is switched to the new
+# generation at once, so readers see either the previous or the new set of files and never partially written ones.
+# The previous generation is kept for requests that are still reading it, older ones are removed
+
+
+def extract(archive_path: str, target: str):
+    parent, name = os.path.split(os.path.normpath(target))
+    generations_dir = os.path.join(parent, f'.{name}')
+    os.makedirs(generations_dir, exist_ok=True)
+    with open(os.path.join(generations_dir, 'lock'), 'w') as lock:
+        # only one process unpacks the archive, the others wait and then see that it's up to date
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        current = os.readlink(target) if os.path.islink(target) else None
+        state = _load_state(current) if current else {}
+        archive_signature = _get_signature(os.stat(archive_path))
+        if state.get('archive') == archive_signature:
+            return
+
+        new = os.path.join(generations_dir, str(time.time_ns()))
+        members = _extract_changed(archive_path, new, current, state.get('members', {}))
+        # the state is saved before the swap so it always describes the files of its generation
+        _save_state(new, {'archive': archive_signature, 'members': members})
+        _swap(target, new)
+        _remove_old_generations(generations_dir, [new, current])
+
+
+def _extract_changed(archive_path: str, new: str, current: Optional[str], previous_members: dict) -> dict:
+    members = {}
+    os.makedirs(new)
+    with tarfile.open(archive_path, "r|gz") as tar:
+        for member in tar:
+            if member.isfile():
+                signature = [member.mtime, member.size]
+                members[member.name] = signature
+                if current and previous_members.get(member.name) == signature \
+                        and _link(os.path.join(current, member.name), os.path.join(new, member.name)):
+                    continue
+            tar.extract(member, new)
+    return members
+
+
+def _link(source: str, destination: str) -> bool:
+    try:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.link(source, destination)
+        return True
+    except OSError:
+        return False
+
+
+def _swap(target: str, new: str):
+    if os.path.isdir(target) and not os.path.islink(target):
+        # the archive used to be extracted right into the target directory
+        shutil.rmtree(target)
+    link = f'{target}.link'
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(new, link)
+    # rename replaces the target atomically
+    os.replace(link, target)
+
+
+def _remove_old_generations(generations_dir: str, keep: list):
+    for entry in os.listdir(generations_dir):
+        path = os.path.join(generations_dir, entry)
+        if entry == 'lock' or _strip_suffix(path, '.json') in keep:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
+
+
+def _strip_suffix(path: str, suffix: str) -> str:
+    return path[:-len(suffix)] if path.endswith(suffix) else path
+
+
+def _get_signature(stat: os.stat_result) -> list:
+    # the archive can be gigabytes, so its mtime and size are compared instead of hashing the content
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _load_state(generation: str) -> dict:
+    try:
+        with open(f'{generation}.json') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(generation: str, state: dict):
+    with open(f'{generation}.json', 'w') as f:
+        json.dump(state, f)
@@ -1,14 +1,27 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from sqlalchemy import Column, String, ForeignKey, JSON, DateTime
+from typing import NamedTuple, Optional, Union
+from sqlalchemy import Column, String, ForeignKey, JSON, DateTime, Integer
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm.attributes import flag_modified
 from agent import pipeline, source
 from agent.data_extractor import cacti
+from agent.modules import constants, logger
+from agent.modules import db as agent_db
 from agent.modules.db import Entity
 from agent.pipeline import Pipeline
 
+logger_ = logger.get_logger(__name__)
+
 
 class CactiCache(Entity):
     GRAPHS = 'graphs'
     HOSTS = 'hosts'
+    DIMENSIONS = 'dimensions'
+    CHECKSUMS = 'checksums'
+    ADD_GRAPH_NAME_DIMENSION = 'add_graph_name_dimension'
 
     __tablename__ = 'cacti_cache'
 
@@ -24,37 +37,188 @@ class CactiCache(Entity):
     def _get(self, key: str):
         return self.data[key]
 
-    @property
-    def graphs(self) -> dict:
-        return self._get(self.GRAPHS)
-
     @property
     def hosts(self) -> dict:
         return self._get(self.HOSTS)
 
+    def has_dimensions(self, add_graph_name_dimension: bool) -> bool:
+        # dimensions of items are precomputed for a specific value of the pipeline `add_graph_name_dimension` config
+        return self.data.get(self.ADD_GRAPH_NAME_DIMENSION) == add_graph_name_dimension
+
     def is_expired(self) -> bool:
         return self.expires_at >= datetime.now()
 
 
-def cache_pipeline_data(pipeline_: Pipeline, *, force=False):
+class CactiCacheGraph(Entity):
+    # graphs are stored one per row so extraction can stream them and filter by graph ids
+    # instead of loading the whole cache
+    __tablename__ = 'cacti_cache_graphs'
+
+    pipeline_id = Column(String, ForeignKey('pipelines.name'), primary_key=True)
+    graph_id = Column(Integer, primary_key=True)
+    host_id = Column(String)
+    data = Column(JSON)
+
+    def __init__(self, pipeline_id: str, graph_id: int, data: dict):
+        self.pipeline_id = pipeline_id
+        self.graph_id = graph_id
+        self.host_id = data.get('host_id')
+        self.data = data
+
+    @property
+    def items(self) -> dict:
+        return self.data.get('items', {})
+
+
+class RefreshStats(NamedTuple):
+    duration: float
+    # number of graphs and hosts that were fetched from the Cacti db, which is everything if the refresh was full
+    graphs: int
+    hosts: int
+    full: bool
+
+
+def cache_pipeline_data(pipeline_: Pipeline, *, force=False, engine: Optional[Engine] = None) -> Optional[RefreshStats]:
     cache = cacti.repository.get_cache(pipeline_)
-    if force or cache is None or cache.is_expired():
-        data = cacti.repository.CactiCacher(pipeline_).get_data()
-        if cache is None:
-            cache = cacti.cacher.CactiCache(
-                pipeline_.name,
-                data,
-                _new_expire(pipeline_.source.config.get('cache_ttl', 3600))
-            )
-        else:
-            cache.data = data
-            cache.expires_at = _new_expire(pipeline_.source.config.get('cache_ttl', 3600))
-        cacti.repository.save_cacti_cache(cache)
-
-
-def cache_data():
-    for pipeline_ in pipeline.repository.get_by_type(source.TYPE_CACTI):
-        cache_pipeline_data(pipeline_)
+    if not (force or cache is None or cache.is_expired()):
+        return None
+
+    cacher_ = cacti.repository.CactiCacher(pipeline_, engine)
+    try:
+        return _cache(pipeline_, cache, cacher_, force)
+    finally:
+        cacher_.close()
+
+
+def _cache(pipeline_: Pipeline, cache: Optional[CactiCache], cacher_, force: bool) -> RefreshStats:
+    start = time.time()
+    add_graph_name_dimension = pipeline_.config.get('add_graph_name_dimension', False)
+    checksums = cacher_.get_checksums()
+    # the pipeline config might have changed on force, e.g. graph_ids, so the whole cache is rebuilt
+    if force or cache is None or CactiCache.CHECKSUMS not in cache.data:
+        data = cacher_.get_data()
+        graphs = data.pop(CactiCache.GRAPHS)
+        _add_dimensions(graphs, data[CactiCache.HOSTS], add_graph_name_dimension)
+        cacti.repository.replace_graphs(pipeline_.name, graphs)
+        graphs_count, hosts_count = len(graphs), len(data[CactiCache.HOSTS])
+        full = True
+    else:
+        data = cache.data
+        graphs_count, hosts_count = _patch(pipeline_, data, cacher_, checksums, add_graph_name_dimension)
+        full = False
+    data[CactiCache.CHECKSUMS] = checksums
+    data[CactiCache.ADD_GRAPH_NAME_DIMENSION] = add_graph_name_dimension
+
+    if cache is None:
+        cache = cacti.cacher.CactiCache(
+            pipeline_.name,
+            data,
+            _new_expire(pipeline_.source.config.get('cache_ttl', 3600))
+        )
+    else:
+        cache.data = data
+        # data might be the same dict that was changed in place, which is not tracked by sqlalchemy
+        flag_modified(cache, 'data')
+        cache.expires_at = _new_expire(pipeline_.source.config.get('cache_ttl', 3600))
+    cacti.repository.save_cacti_cache(cache)
+    return RefreshStats(time.time() - start, graphs_count, hosts_count, full)
+
+
+def cache_data(workers: int = constants.CACTI_CACHE_REFRESH_WORKERS) -> dict:
+    # pipelines are refreshed concurrently, returns pipeline_id -> RefreshStats, None if the cache hasn't expired
+    # or the exception if refreshing the pipeline failed, a failed pipeline doesn't stop refreshing the others
+    pipelines = pipeline.repository.get_by_type(source.TYPE_CACTI)
+    # pipelines that use the same Cacti db share one pool of connections
+    engines = {}
+    try:
+        with ThreadPoolExecutor(workers) as executor:
+            futures = {
+                pipeline_.name: executor.submit(_refresh, pipeline_, _get_engine(pipeline_, engines, workers))
+                for pipeline_ in pipelines
+            }
+        return {pipeline_id: future.result() for pipeline_id, future in futures.items()}
+    finally:
+        for engine in engines.values():
+            engine.dispose()
+
+
+def _get_engine(pipeline_: Pipeline, engines: dict, pool_size: int) -> Union[Engine, Exception]:
+    # an error in the pipeline config is returned instead of raised, so only this pipeline fails to refresh
+    try:
+        connection_string = pipeline_.source.config[source.CactiSource.MYSQL_CONNECTION_STRING]
+        if connection_string not in engines:
+            engines[connection_string] = cacti.repository.create_cacti_engine(connection_string, pool_size)
+        return engines[connection_string]
+    except Exception as e:
+        return e
+
+
+def _refresh(pipeline_: Pipeline, engine: Union[Engine, Exception]) -> Union[RefreshStats, Exception, None]:
+    try:
+        if isinstance(engine, Exception):
+            raise engine
+        return cache_pipeline_data(pipeline_, engine=engine)
+    except Exception as e:
+        logger_.exception(f'Failed to cache Cacti data for the pipeline {pipeline_.name}')
+        return e
+    finally:
+        # every worker thread uses its own agent db session
+        agent_db.Session.remove()
+
+
+def _patch(pipeline_: Pipeline, data: dict, cacher_, checksums: dict, add_graph_name_dimension: bool) -> (int, int):
+    # fetches only graphs and hosts whose checksums changed since the last caching and updates them in the cache
+    previous_checksums = data[CactiCache.CHECKSUMS]
+    changed_graph_ids = _get_changed(previous_checksums[CactiCache.GRAPHS], checksums[CactiCache.GRAPHS])
+    changed_host_ids = _get_changed(previous_checksums[CactiCache.HOSTS], checksums[CactiCache.HOSTS])
+    delta = cacher_.get_data(graph_ids=changed_graph_ids, host_ids=changed_host_ids)
+
+    hosts = data[CactiCache.HOSTS]
+    for host_id in changed_host_ids:
+        hosts.pop(host_id, None)
+    # keys become strings after the cache is stored as json
+    hosts.update({str(host_id): host for host_id, host in delta[CactiCache.HOSTS].items()})
+
+    _add_dimensions(delta[CactiCache.GRAPHS], hosts, add_graph_name_dimension)
+    cacti.repository.update_graphs(pipeline_.name, delta[CactiCache.GRAPHS], [int(id_) for id_ in changed_graph_ids])
+
+    if data.get(CactiCache.ADD_GRAPH_NAME_DIMENSION) != add_graph_name_dimension:
+        _update_dimensions(pipeline_, hosts, add_graph_name_dimension)
+    elif changed_host_ids:
+        # graph dimensions contain host properties, so they need to be updated if the host changed
+        _update_dimensions(pipeline_, hosts, add_graph_name_dimension, changed_host_ids)
+    return len(changed_graph_ids), len(changed_host_ids)
+
+
+def _get_changed(previous_checksums: dict, checksums: dict) -> list:
+    # ids that were added, changed or removed
+    return [
+        id_ for id_ in set(previous_checksums) | set(checksums)
+        if previous_checksums.get(id_) != checksums.get(id_)
+    ]
+
+
+def update_dimensions(pipeline_: Pipeline, cache: CactiCache, add_graph_name_dimension: bool):
+    _update_dimensions(pipeline_, cache.hosts, add_graph_name_dimension)
+    cache.data[CactiCache.ADD_GRAPH_NAME_DIMENSION] = add_graph_name_dimension
+    # data is a JSON column, in place changes are not tracked by sqlalchemy
+    flag_modified(cache, 'data')
+    cacti.repository.save_cacti_cache(cache)
+
+
+def _update_dimensions(pipeline_: Pipeline, hosts: dict, add_graph_name_dimension: bool,
+                       host_ids: Optional[list] = None):
+    for graph in cacti.repository.get_graphs(pipeline_, host_ids=host_ids):
+        _add_dimensions({graph.graph_id: graph.data}, hosts, add_graph_name_dimension)
+        flag_modified(graph, 'data')
+
+
+def _add_dimensions(graphs: dict, hosts: dict, add_graph_name_dimension: bool):
+    # host ids are integers in a freshly built cache and strings after it's loaded from json
+    hosts = {str(host_id): host for host_id, host in hosts.items()}
+    for graph in graphs.values():
+        for item in graph.get('items', {}).values():
+            item[CactiCache.DIMENSIONS] = cacti.dimensions.extract(item, graph, hosts, add_graph_name_dimension)
 
 
 def _new_expire(ttl_seconds: int) -> datetime:
@@ -1,139 +1,137 @@
 import os
-import re
-import rrdtool
-import tarfile
 
-from copy import deepcopy
-from typing import List, Optional
+from itertools import chain
+from types import MappingProxyType
+from typing import Iterable, Iterator, List, Optional
 from agent.data_extractor import cacti
+from agent.data_extractor.cacti.cacher import CactiCache
+from agent.data_extractor.cacti.metric import Metric
+from agent.data_extractor.cacti.planner import ExtractionPlan
 from agent.pipeline import Pipeline
 from agent import source
-from agent.modules import logger, tools
+from agent.modules import constants, logger
 
 logger_ = logger.get_logger(__name__)
 
+RRD_ENGINE_FETCH = 'fetch'
+RRD_ENGINE_XPORT = 'xport'
 
-def extract_metrics(pipeline_: Pipeline, start: str, end: str, step: str) -> list:
+
+def extract_metrics(pipeline_: Pipeline, start: str, end: str, step: str, graph_ids: Optional[List[int]] = None,
+                    cursor: int = 0, limit: Optional[int] = None) -> 'Metrics':
+    # the archive is extracted and graphs are looked up before returning, so these errors are raised right away.
+    # Graphs are read from the cache in batches, rrd files of a batch are fetched and its metrics built lazily
+    # as the caller consumes them, so only one batch is kept in memory. `cursor` and `limit` select a page
+    # of graph items, the page is planned and its files are fetched before returning to know the next cursor
     if pipeline_.source.RRD_ARCHIVE_PATH in pipeline_.source.config:
         _extract_rrd_archive(pipeline_)
 
-    cache = cacti.repository.get_cache(pipeline_)
-    if cache is None:
+    batches = _get_graphs(pipeline_, graph_ids)
+    if cursor or limit is not None:
+        plan = cacti.planner.build(chain.from_iterable(batches), _get_rrd_dir(pipeline_), cursor, limit)
+        return Metrics(_extract_plan(pipeline_, plan, start, end, step), plan.next_cursor)
+    return Metrics(_extract_batches(pipeline_, batches, start, end, step), None)
+
+
+def _extract_batches(pipeline_: Pipeline, batches: Iterable[List[dict]], start: str, end: str,
+                     step: str) -> Iterator[Metric]:
+    rrd_dir = _get_rrd_dir(pipeline_)
+    for graphs in batches:
+        yield from _extract_plan(pipeline_, cacti.planner.build(graphs, rrd_dir), start, end, step)
+
+
+def _extract_plan(pipeline_: Pipeline, plan: ExtractionPlan, start: str, end: str, step: str) -> Iterator[Metric]:
+    # files are fetched when it's called, metrics are built lazily
+    workers = pipeline_.config.get('rrd_fetch_workers', constants.CACTI_RRD_FETCH_WORKERS)
+    if pipeline_.config.get('rrd_engine', RRD_ENGINE_FETCH) == RRD_ENGINE_XPORT:
+        columns = cacti.xport.fetch_columns(
+            {path: list(data_source_names) for path, data_source_names in plan.files.items()},
+            start,
+            end,
+            step,
+            workers,
+        )
+    else:
+        fetched = cacti.fetcher.fetch_files(plan.files.keys(), start, end, step, workers)
+        columns = {}
+        for rrd_file_path, data_source_names in plan.files.items():
+            columns[rrd_file_path] = cacti.fetcher.extract_columns(
+                fetched.pop(rrd_file_path), data_source_names, start, end, step
+            )
+    return _build_metrics(plan, columns, pipeline_.config['convert_bytes_into_bits'])
+
+
+def _get_graphs(pipeline_: Pipeline, graph_ids: Optional[List[int]]) -> Iterable[List[dict]]:
+    # returns batches of graphs
+    add_graph_name_dimension = pipeline_.config['add_graph_name_dimension']
+    expires_at = cacti.repository.get_cache_expires_at(pipeline_)
+    if expires_at is None:
         raise Exception('Cacti cache does not exist')
-
-    metrics = []
-    for local_graph_id, graph in cache.graphs.items():
-        for item_id, item in graph['items'].items():
-            should_convert_to_bits = _should_convert_to_bits(item)
-            data_source_path = item['data_source_path']
-            if not data_source_path:
-                continue
-            if '<path_rra>/' not in data_source_path:
-                logger_.debug(f'Path {data_source_path} does not contain "<path_rra>/", skipping')
-                continue
-            rrd_file_path = data_source_path.replace('<path_rra>', _get_rrd_dir(pipeline_))
-            if not os.path.isfile(rrd_file_path):
-                logger_.debug(f'File {rrd_file_path} does not exist')
-                continue
-
-            base_metric = {
-                'target_type': 'gauge',
-                'properties': _extract_dimensions(item, graph, cache.hosts, pipeline_.config['add_graph_name_dimension']),
-            }
-
-            result = rrdtool.fetch(rrd_file_path, 'AVERAGE', ['-s', start, '-e', end, '-r', step])
-
-            # result[0][2] - is the closest available step to the step provided in the fetch command
-            # if they differ - skip the source as the desired step is not available for it
-            if result[0][2] != int(step):
-                continue
-
-            first_data_item_timestamp = result[0][0]
-            for name_idx, measurement_name in enumerate(result[1]):
-                if measurement_name != item['data_source_name']:
-                    continue
-                for row_idx, data in enumerate(result[2]):
-                    timestamp = int(first_data_item_timestamp) + row_idx * int(step)
-                    value = data[name_idx]
-
-                    # rrd might return a record for the timestamp earlier then start
-                    if timestamp < int(start):
-                        continue
-                    # skip values with timestamp end in order not to duplicate them
-                    if timestamp >= int(end):
-                        continue
-                    # value will be None if it's not available for the chosen consolidation function or timestamp
-                    if value is None:
-                        continue
-
-                    if should_convert_to_bits and pipeline_.config['convert_bytes_into_bits']:
-                        value *= 8
-
-                    metric = deepcopy(base_metric)
-                    metric['properties']['what'] = measurement_name.replace(".", "_").replace(" ", "_")
-                    metric['value'] = value
-                    metric['timestamp'] = timestamp
-                    metrics.append(metric)
-    return metrics
-
-
-def _extract_dimensions(item: dict, graph: dict, hosts: dict, add_graph_name_dimension=False) -> dict:
-    graph_title = graph['title']
-    host = _get_host(graph, hosts)
-
-    dimensions = _extract_title_dimensions(graph_title, graph, host)
-    if add_graph_name_dimension:
-        dimensions = _add_graph_name_dimension(dimensions, graph_title)
-    if 'host_description' not in dimensions and 'description' in host:
-        dimensions['host_description'] = host['description']
-    dimensions = {**dimensions, **_extract_item_dimensions(item)}
-
-    return tools.replace_illegal_chars(dimensions)
-
-
-def _add_graph_name_dimension(dimensions: dict, graph_title: str) -> dict:
-    for k, v in dimensions.items():
-        graph_title = graph_title.replace(f'|{k}|', v)
-    dimensions['graph_title'] = graph_title
-    return dimensions
-
-
-def _extract_title_dimensions(graph_title: str, graph: dict, host: dict) -> dict:
-    dimensions = {}
-    for var in _extract_dimension_names(graph_title):
-        value = _extract(var, graph.get('variables', {}), host)
-        if value is None or value == '':
+    # expires_at changes every time the cache is refreshed
+    version = (expires_at, add_graph_name_dimension)
+    graphs = cacti.lru.get(pipeline_.name, version)
+    if graphs is None:
+        cache = cacti.repository.get_cache(pipeline_)
+        if not cache.has_dimensions(add_graph_name_dimension):
+            # the pipeline config was changed after the cache had been built, dimensions are stored for the old config
+            cacti.cacher.update_dimensions(pipeline_, cache, add_graph_name_dimension)
+        if graph_ids is not None or cacti.lru.is_oversized(pipeline_.name, version):
+            # only the requested graphs are loaded, caches that don't fit the LRU are never loaded as a whole
+            return _stream_graphs(pipeline_, graph_ids)
+        graphs = _load_graphs(pipeline_, version)
+        if graphs is None:
+            return _stream_graphs(pipeline_)
+    if graph_ids is None:
+        return _chunks(list(graphs.values()))
+    return _chunks([graphs[graph_id] for graph_id in sorted(set(graph_ids)) if graph_id in graphs])
+
+
+def _load_graphs(pipeline_: Pipeline, version: tuple) -> Optional[dict]:
+    # loading stops as soon as the cache turns out to be larger than the LRU can keep
+    graphs = {}
+    size = 0
+    for batch in cacti.repository.get_graph_batches(pipeline_):
+        for graph_ in batch:
+            graphs[graph_.graph_id] = graph_.data
+            size += len(graph_.items)
+        if size > constants.CACTI_CACHE_LRU_MAX_ITEMS:
+            cacti.lru.mark_oversized(pipeline_.name, version)
+            return None
+    cacti.lru.put(pipeline_.name, version, graphs)
+    return graphs
+
+
+def _stream_graphs(pipeline_: Pipeline, graph_ids: Optional[List[int]] = None) -> Iterator[List[dict]]:
+    for batch in cacti.repository.get_graph_batches(pipeline_, graph_ids):
+        yield [graph_.data for graph_ in batch]
+
+
+def _chunks(graphs: List[dict]) -> Iterator[List[dict]]:
+    size = cacti.repository.GRAPHS_BATCH_SIZE
+    for i in range(0, len(graphs), size):
+        yield graphs[i:i + size]
+
+
+def _build_metrics(plan: ExtractionPlan, columns: dict, convert_bytes_into_bits: bool) -> Iterator[Metric]:
+    for rrd_file_path, graph, item in plan.items:
+        rows = columns[rrd_file_path].get(item['data_source_name'])
+        if not rows:
             continue
-        dimensions[var] = value
-    return tools.replace_illegal_chars(dimensions)
-
-
-def _get_host(graph, hosts):
-    # if the host_id is 0 it means the graph doesn't have a host and it will not be used later
-    return hosts[graph['host_id']] if graph['host_id'] != '0' else {}
-
 
-def _extract(variable: str, variables: dict, host: dict) -> Optional[str]:
-    if variable.startswith('host_'):
-        prefix = 'host_'
-        vars_ = host
-    elif variable.startswith('query_'):
-        prefix = 'query_'
-        vars_ = variables
-    else:
-        return None
-    var_name = variable.replace(prefix, '')
-    if var_name not in vars_:
-        return None
-    return vars_[var_name]
+        should_convert_to_bits = _should_convert_to_bits(item) and convert_bytes_into_bits
+        properties = MappingProxyType(item[CactiCache.DIMENSIONS])
+        what = item['data_source_name'].replace(".", "_").replace(" ", "_")
+        for timestamp, value in rows:
+            if should_convert_to_bits:
+                value *= 8
+            yield Metric(properties, what, value, timestamp)
 
 
 def _extract_rrd_archive(pipeline_: Pipeline):
     file_path = pipeline_.source.config[source.CactiSource.RRD_ARCHIVE_PATH]
     if not os.path.isfile(file_path):
         raise ArchiveNotExistsException()
-    with tarfile.open(file_path, "r:gz") as tar:
-        tar.extractall(path=_get_rrd_dir(pipeline_))
+    cacti.archive.extract(file_path, _get_rrd_dir(pipeline_))
 
 
 def _get_rrd_dir(pipeline_: Pipeline):
@@ -143,32 +141,6 @@ def _get_rrd_dir(pipeline_: Pipeline):
         return pipeline_.source.config[source.CactiSource.RRD_DIR_PATH]
 
 
-def _extract_dimension_names(name: str) -> List[str]:
-    # extract all values between `|`
-    return re.findall('\|([^|]+)\|', name)
-
-
-def _extract_item_dimensions(item: dict) -> dict:
-    dimensions = {}
-    item_title = item['item_title']
-    if 'variables' in item and item_title != '':
-        for dimension_name in _extract_dimension_names(item_title):
-            if not dimension_name.startswith('query'):
-                continue
-            dim_name = dimension_name.replace('query_', '')
-            if dim_name not in item['variables']:
-                continue
-            value = item['variables'][dim_name]
-            if value is None or value == '':
-                continue
-            dimensions[dimension_name] = value
-    if item_title != '':
-        for k, v in dimensions.items():
-            item_title = item_title.replace(f'|{k}|', v)
-        dimensions['item_title'] = item_title
-    return tools.replace_illegal_chars(dimensions)
-
-
 def _should_convert_to_bits(item: dict) -> bool:
     # the table cdef_items contains a list of functions that will be applied to a graph item
     # we need to find if there's a function that converts values to bits. We can find it out by checking two things:
@@ -192,5 +164,15 @@ def _should_convert_to_bits(item: dict) -> bool:
             contains_8 = False
 
 
+class Metrics:
+    def __init__(self, metrics: Iterator[Metric], next_cursor: Optional[int]):
+        self._metrics = metrics
+        # cursor of the next page of graph items, None if this is the last page
+        self.next_cursor = next_cursor
+
+    def __iter__(self) -> Iterator[Metric]:
+        return self._metrics
+
+
 class ArchiveNotExistsException(Exception):
     pass
@@ -0,0 +1,81 @@
+import re
+
+from typing import List, Optional
+from agent.modules import tools
+
+
+def extract(item: dict, graph: dict, hosts: dict, add_graph_name_dimension=False) -> dict:
+    graph_title = graph['title']
+    host = _get_host(graph, hosts)
+
+    dimensions = _extract_title_dimensions(graph_title, graph, host)
+    if add_graph_name_dimension:
+        dimensions = _add_graph_name_dimension(dimensions, graph_title)
+    if 'host_description' not in dimensions and 'description' in host:
+        dimensions['host_description'] = host['description']
+    dimensions = {**dimensions, **_extract_item_dimensions(item)}
+
+    return tools.replace_illegal_chars(dimensions)
+
+
+def _add_graph_name_dimension(dimensions: dict, graph_title: str) -> dict:
+    for k, v in dimensions.items():
+        graph_title = graph_title.replace(f'|{k}|', v)
+    dimensions['graph_title'] = graph_title
+    return dimensions
+
+
+def _extract_title_dimensions(graph_title: str, graph: dict, host: dict) -> dict:
+    dimensions = {}
+    for var in _extract_dimension_names(graph_title):
+        value = _extract(var, graph.get('variables', {}), host)
+        if value is None or value == '':
+            continue
+        dimensions[var] = value
+    return tools.replace_illegal_chars(dimensions)
+
+
+def _get_host(graph, hosts):
+    # if the host_id is 0 it means the graph doesn't have a host and it will not be used later
+    return hosts[graph['host_id']] if graph['host_id'] != '0' else {}
+
+
+def _extract(variable: str, variables: dict, host: dict) -> Optional[str]:
+    if variable.startswith('host_'):
+        prefix = 'host_'
+        vars_ = host
+    elif variable.startswith('query_'):
+        prefix = 'query_'
+        vars_ = variables
+    else:
+        return None
+    var_name = variable.replace(prefix, '')
+    if var_name not in vars_:
+        return None
+    return vars_[var_name]
+
+
+def _extract_dimension_names(name: str) -> List[str]:
+    # extract all values between `|`
+    return re.findall('\|([^|]+)\|', name)
+
+
+def _extract_item_dimensions(item: dict) -> dict:
+    dimensions = {}
+    item_title = item['item_title']
+    if 'variables' in item and item_title != '':
+        for dimension_name in _extract_dimension_names(item_title):
+            if not dimension_name.startswith('query'):
+                continue
+            dim_name = dimension_name.replace('query_', '')
+            if dim_name not in item['variables']:
+                continue
+            value = item['variables'][dim_name]
+            if value is None or value == '':
+                continue
+            dimensions[dimension_name] = value
+    if item_title != '':
+        for k, v in dimensions.items():
+            item_title = item_title.replace(f'|{k}|', v)
+        dimensions['item_title'] = item_title
+    return tools.replace_illegal_chars(dimensions)
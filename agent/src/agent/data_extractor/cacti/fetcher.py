@@ -0,0 +1,49 @@
+import rrdtool
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Tuple
+
+
+def fetch_files(rrd_file_paths: Iterable[str], start: str, end: str, step: str, workers: int = 1) -> dict:
+    # every file is fetched only once, results are returned as {rrd_file_path: rrdtool.fetch result}
+    # files are fetched in threads only if more than one worker is configured, the api worker is multithreaded
+    # and holds db connection pools so it must not be forked, and rrdtool.fetch spends most of the time reading files
+    args = [(path, start, end, step) for path in set(rrd_file_paths)]
+    if workers <= 1 or len(args) <= 1:
+        return dict(_fetch(*arg) for arg in args)
+    with ThreadPoolExecutor(min(workers, len(args))) as executor:
+        return dict(executor.map(lambda arg: _fetch(*arg), args))
+
+
+def extract_columns(result: tuple, data_source_names, start: str, end: str, step: str) -> dict:
+    # result[0][2] - is the closest available step to the step provided in the fetch command
+    # if they differ - skip the source as the desired step is not available for it
+    if result[0][2] != int(step):
+        return {}
+
+    first_data_item_timestamp = int(result[0][0])
+    columns = {}
+    for name_idx, measurement_name in enumerate(result[1]):
+        if measurement_name not in data_source_names:
+            continue
+        rows = []
+        for row_idx, data in enumerate(result[2]):
+            timestamp = first_data_item_timestamp + row_idx * int(step)
+            value = data[name_idx]
+
+            # rrd might return a record for the timestamp earlier then start
+            if timestamp < int(start):
+                continue
+            # skip values with timestamp end in order not to duplicate them
+            if timestamp >= int(end):
+                continue
+            # value will be None if it's not available for the chosen consolidation function or timestamp
+            if value is None:
+                continue
+            rows.append((timestamp, value))
+        columns[measurement_name] = rows
+    return columns
+
+
+def _fetch(rrd_file_path: str, start: str, end: str, step: str) -> Tuple[str, tuple]:
+    return rrd_file_path, rrdtool.fetch(rrd_file_path, 'AVERAGE', ['-s', start, '-e', end, '-r', step])
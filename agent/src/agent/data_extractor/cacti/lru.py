@@ -0,0 +1,80 @@
+import threading
+
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from agent import monitoring
+from agent.modules import constants
+
+# decoded graphs of Cacti caches kept in memory of the api worker, so extraction calls between cache refreshes
+# don't load and parse them from the db every time
+
+
+class _Entry(NamedTuple):
+    # the cache is reloaded if the version stored in the db is different
+    version: tuple
+    graphs: dict
+    size: int
+
+
+_entries = OrderedDict()
+_size = 0
+# pipeline_id -> version of caches that are larger than the max size, they are streamed from the db instead
+_oversized = {}
+_lock = threading.Lock()
+
+
+def get(pipeline_id: str, version: tuple) -> Optional[dict]:
+    with _lock:
+        entry = _entries.get(pipeline_id)
+        if entry is None or entry.version != version:
+            monitoring.metrics.CACTI_CACHE_LRU_MISSES.labels(pipeline_id).inc()
+            return None
+        _entries.move_to_end(pipeline_id)
+    monitoring.metrics.CACTI_CACHE_LRU_HITS.labels(pipeline_id).inc()
+    return entry.graphs
+
+
+def put(pipeline_id: str, version: tuple, graphs: dict, max_size: int = None):
+    global _size
+    if max_size is None:
+        max_size = constants.CACTI_CACHE_LRU_MAX_ITEMS
+    # the memory used by a cache is bound by the number of graph items as they make up most of it
+    size = sum(len(graph.get('items', {})) for graph in graphs.values())
+    with _lock:
+        _remove(pipeline_id)
+        if size > max_size:
+            _oversized[pipeline_id] = version
+            return
+        _oversized.pop(pipeline_id, None)
+        _entries[pipeline_id] = _Entry(version, graphs, size)
+        _size += size
+        while _size > max_size:
+            evicted_pipeline_id = next(iter(_entries))
+            _remove(evicted_pipeline_id)
+            monitoring.metrics.CACTI_CACHE_LRU_EVICTIONS.labels(evicted_pipeline_id).inc()
+
+
+def mark_oversized(pipeline_id: str, version: tuple):
+    with _lock:
+        _remove(pipeline_id)
+        _oversized[pipeline_id] = version
+
+
+def is_oversized(pipeline_id: str, version: tuple) -> bool:
+    with _lock:
+        return _oversized.get(pipeline_id) == version
+
+
+def clear():
+    global _size
+    with _lock:
+        _entries.clear()
+        _oversized.clear()
+        _size = 0
+
+
+def _remove(pipeline_id: str):
+    global _size
+    entry = _entries.pop(pipeline_id, None)
+    if entry is not None:
+        _size -= entry.size
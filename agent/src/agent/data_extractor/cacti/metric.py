@@ -0,0 +1,18 @@
+from typing import Mapping, NamedTuple
+
+
+class Metric(NamedTuple):
+    # properties are shared between all metrics of one graph item and must not be modified,
+    # the metric dict is built only when it's serialized
+    properties: Mapping[str, str]
+    what: str
+    value: float
+    timestamp: int
+
+    def to_dict(self) -> dict:
+        return {
+            'target_type': 'gauge',
+            'properties': {**self.properties, 'what': self.what},
+            'value': self.value,
+            'timestamp': self.timestamp,
+        }
@@ -0,0 +1,52 @@
+import os
+
+from typing import Dict, Iterable, List, Optional, Tuple
+from agent.modules import logger
+
+logger_ = logger.get_logger(__name__)
+
+
+class ExtractionPlan:
+    def __init__(self):
+        # rrd_file_path -> data_source_name -> [(graph, item)], every file needs to be fetched only once
+        # and every data source column in it parsed once no matter how many graph items use it
+        self.files: Dict[str, Dict[str, List[Tuple[dict, dict]]]] = {}
+        # (rrd_file_path, graph, item) in the order they are stored in the cache, metrics are built in this order
+        self.items: List[Tuple[str, dict, dict]] = []
+        # position of the first item of the next page, None if the plan contains the last item
+        self.next_cursor: Optional[int] = None
+
+    def add(self, rrd_file_path: str, graph: dict, item: dict):
+        self.files\
+            .setdefault(rrd_file_path, {})\
+            .setdefault(item['data_source_name'], [])\
+            .append((graph, item))
+        self.items.append((rrd_file_path, graph, item))
+
+
+def build(graphs: Iterable[dict], rrd_dir: str, cursor: int = 0, limit: Optional[int] = None) -> ExtractionPlan:
+    # `cursor` and `limit` select a page of items that have an rrd file, items outside of the page are skipped
+    # before anything is fetched for them
+    plan = ExtractionPlan()
+    position = 0
+    for graph in graphs:
+        for item_id, item in graph.get('items', {}).items():
+            data_source_path = item['data_source_path']
+            if not data_source_path:
+                continue
+            if '<path_rra>/' not in data_source_path:
+                logger_.debug(f'Path {data_source_path} does not contain "<path_rra>/", skipping')
+                continue
+            rrd_file_path = data_source_path.replace('<path_rra>', rrd_dir)
+            if rrd_file_path not in plan.files and not os.path.isfile(rrd_file_path):
+                logger_.debug(f'File {rrd_file_path} does not exist')
+                continue
+            if position < cursor:
+                position += 1
+                continue
+            if limit is not None and position == cursor + limit:
+                plan.next_cursor = position
+                return plan
+            plan.add(rrd_file_path, graph, item)
+            position += 1
+    return plan
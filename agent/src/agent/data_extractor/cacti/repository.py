@@ -1,11 +1,18 @@
-from typing import Optional
+import json
+import zlib
+
+from datetime import datetime
+from typing import Optional, List, Iterator
 from agent import source
-from agent.data_extractor.cacti.cacher import CactiCache
+from agent.data_extractor.cacti.cacher import CactiCache, CactiCacheGraph
 from agent.modules import db as agent_db
 from agent.pipeline import Pipeline
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, scoped_session
 
+GRAPHS_BATCH_SIZE = 1000
+
 
 def _get_session(connection_string: str):
     return scoped_session(sessionmaker(bind=create_engine(connection_string)))
@@ -17,6 +24,72 @@ def get_cache(pipeline_: Pipeline) -> Optional[CactiCache]:
             .filter(CactiCache.pipeline_id == pipeline_.name).first()
 
 
+def get_cache_expires_at(pipeline_: Pipeline) -> Optional[datetime]:
+    # only the expiration time is selected so the cache data isn't loaded and parsed
+    return agent_db.Session\
+        .query(CactiCache.expires_at)\
+        .filter(CactiCache.pipeline_id == pipeline_.name).scalar()
+
+
+def get_graphs(pipeline_: Pipeline, graph_ids: Optional[List[int]] = None,
+               host_ids: Optional[List[str]] = None) -> Iterator[CactiCacheGraph]:
+    query = agent_db.Session\
+        .query(CactiCacheGraph)\
+        .filter(CactiCacheGraph.pipeline_id == pipeline_.name)
+    if graph_ids is not None:
+        query = query.filter(CactiCacheGraph.graph_id.in_(graph_ids))
+    if host_ids is not None:
+        query = query.filter(CactiCacheGraph.host_id.in_(host_ids))
+    # graphs are loaded from the db in batches instead of all at once
+    return query.order_by(CactiCacheGraph.graph_id).yield_per(GRAPHS_BATCH_SIZE)
+
+
+def get_graph_batches(pipeline_: Pipeline, graph_ids: Optional[List[int]] = None) -> Iterator[List[CactiCacheGraph]]:
+    # graphs of a batch are removed from the session once the next batch is requested,
+    # so the session doesn't keep all graphs that were read
+    batch = []
+    for graph_ in get_graphs(pipeline_, graph_ids):
+        batch.append(graph_)
+        if len(batch) == GRAPHS_BATCH_SIZE:
+            yield batch
+            _expunge(batch)
+            batch = []
+    if batch:
+        yield batch
+        _expunge(batch)
+
+
+def _expunge(graphs: List[CactiCacheGraph]):
+    for graph_ in graphs:
+        agent_db.Session.expunge(graph_)
+
+
+def replace_graphs(pipeline_id: str, graphs: dict):
+    # changes are committed by save_cacti_cache
+    agent_db.Session.query(CactiCacheGraph).filter(CactiCacheGraph.pipeline_id == pipeline_id).delete()
+    _add_graphs(pipeline_id, graphs)
+
+
+def update_graphs(pipeline_id: str, graphs: dict, changed_graph_ids: List[int]):
+    # changed graphs are deleted and the ones that still exist in Cacti are added again,
+    # changes are committed by save_cacti_cache
+    if changed_graph_ids:
+        agent_db.Session.query(CactiCacheGraph).filter(
+            CactiCacheGraph.pipeline_id == pipeline_id,
+            CactiCacheGraph.graph_id.in_(changed_graph_ids)
+        ).delete(synchronize_session=False)
+    _add_graphs(pipeline_id, graphs)
+
+
+def _add_graphs(pipeline_id: str, graphs: dict):
+    agent_db.Session.add_all([CactiCacheGraph(pipeline_id, int(graph_id), graph) for graph_id, graph in graphs.items()])
+
+
+def create_cacti_engine(connection_string: str, pool_size: int) -> Engine:
+    # the engine is shared by all pipelines that use the same Cacti db, they are refreshed by at most pool_size workers
+    return create_engine(connection_string, pool_size=pool_size, max_overflow=0, pool_pre_ping=True)
+
+
 def save_cacti_cache(source_cache: CactiCache):
     if not agent_db.Session.object_session(source_cache):
         agent_db.Session.add(source_cache)
@@ -24,18 +97,67 @@ def save_cacti_cache(source_cache: CactiCache):
 
 
 class CactiCacher:
-    def __init__(self, pipeline_: Pipeline):
-        mysql_connection_string = pipeline_.source.config[source.CactiSource.MYSQL_CONNECTION_STRING]
-        self.session = scoped_session(sessionmaker(bind=create_engine(mysql_connection_string)))
+    def __init__(self, pipeline_: Pipeline, engine: Optional[Engine] = None):
+        # a shared engine is disposed by the one who created it, otherwise the cacher creates and disposes its own
+        self.own_engine = engine is None
+        if engine is None:
+            engine = create_engine(pipeline_.source.config[source.CactiSource.MYSQL_CONNECTION_STRING])
+        self.engine = engine
+        self.session = scoped_session(sessionmaker(bind=engine))
         self.pipeline = pipeline_
         self.graphs = {}
         self.hosts = {}
-        self._get_graph_items()
-        self._get_graph_titles()
-        self._get_graph_variables()
-        self._get_items_variables()
-        self._get_hosts()
-        self._get_item_cdef_items()
+        # if set, only these graphs are fetched, it's used to fetch graphs that changed since the last caching
+        self.graph_ids = None
+
+    def close(self):
+        # returns the connection to the pool
+        self.session.remove()
+        if self.own_engine:
+            self.engine.dispose()
+
+    def get_data(self, graph_ids: Optional[list] = None, host_ids: Optional[list] = None) -> dict:
+        self.graphs = {}
+        self.hosts = {}
+        self.graph_ids = graph_ids
+        if graph_ids is None or graph_ids:
+            self._get_graph_items()
+            self._get_graph_titles()
+            self._get_graph_variables()
+            self._get_items_variables()
+            self._get_item_cdef_items()
+        if host_ids is None or host_ids:
+            self._get_hosts(host_ids)
+        return {
+            'hosts': self.hosts,
+            'graphs': self.graphs,
+        }
+
+    def get_checksums(self) -> dict:
+        # a checksum of every part of the graph data, the queries are the same as the ones that fetch the data
+        # but the result is aggregated by the graph, so it's much smaller
+        self.graph_ids = None
+        graphs = {}
+        for part, query in [
+            ('items', self._graph_items_checksum_query()),
+            ('title', self._graph_titles_checksum_query()),
+            ('variables', self._graph_variables_checksum_query()),
+            ('items_variables', self._items_variables_checksum_query()),
+            ('cdef_items', self._item_cdef_items_checksum_query()),
+        ]:
+            for row in self.session.execute(query):
+                graphs.setdefault(str(row['local_graph_id']), {})[part] = int(row['checksum'] or 0)
+        hosts = {}
+        for row in self.session.execute(self._hosts_checksum_query()):
+            hosts[str(row['id'])] = int(row['checksum'] or 0)
+        return {
+            # graphs without items are not cached
+            'graphs': {
+                graph_id: zlib.crc32(json.dumps(parts, sort_keys=True).encode())
+                for graph_id, parts in graphs.items() if 'items' in parts
+            },
+            'hosts': hosts,
+        }
 
     def _get_graph_titles(self):
         res = self.session.execute(f"""
@@ -119,11 +241,12 @@ class CactiCacher:
             self.graphs[local_graph_id]['items'][item_id]['host_id'] = str(row['host_id'])
             self.graphs[local_graph_id]['items'][item_id]['variables'][row['field_name']] = row['field_value']
 
-    def _get_hosts(self):
-        res = self.session.execute("""
+    def _get_hosts(self, host_ids: Optional[list] = None):
+        res = self.session.execute(f"""
             SELECT id, description, hostname, snmp_community, snmp_version, snmp_username, snmp_password, snmp_auth_protocol,
              snmp_priv_passphrase, snmp_context, snmp_port, snmp_timeout, ping_retries, max_oids
             FROM host
+            {self._filter_by_host_ids(host_ids)}
         """)
         for row in res:
             self.hosts[row['id']] = dict(row)
@@ -149,14 +272,85 @@ class CactiCacher:
                 item['cdef_items'] = {}
             item['cdef_items'][row['sequence']] = row['value']
 
+    def _graph_items_checksum_query(self) -> str:
+        return f"""
+            SELECT gti.local_graph_id,
+             SUM(CRC32(CONCAT_WS('|', gti.id, dtr.data_source_name, gti.text_format, dtd.data_source_path))) AS checksum
+            FROM graph_templates_item gti
+            JOIN graph_templates_graph gtg on gti.local_graph_id = gtg.local_graph_id
+            JOIN data_template_rrd dtr on dtr.id = gti.task_item_id
+            JOIN data_template_data dtd on dtd.local_data_id = dtr.local_data_id
+            WHERE gtg.local_graph_id != 0
+            AND gti.graph_type_id IN (4, 5, 6, 7 ,8)
+            AND dtd.data_source_path IS NOT NULL
+            {self._filter_by_graph_ids('gti.local_graph_id')}
+            GROUP BY gti.local_graph_id
+        """
+
+    def _graph_titles_checksum_query(self) -> str:
+        return f"""
+            SELECT gtg.local_graph_id, SUM(CRC32(CONCAT_WS('|', gtg.title, gl.host_id))) AS checksum
+            FROM graph_templates_graph gtg
+            JOIN graph_local gl ON gtg.local_graph_id = gl.id
+            WHERE local_graph_id != 0 {self._filter_by_graph_ids('gtg.local_graph_id')}
+            GROUP BY gtg.local_graph_id
+        """
+
+    def _graph_variables_checksum_query(self) -> str:
+        return f"""
+            SELECT gl.id AS local_graph_id, SUM(CRC32(CONCAT_WS('|', field_name, field_value))) AS checksum
+            FROM host_snmp_cache hsc FORCE INDEX (`PRIMARY`)
+            JOIN graph_local gl
+            ON gl.host_id = hsc.host_id
+            AND gl.snmp_index = hsc.snmp_index
+            AND gl.snmp_query_id = hsc.snmp_query_id
+            WHERE 1 {self._filter_by_graph_ids('gl.id')}
+            GROUP BY gl.id
+        """
+
+    def _items_variables_checksum_query(self) -> str:
+        return f"""
+            SELECT gti.local_graph_id,
+             SUM(CRC32(CONCAT_WS('|', gti.id, hsc.field_name, hsc.field_value, hsc.host_id))) AS checksum
+            FROM graph_templates_item AS gti
+                JOIN data_template_rrd AS dtr ON gti.task_item_id = dtr.id
+                JOIN data_local AS dl ON dl.id = dtr.local_data_id
+                JOIN host_snmp_cache hsc FORCE INDEX (`PRIMARY`)
+            WHERE hsc.host_id = dl.host_id
+            AND hsc.snmp_query_id = dl.snmp_query_id
+            AND hsc.snmp_index = dl.snmp_index
+            {self._filter_by_graph_ids('gti.local_graph_id')}
+            GROUP BY gti.local_graph_id
+        """
+
+    def _item_cdef_items_checksum_query(self) -> str:
+        return f"""
+            SELECT gti.local_graph_id, SUM(CRC32(CONCAT_WS('|', gti.id, ci.sequence, ci.value))) AS checksum
+            FROM cdef_items ci
+            JOIN graph_templates_item gti on gti.cdef_id = ci.cdef_id
+            WHERE gti.cdef_id != 0
+            AND gti.local_graph_id != 0
+            {self._filter_by_graph_ids('gti.local_graph_id')}
+            GROUP BY gti.local_graph_id
+        """
+
+    @staticmethod
+    def _hosts_checksum_query() -> str:
+        return """
+            SELECT id, CRC32(CONCAT_WS('|', description, hostname, snmp_community, snmp_version, snmp_username,
+             snmp_password, snmp_auth_protocol, snmp_priv_passphrase, snmp_context, snmp_port, snmp_timeout,
+             ping_retries, max_oids)) AS checksum
+            FROM host
+        """
+
     def _filter_by_graph_ids(self, field_name):
-        graph_ids = self.pipeline.config.get('graph_ids')
+        graph_ids = self.graph_ids if self.graph_ids is not None else self.pipeline.config.get('graph_ids')
         if not graph_ids:
             return ''
         return f'AND {field_name} in ({",".join(graph_ids)})'
 
-    def get_data(self) -> dict:
-        return {
-            'hosts': self.hosts,
-            'graphs': self.graphs,
-        }
+    @staticmethod
+    def _filter_by_host_ids(host_ids: Optional[list]):
+        if not host_ids:
+            return ''
+        return f'WHERE id in ({",".join(host_ids)})'
@@ -0,0 +1,97 @@
+import rrdtool
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+from agent.data_extractor import cacti
+from agent.modules import logger
+
+logger_ = logger.get_logger(__name__)
+
+# number of rrd files exported with one rrdtool.xport call
+BATCH_SIZE = 100
+
+# (rrd_file_path, [data_source_name])
+Batch = List[Tuple[str, List[str]]]
+
+
+def fetch_columns(files: Dict[str, List[str]], start: str, end: str, step: str, workers: int = 1) -> dict:
+    # files are {rrd_file_path: [data_source_name]}, data sources of many files are exported with one call,
+    # returns {rrd_file_path: {data_source_name: [(timestamp, value)]}} the same way as columns of rrdtool.fetch results
+    paths = list(files)
+    args = [
+        ([(path, files[path]) for path in paths[i:i + BATCH_SIZE]], start, end, step)
+        for i in range(0, len(paths), BATCH_SIZE)
+    ]
+    if workers <= 1 or len(args) <= 1:
+        results = [_export(*arg) for arg in args]
+    else:
+        # batches are exported in threads the same way as files are fetched by the fetch engine
+        with ThreadPoolExecutor(min(workers, len(args))) as executor:
+            results = list(executor.map(lambda arg: _export(*arg), args))
+    columns = {}
+    for result in results:
+        columns.update(result)
+    return columns
+
+
+def _export(batch: Batch, start: str, end: str, step: str) -> dict:
+    if len(batch) == 1:
+        # a single file is fetched the same way as by the fetch engine, so files that don't have the desired step
+        # or the data source are skipped instead of failing the whole export
+        path, data_source_names = batch[0]
+        return {path: cacti.fetcher.extract_columns(
+            rrdtool.fetch(path, 'AVERAGE', ['-s', start, '-e', end, '-r', step]),
+            set(data_source_names), start, end, step,
+        )}
+    try:
+        result = rrdtool.xport(*_get_xport_args(batch, start, end, step))
+    except rrdtool.OperationalError as e:
+        logger_.debug(f'Failed to export a batch of rrd files, exporting them one by one: {str(e)}')
+        result = None
+    # xport consolidates all data sources to the coarsest step among them, if it's not the desired one
+    # files are exported separately to find the ones that don't have it
+    if result is None or result['meta']['step'] != int(step):
+        columns = {}
+        for file in batch:
+            columns.update(_export([file], start, end, step))
+        return columns
+    return _extract_columns(batch, result, start, end)
+
+
+def _get_xport_args(batch: Batch, start: str, end: str, step: str) -> list:
+    # xport returns 400 rows at most by default and increases the step if there are more
+    args = ['--start', start, '--end', end, '--step', step, '--maxrows', str((int(end) - int(start)) // int(step) + 2)]
+    idx = 0
+    for path, data_source_names in batch:
+        for name in data_source_names:
+            args.append(f'DEF:v{idx}={_escape(path)}:{name}:AVERAGE')
+            args.append(f'XPORT:v{idx}')
+            idx += 1
+    return args
+
+
+def _escape(path: str) -> str:
+    # colons separate DEF fields
+    return path.replace(':', '\\:')
+
+
+def _extract_columns(batch: Batch, result: dict, start: str, end: str) -> dict:
+    rows = result['data']
+    first_timestamp = int(result['meta']['start'])
+    step = int(result['meta']['step'])
+    # rows are transposed once, so every column is filtered as a whole instead of indexing into every row
+    values = list(zip(*rows)) or [()] * sum(len(names) for _, names in batch)
+    timestamps = [first_timestamp + row_idx * step for row_idx in range(len(rows))]
+    # rrd might return records earlier than start, records with timestamp end are skipped not to duplicate them
+    row_indexes = [row_idx for row_idx, timestamp in enumerate(timestamps) if int(start) <= timestamp < int(end)]
+
+    columns = {}
+    column_idx = 0
+    for path, data_source_names in batch:
+        columns[path] = {}
+        for name in data_source_names:
+            column = values[column_idx]
+            # value is None if it's not available for the timestamp
+            columns[path][name] = [(timestamps[i], column[i]) for i in row_indexes if column[i] is not None]
+            column_idx += 1
+    return columns
@@ -28,3 +28,22 @@ MONITORING_SEND_TO_CLIENT = True if os.environ.get('MONITORING_SEND_TO_CLIENT',
 MONITORING_SEND_TO_ANODOT = True if os.environ.get('MONITORING_SEND_TO_ANODOT', 'true') == 'true' else False
 
 AGENT_MONITORING_ENDPOINT = os.environ.get('AGENT_MONITORING_ENDPOINT', 'http://localhost/monitoring')
+# seconds between collections of StreamSets metrics by the background collector of an api worker
+MONITORING_COLLECT_INTERVAL = int(os.environ.get('MONITORING_COLLECT_INTERVAL', 30))
+# max number of concurrent jmx requests to one StreamSets instance
+MONITORING_JMX_WORKERS_PER_STREAMSETS = int(os.environ.get('MONITORING_JMX_WORKERS_PER_STREAMSETS', 4))
+# max number of samples in one request with monitoring data to anodot
+MONITORING_SEND_CHUNK_SIZE = int(os.environ.get('MONITORING_SEND_CHUNK_SIZE', 1000))
+MONITORING_SEND_GZIP = True if os.environ.get('MONITORING_SEND_GZIP', 'true') == 'true' else False
+# max number of failed requests with monitoring data that are kept to be sent again with the next data
+MONITORING_RETRY_QUEUE_SIZE = int(os.environ.get('MONITORING_RETRY_QUEUE_SIZE', 50))
+# gauges are sent only if their value changed since they were sent last time, counters are always sent
+MONITORING_SEND_CHANGED_GAUGES_ONLY = \
+    True if os.environ.get('MONITORING_SEND_CHANGED_GAUGES_ONLY', 'false') == 'true' else False
+
+# number of threads that fetch rrd files of one Cacti extraction request, files are fetched sequentially by default
+CACTI_RRD_FETCH_WORKERS = int(os.environ.get('CACTI_RRD_FETCH_WORKERS', 1))
+# number of Cacti pipelines whose caches are refreshed concurrently
+CACTI_CACHE_REFRESH_WORKERS = int(os.environ.get('CACTI_CACHE_REFRESH_WORKERS', 4))
+# max number of graph items of decoded Cacti caches that every api worker keeps in memory
+CACTI_CACHE_LRU_MAX_ITEMS = int(os.environ.get('CACTI_CACHE_LRU_MAX_ITEMS', 500000))
@@ -1,14 +1,41 @@
 import requests
 
+from requests.adapters import HTTPAdapter
+
+# messages of Zabbix API errors returned when the auth token expired or was invalidated
+SESSION_EXPIRED_ERRORS = ['Session terminated', 'Not authorised', 'Not authorized']
+
 
 class Client:
-    def __init__(self, url: str, user: str, password: str):
+    def __init__(self, url: str, user: str, password: str, pool_size: int = 1):
         self.url = url + '/api_jsonrpc.php'
+        self.user = user
+        self.password = password
         self.auth_token = None
-        self._authenticate(user, password)
+        # connections are kept alive and reused by all requests of the client
+        self.session = requests.Session()
+        self.session.mount(self.url, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({
+            'Content-Type': 'application/json-rpc',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+        self._authenticate()
 
     def post(self, method: str, params: dict) -> list:
-        res = requests.post(self.url, json={
+        try:
+            return self._post(method, params)
+        except ZabbixSessionExpiredException:
+            if method == 'user.login':
+                raise
+            self._authenticate()
+            return self._post(method, params)
+
+    def close(self):
+        self.session.close()
+
+    def _post(self, method: str, params: dict) -> list:
+        res = self.session.post(self.url, json={
             'jsonrpc': '2.0',
             'method': method,
             'params': params,
@@ -18,12 +45,24 @@ class Client:
         res.raise_for_status()
         result = res.json()
         if 'error' in result:
+            if _is_session_expired(result['error']):
+                raise ZabbixSessionExpiredException(str(result))
             raise ZabbixClientException(str(result))
         return result['result']
 
-    def _authenticate(self, user: str, password: str):
-        self.auth_token = self.post('user.login', {'user': user, 'password': password})
+    def _authenticate(self):
+        self.auth_token = None
+        self.auth_token = self.post('user.login', {'user': self.user, 'password': self.password})
+
+
+def _is_session_expired(error: dict) -> bool:
+    message = str(error.get('data', '')) + str(error.get('message', ''))
+    return any(e in message for e in SESSION_EXPIRED_ERRORS)
 
 
 class ZabbixClientException(Exception):
     pass
+
+
+class ZabbixSessionExpiredException(ZabbixClientException):
+    pass
@@ -1,7 +1,7 @@
 import anodot
 import requests
 
-from . import metrics, streamsets
+from . import metrics, streamsets, collector, sender
 from agent.modules import constants, logger
 from datetime import datetime
 
@@ -9,21 +9,24 @@ logger_ = logger.get_logger(__name__)
 
 
 def pull_latest():
-    streamsets.pull_metrics()
+    # metrics are pulled from StreamSets by the background collector, the last collected values are served
+    collector.start()
+    collector.set_snapshot_age()
 
 
 def latest_to_anodot():
     pull_latest()
 
     data = []
-    for metric in metrics.registry.collect():
+    now = datetime.utcnow()
+    for metric in metrics.get_registry().collect():
         target_type = anodot.TargetType.COUNTER if metric.type == 'counter' else anodot.TargetType.GAUGE
         for sample in metric.samples:
 
             if sample.name.endswith('_created'):
                 continue
             dims = {**sample.labels, 'host_name': constants.HOSTNAME, 'source': 'agent_monitoring'}
-            data.append(anodot.Metric20(sample.name, sample.value, target_type, datetime.utcnow(),
+            data.append(anodot.Metric20(sample.name, sample.value, target_type, now,
                                         dimensions=dims).to_dict())
 
     return data
@@ -37,3 +40,8 @@ def increase_scheduled_script_error_counter(script_name):
 def set_scheduled_script_execution_time(script_name, duration):
     url = constants.AGENT_MONITORING_ENDPOINT + '/scheduled_script_execution_time/' + script_name
     requests.post(url, json={'duration': duration}).raise_for_status()
+
+
+def set_cacti_cache_refresh_stats(pipeline_id: str, duration: float, graphs: int, hosts: int, full: bool):
+    url = constants.AGENT_MONITORING_ENDPOINT + '/cacti_cache_refresh/' + pipeline_id
+    requests.post(url, json={'duration': duration, 'graphs': graphs, 'hosts': hosts, 'full': full}).raise_for_status()
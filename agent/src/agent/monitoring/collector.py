@@ -0,0 +1,97 @@
+import fcntl
+import os
+import threading
+import time
+import traceback
+
+from agent.modules import constants, logger
+from agent.modules import db as agent_db
+from agent.monitoring import metrics, streamsets
+
+logger_ = logger.get_logger(__name__)
+
+# StreamSets metrics are collected by a background thread of the api worker, requests to /metrics and /monitoring
+# serve the last collected values right away instead of waiting for jmx of every pipeline.
+# In multiprocess mode every worker runs the thread but only the one that holds the lock file collects,
+# another worker takes over if it exits
+
+_thread = None
+_lock = threading.Lock()
+_lock_file = None
+# until the first collection finishes the age is counted from the start of the collector
+_collected_at = time.time()
+
+
+def start():
+    # the thread is started by the first request because threads started before uwsgi forks workers don't run in them
+    global _thread, _collected_at
+    with _lock:
+        if _thread is not None and _thread.is_alive():
+            return
+        _collected_at = time.time()
+        _thread = threading.Thread(target=_run, name='monitoring_collector', daemon=True)
+        _thread.start()
+
+
+def set_snapshot_age():
+    metrics.set_gauge(metrics.MONITORING_SNAPSHOT_AGE, time.time() - _get_collected_at())
+
+
+def collect():
+    global _collected_at
+    start_time = time.time()
+    try:
+        streamsets.pull_metrics()
+    finally:
+        agent_db.Session.remove()
+    _collected_at = time.time()
+    metrics.set_gauge(metrics.MONITORING_COLLECTION_DURATION, _collected_at - start_time)
+    if metrics.MULTIPROCESS:
+        _save_collected_at(_collected_at)
+
+
+def _run():
+    while True:
+        start_time = time.time()
+        try:
+            if _is_collecting_process():
+                collect()
+        except Exception:
+            logger_.error(traceback.format_exc())
+        time.sleep(max(0.0, constants.MONITORING_COLLECT_INTERVAL - (time.time() - start_time)))
+
+
+def _is_collecting_process() -> bool:
+    global _lock_file
+    if not metrics.MULTIPROCESS or _lock_file is not None:
+        return True
+    lock_file = open(_get_path('collector.lock'), 'w')
+    try:
+        # the lock is released by the os when the process exits
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    _lock_file = lock_file
+    return True
+
+
+def _get_path(name: str) -> str:
+    return os.path.join(os.environ['prometheus_multiproc_dir'], name)
+
+
+def _save_collected_at(collected_at: float):
+    path = _get_path('collected_at')
+    with open(f'{path}.tmp', 'w') as f:
+        f.write(str(collected_at))
+    os.replace(f'{path}.tmp', path)
+
+
+def _get_collected_at() -> float:
+    if not metrics.MULTIPROCESS:
+        return _collected_at
+    try:
+        with open(_get_path('collected_at')) as f:
+            return float(f.read())
+    except (OSError, ValueError):
+        return _collected_at
@@ -1,40 +1,94 @@
-from prometheus_client import Info, Gauge, Enum, Counter, CollectorRegistry
+import glob
+import os
+import time
+
+from typing import Dict, List
+from prometheus_client import Info, Gauge, Counter, CollectorRegistry, multiprocess
+from prometheus_client.metrics_core import Metric
 from agent import version
 from agent.pipeline import Pipeline
 
+# the api runs in several uwsgi workers, if prometheus_multiproc_dir is set every process writes its metrics to files
+# in that directory and metrics of all processes are merged when they're served. Counters are summed, every process
+# keeps its own value of a gauge and the value that was set last is served
+MULTIPROCESS = 'prometheus_multiproc_dir' in os.environ
+
+PIPELINE_LABELS = ['streamsets_url', 'pipeline_id', 'pipeline_type']
+
 registry = CollectorRegistry()
+# {gauge: gauge with the time its values were set}, the time is used to find the last value in multiprocess mode
+_updated = {}
+_last_value_gauges = set()
+
+
+def _gauge(name: str, documentation: str, labelnames: List[str] = ()) -> Gauge:
+    gauge = Gauge(name, documentation, labelnames, registry=registry, multiprocess_mode='all')
+    _updated[gauge] = Gauge(f'{name}_updated', f'Time {name} was set', labelnames, multiprocess_mode='all',
+                            registry=None)
+    _last_value_gauges.add(name)
+    return gauge
+
 
 VERSION = Info('version', 'Agent version', registry=registry)
 VERSION.info({'version': version.__version__})
 
-STREAMSETS_CPU = Gauge('streamsets_cpu', 'Streamsets CPU utilization', ['streamsets_url'], registry=registry)
-STREAMSETS_HEAP_MEMORY = Gauge('streamsets_heap_memory_used_bytes', 'Streamsets Heap memory utilization',
-                               ['streamsets_url'], registry=registry)
-STREAMSETS_NON_HEAP_MEMORY = Gauge('streamsets_non_heap_memory_used_bytes', 'Streamsets Non-heap memory utilization',
-                                   ['streamsets_url'], registry=registry)
-
-PIPELINE_INCOMING_RECORDS = Counter('pipeline_incoming_records', 'Pipeline incoming records',
-                                    ['streamsets_url', 'pipeline_id', 'pipeline_type'], registry=registry)
-PIPELINE_OUTGOING_RECORDS = Counter('pipeline_outgoing_records', 'Pipeline outgoing records',
-                                    ['streamsets_url', 'pipeline_id', 'pipeline_type'], registry=registry)
-PIPELINE_ERROR_RECORDS = Counter('pipeline_error_records', 'Pipeline error records',
-                                 ['streamsets_url', 'pipeline_id', 'pipeline_type'], registry=registry)
-PIPELINE_DESTINATION_LATENCY = Gauge('pipeline_destination_latency_seconds', 'Pipeline destination latency',
-                                     ['streamsets_url', 'pipeline_id', 'pipeline_type'], registry=registry)
-PIPELINE_SOURCE_LATENCY = Gauge('pipeline_source_latency_seconds', 'Pipeline source latency',
-                                ['streamsets_url', 'pipeline_id', 'pipeline_type'], registry=registry)
-
-PIPELINE_STATUS = Enum('pipeline_status', 'Pipeline status', ['streamsets_url', 'pipeline_id', 'pipeline_type'],
-                       states=Pipeline.statuses, registry=registry)
-
-KAFKA_CONSUMER_LAG = Gauge('kafka_consumer_lag', 'Kafka consumer lag', ['topic'], registry=registry)
-
-SOURCE_HTTP_ERRORS = Counter('source_http_errors', 'Source HTTP errors',
-                             ['streamsets_url', 'pipeline_id', 'pipeline_type', 'code'], registry=registry)
+STREAMSETS_CPU = _gauge('streamsets_cpu', 'Streamsets CPU utilization', ['streamsets_url'])
+STREAMSETS_HEAP_MEMORY = _gauge('streamsets_heap_memory_used_bytes', 'Streamsets Heap memory utilization',
+                                ['streamsets_url'])
+STREAMSETS_NON_HEAP_MEMORY = _gauge('streamsets_non_heap_memory_used_bytes', 'Streamsets Non-heap memory utilization',
+                                    ['streamsets_url'])
+
+PIPELINE_INCOMING_RECORDS = Counter('pipeline_incoming_records', 'Pipeline incoming records', PIPELINE_LABELS,
+                                    registry=registry)
+PIPELINE_OUTGOING_RECORDS = Counter('pipeline_outgoing_records', 'Pipeline outgoing records', PIPELINE_LABELS,
+                                    registry=registry)
+PIPELINE_ERROR_RECORDS = Counter('pipeline_error_records', 'Pipeline error records', PIPELINE_LABELS,
+                                 registry=registry)
+PIPELINE_DESTINATION_LATENCY = _gauge('pipeline_destination_latency_seconds', 'Pipeline destination latency',
+                                      PIPELINE_LABELS)
+PIPELINE_SOURCE_LATENCY = _gauge('pipeline_source_latency_seconds', 'Pipeline source latency', PIPELINE_LABELS)
+# percentiles of batch processing time that StreamSets timers already calculate, observations are not available
+# to fill a prometheus histogram so they're exposed as a summary would expose them, with the quantile label
+PIPELINE_DESTINATION_LATENCY_QUANTILES = _gauge('pipeline_destination_latency_quantile_seconds',
+                                                'Pipeline destination latency quantiles',
+                                                PIPELINE_LABELS + ['quantile'])
+PIPELINE_SOURCE_LATENCY_QUANTILES = _gauge('pipeline_source_latency_quantile_seconds',
+                                           'Pipeline source latency quantiles', PIPELINE_LABELS + ['quantile'])
+PIPELINE_INCOMING_RECORDS_RATE = _gauge('pipeline_incoming_records_per_second',
+                                        'Pipeline incoming records per second, one-minute rate', PIPELINE_LABELS)
+PIPELINE_OUTGOING_RECORDS_RATE = _gauge('pipeline_outgoing_records_per_second',
+                                        'Pipeline outgoing records per second, one-minute rate', PIPELINE_LABELS)
+PIPELINE_OFFSET_LAG = _gauge('pipeline_offset_lag_seconds', 'Time since the last saved offset of a pipeline',
+                             PIPELINE_LABELS)
+
+# Enum metrics don't work in multiprocess mode, the status is exposed the same way by a gauge
+# that is 1 for the current status and 0 for the others
+PIPELINE_STATUS = _gauge('pipeline_status', 'Pipeline status', PIPELINE_LABELS + ['pipeline_status'])
+
+KAFKA_CONSUMER_LAG = _gauge('kafka_consumer_lag', 'Kafka consumer lag', ['topic'])
+
+MONITORING_SNAPSHOT_AGE = _gauge('monitoring_snapshot_age_seconds', 'Time since StreamSets metrics were last collected')
+MONITORING_COLLECTION_DURATION = _gauge('monitoring_collection_duration_seconds',
+                                        'Time to collect metrics from all StreamSets instances')
+
+SOURCE_HTTP_ERRORS = Counter('source_http_errors', 'Source HTTP errors', PIPELINE_LABELS + ['code'],
+                             registry=registry)
 SCHEDULED_SCRIPTS_ERRORS = Counter('scheduled_scripts_errors', 'Scheduled scripts errors', ['script_name'],
                                    registry=registry)
-SCHEDULED_SCRIPT_EXECUTION_TIME = Gauge('scheduled_script_execution_time', 'Time to execute a scheduled script',
-                                        ['script_name'], registry=registry)
+SCHEDULED_SCRIPT_EXECUTION_TIME = _gauge('scheduled_script_execution_time', 'Time to execute a scheduled script',
+                                         ['script_name'])
+
+CACTI_CACHE_REFRESH_TIME = _gauge('cacti_cache_refresh_time_seconds', 'Time to refresh Cacti cache of a pipeline',
+                                  ['pipeline_id', 'refresh_type'])
+CACTI_CACHE_REFRESH_DELTA_SIZE = _gauge('cacti_cache_refresh_delta_size',
+                                        'Number of graphs or hosts fetched to refresh Cacti cache',
+                                        ['pipeline_id', 'entity'])
+CACTI_CACHE_LRU_HITS = Counter('cacti_cache_lru_hits', 'Cacti cache reads served from the in-memory LRU',
+                               ['pipeline_id'], registry=registry)
+CACTI_CACHE_LRU_MISSES = Counter('cacti_cache_lru_misses', 'Cacti cache reads that loaded the cache from the db',
+                                 ['pipeline_id'], registry=registry)
+CACTI_CACHE_LRU_EVICTIONS = Counter('cacti_cache_lru_evictions', 'Cacti caches evicted from the in-memory LRU',
+                                    ['pipeline_id'], registry=registry)
 
 # # Not for every endpoint
 # AGENT_API_REQUESTS_LATENCY = Gauge('agent_api_requests_latency_seconds', 'Agent API requests time in seconds',
@@ -46,3 +100,80 @@ SCHEDULED_SCRIPT_EXECUTION_TIME = Gauge('scheduled_script_execution_time', 'Time
 #                                   registry=registry)
 # # Do we need it?
 # AGENT_DB_HEALTH_CHECK = Gauge('agent_db_health_check', 'Agent DB health check', registry=registry)
+
+
+def set_gauge(gauge: Gauge, value: float, *labels):
+    (gauge.labels(*labels) if labels else gauge).set(value)
+    if MULTIPROCESS:
+        updated = _updated[gauge]
+        (updated.labels(*labels) if labels else updated).set(time.time())
+
+
+def set_pipeline_status(labels: tuple, status: str):
+    for state in Pipeline.statuses:
+        set_gauge(PIPELINE_STATUS, int(state == status), *labels, state)
+
+
+def get_registry() -> CollectorRegistry:
+    # the registry to serve metrics from, in multiprocess mode it reads metrics of all processes
+    if not MULTIPROCESS:
+        return registry
+    registry_ = CollectorRegistry()
+    registry_.register(_MultiProcessCollector())
+    # Info metrics don't work in multiprocess mode, the version is the same in every process
+    registry_.register(VERSION)
+    return registry_
+
+
+def get_counter_values(*counters: Counter) -> Dict[tuple, float]:
+    # returns {(counter name, frozenset of label items): value}, the value is summed over all processes.
+    # Only counters are collected, in multiprocess mode only files of counters are read and merged
+    names = {counter.describe()[0].name for counter in counters}
+    if MULTIPROCESS:
+        files = glob.glob(os.path.join(os.environ['prometheus_multiproc_dir'], 'counter_*.db'))
+        families = multiprocess.MultiProcessCollector.merge(files, accumulate=True)
+    else:
+        families = [family for counter in counters for family in counter.collect()]
+    values = {}
+    for family in families:
+        if family.name not in names:
+            continue
+        for sample in family.samples:
+            if sample.name == family.name + '_total':
+                values[(family.name, frozenset(sample.labels.items()))] = sample.value
+    return values
+
+
+class _MultiProcessCollector:
+    def __init__(self):
+        self._collector = multiprocess.MultiProcessCollector(None)
+
+    def collect(self):
+        families = {family.name: family for family in self._collector.collect()}
+        for name, family in families.items():
+            if name in _last_value_gauges:
+                yield _get_last_values(family, families.get(f'{name}_updated'))
+            elif not (name.endswith('_updated') and name[:-len('_updated')] in _last_value_gauges):
+                yield family
+
+
+def _get_last_values(family: Metric, updated: Metric) -> Metric:
+    # gauge samples of every process have the pid label, for every set of labels the value
+    # of the process that set it last is kept
+    def split_pid(labels: dict) -> tuple:
+        labels = dict(labels)
+        pid = labels.pop('pid')
+        return frozenset(labels.items()), pid
+
+    updated_at = {split_pid(sample.labels): sample.value for sample in (updated.samples if updated else [])}
+    last = {}
+    for sample in family.samples:
+        labels, pid = split_pid(sample.labels)
+        sample_updated_at = updated_at.get((labels, pid), 0)
+        if labels not in last or sample_updated_at >= last[labels][0]:
+            last[labels] = (sample_updated_at, sample)
+
+    merged = Metric(family.name, family.documentation, 'gauge')
+    for _, sample in last.values():
+        merged.add_sample(sample.name, {k: v for k, v in sample.labels.items() if k != 'pid'}, sample.value)
+    return merged
@@ -0,0 +1,114 @@
+import gzip
+import json
+import threading
+import requests
+
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from agent.modules import constants, logger
+
+logger_ = logger.get_logger(__name__)
+
+# seconds to wait for anodot to respond to one request
+TIMEOUT = 60
+# status codes after which a request is sent again, other errors would be returned again
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+# connections to anodot are kept alive and reused by all sends of the api worker
+_session: Optional[requests.Session] = None
+# sends are made one at a time, so the retry queue and the sent gauges are not changed concurrently
+_lock = threading.Lock()
+# {url: (encoded request, gauges in it) that failed}, when the queue is full the oldest requests are dropped
+_retry_queues: Dict[str, deque] = {}
+# {url: {sample properties: value}} of gauges that were accepted by anodot last time
+_sent_gauges: Dict[str, dict] = {}
+
+
+def send(data: list, url: str, proxies: dict) -> List[str]:
+    # data is split into chunks of MONITORING_SEND_CHUNK_SIZE samples, requests that failed before are sent first.
+    # If a request fails, it and the rest are queued and sent with the next data. Returns errors
+    with _lock:
+        if constants.MONITORING_SEND_CHANGED_GAUGES_ONLY:
+            data = _get_changed(data, url)
+        queue = _retry_queues.setdefault(url, deque(maxlen=constants.MONITORING_RETRY_QUEUE_SIZE))
+        bodies = list(queue) + [(_encode(chunk), _get_gauges(chunk)) for chunk in _get_chunks(data)]
+        queue.clear()
+
+        errors = []
+        for idx, (body, gauges) in enumerate(bodies):
+            error, retry = _post(body, url, proxies)
+            if not error:
+                # gauges count as sent only after anodot accepted them, otherwise they're sent again
+                _sent_gauges.setdefault(url, {}).update(gauges)
+                continue
+            errors.append(error)
+            if retry:
+                _queue(queue, bodies[idx:])
+                break
+        return errors
+
+
+def _get_changed(data: list, url: str) -> list:
+    sent = _sent_gauges.get(url, {})
+    return [
+        sample for sample in data
+        if not _is_gauge(sample) or sent.get(_get_key(sample)) != sample['value']
+    ]
+
+
+def _get_gauges(chunk: list) -> dict:
+    # values of gauges in the chunk that are remembered when the chunk is sent
+    if not constants.MONITORING_SEND_CHANGED_GAUGES_ONLY:
+        return {}
+    return {_get_key(sample): sample['value'] for sample in chunk if _is_gauge(sample)}
+
+
+def _is_gauge(sample: dict) -> bool:
+    return sample['properties']['target_type'] == 'gauge'
+
+
+def _get_key(sample: dict) -> tuple:
+    return tuple(sorted(sample['properties'].items()))
+
+
+def _get_chunks(data: list) -> List[list]:
+    size = max(1, constants.MONITORING_SEND_CHUNK_SIZE)
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def _encode(chunk: list) -> bytes:
+    body = json.dumps(chunk).encode()
+    return gzip.compress(body) if constants.MONITORING_SEND_GZIP else body
+
+
+def _queue(queue: deque, bodies: List[Tuple[bytes, dict]]):
+    dropped = max(0, len(queue) + len(bodies) - queue.maxlen)
+    if dropped:
+        logger_.warning(f'Monitoring retry queue is full, {dropped} requests are dropped')
+    queue.extend(bodies)
+
+
+def _post(body: bytes, url: str, proxies: dict) -> Tuple[Optional[str], bool]:
+    # returns the error and whether the request should be sent again
+    headers = {'Content-Type': 'application/json'}
+    if constants.MONITORING_SEND_GZIP:
+        headers['Content-Encoding'] = 'gzip'
+    try:
+        res = _get_session().post(url, data=body, headers=headers, proxies=proxies, timeout=TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        return f'Error sending to {url}: {e}', True
+
+    if res.status_code != 200:
+        return f'Error {res.status_code} from {url}', res.status_code in RETRY_STATUS_CODES
+    if res.text:
+        res_json = res.json()
+        if res_json['errors']:
+            return str(res_json['errors']), False
+    return None, False
+
+
+def _get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        _session = requests.Session()
+    return _session
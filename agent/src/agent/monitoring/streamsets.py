@@ -1,62 +1,251 @@
+import functools
+import json
+import time
+import traceback
 import prometheus_client
 import sdc_client
 
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from typing import List, Optional
 from agent import streamsets, pipeline, source
+from agent.modules import constants, logger
 from agent.monitoring import metrics
 
+logger_ = logger.get_logger(__name__)
 
-def _pull_system_metrics(streamsets_: streamsets.StreamSets):
-    jmx = sdc_client.get_jmx(streamsets_, 'java.lang:type=*')
+SYSTEM_QUERY = 'java.lang:type=*'
+KAFKA_QUERY = 'kafka.consumer:type=consumer-fetch-manager-metrics,client-id=*,topic=*,partition=*'
+# metrics of all pipelines of a StreamSets are requested at once, bean names start with the pipeline name
+PIPELINES_QUERY = 'metrics:name=sdc.pipeline.*'
+PIPELINE_BEAN_PREFIX = 'metrics:name=sdc.pipeline.'
+
+# sources whose scripts save the timestamp of the last queried interval as the offset,
+# jdbc sources save it only if they use schema, otherwise the offset is a value of the offset column
+_INTERVAL_OFFSET_SOURCES = {
+    source.TYPE_CACTI, source.TYPE_INFLUX, source.TYPE_SAGE, source.TYPE_SOLARWINDS, source.TYPE_VICTORIA,
+    source.TYPE_ZABBIX,
+}
+_INTERVAL_OFFSET_SCHEMA_SOURCES = {source.TYPE_CLICKHOUSE, source.TYPE_MYSQL, source.TYPE_POSTGRES}
+# sage saves the offset as a date
+_OFFSET_DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _set_system_metrics(streamsets_url: str, jmx: dict):
     for bean in jmx['beans']:
         if bean['name'] == 'java.lang:type=Memory':
-            metrics.STREAMSETS_HEAP_MEMORY.labels(streamsets_.url).set(bean['HeapMemoryUsage']['used'])
-            metrics.STREAMSETS_NON_HEAP_MEMORY.labels(streamsets_.url).set(bean['NonHeapMemoryUsage']['used'])
+            metrics.set_gauge(metrics.STREAMSETS_HEAP_MEMORY, bean['HeapMemoryUsage']['used'], streamsets_url)
+            metrics.set_gauge(metrics.STREAMSETS_NON_HEAP_MEMORY, bean['NonHeapMemoryUsage']['used'], streamsets_url)
         elif bean['name'] == 'java.lang:type=OperatingSystem':
-            metrics.STREAMSETS_CPU.labels(streamsets_.url).set(bean['ProcessCpuLoad'])
+            metrics.set_gauge(metrics.STREAMSETS_CPU, bean['ProcessCpuLoad'], streamsets_url)
 
 
-def _increase_counter(total: int, metric: prometheus_client.Counter):
-    # TODO: do not access private property
-    val = total - metric._value.get()
+def _increase_counter(total: int, counter: prometheus_client.Counter, labels: tuple, values: dict):
+    # the counter is increased up to the total from StreamSets, values are {(counter name, label items): value}
+    # read from all processes, so the counter stays correct if it was increased by another worker before
+    key = (counter.describe()[0].name, frozenset(zip(metrics.PIPELINE_LABELS, labels)))
+    val = total - values.get(key, 0)
     if val > 0:
-        metric.inc(val)
+        counter.labels(*labels).inc(val)
+        values[key] = total
 
 
 def _is_influx(pipeline_: pipeline.Pipeline):
     return pipeline_.source.type == source.TYPE_INFLUX
 
 
-def _pull_pipeline_metrics(pipeline_: pipeline.Pipeline):
-    jmx = sdc_client.get_jmx(pipeline_.streamsets, f'metrics:name=sdc.pipeline.{pipeline_.name}.*')
-    labels = (pipeline_.streamsets.url, pipeline_.name, pipeline_.source.type)
+# {jmx timer attribute: quantile}
+_TIMER_QUANTILES = {
+    '50thPercentile': '0.5',
+    '75thPercentile': '0.75',
+    '95thPercentile': '0.95',
+    '98thPercentile': '0.98',
+    '99thPercentile': '0.99',
+    '999thPercentile': '0.999',
+}
+
+
+def _set_latency(metric: prometheus_client.Gauge, quantiles: prometheus_client.Gauge, labels: tuple, bean: dict,
+                 counter_values: dict):
+    # timers are in milliseconds
+    metrics.set_gauge(metric, bean['Mean'] / 1000, *labels)
+    for attribute, quantile in _TIMER_QUANTILES.items():
+        if attribute in bean:
+            metrics.set_gauge(quantiles, bean[attribute] / 1000, *labels, quantile)
+
+
+def _set_count(metric: prometheus_client.Counter, labels: tuple, bean: dict, counter_values: dict):
+    _increase_counter(bean['Count'], metric, labels, counter_values)
+
+
+def _set_rate(metric: prometheus_client.Gauge, labels: tuple, bean: dict, counter_values: dict):
+    metrics.set_gauge(metric, bean['OneMinuteRate'], *labels)
+
+
+# {bean name suffix: (function that sets metrics from the bean, for_influx)}, for_influx is True if the bean
+# is used only for influx pipelines, False if it's used for all pipelines except influx and None if for all
+_PIPELINE_BEANS = {
+    'source.batchProcessing.timer': (
+        functools.partial(_set_latency, metrics.PIPELINE_SOURCE_LATENCY, metrics.PIPELINE_SOURCE_LATENCY_QUANTILES),
+        None,
+    ),
+    'source.outputRecords.counter': (functools.partial(_set_count, metrics.PIPELINE_INCOMING_RECORDS), False),
+    'source.outputRecords.meter': (functools.partial(_set_rate, metrics.PIPELINE_INCOMING_RECORDS_RATE), False),
+    'transform_records.outputRecords.counter': (
+        functools.partial(_set_count, metrics.PIPELINE_INCOMING_RECORDS), True
+    ),
+    'transform_records.outputRecords.meter': (
+        functools.partial(_set_rate, metrics.PIPELINE_INCOMING_RECORDS_RATE), True
+    ),
+    'destination.batchProcessing.timer': (
+        functools.partial(
+            _set_latency, metrics.PIPELINE_DESTINATION_LATENCY, metrics.PIPELINE_DESTINATION_LATENCY_QUANTILES
+        ),
+        None,
+    ),
+    'destination.outputRecords.counter': (functools.partial(_set_count, metrics.PIPELINE_OUTGOING_RECORDS), None),
+    'destination.outputRecords.meter': (functools.partial(_set_rate, metrics.PIPELINE_OUTGOING_RECORDS_RATE), None),
+    'pipeline.batchErrorRecords.counter': (functools.partial(_set_count, metrics.PIPELINE_ERROR_RECORDS), None),
+}
+# all bean name suffixes consist of the same number of dot separated parts, so the suffix of a bean is cut off
+# its name with one rsplit and looked up in _PIPELINE_BEANS, beans that are not used are skipped by the lookup
+_PIPELINE_BEAN_SUFFIX_PARTS = 3
+
+
+def _get_bean_suffix(bean_name: str) -> str:
+    return '.'.join(bean_name.rsplit('.', _PIPELINE_BEAN_SUFFIX_PARTS)[1:])
+
+
+def _get_pipeline_name(bean_name: str, pipelines: dict) -> Optional[str]:
+    # pipeline names can contain dots, so every prefix of the bean name that ends before a dot is checked and
+    # the longest known name is used
+    if not bean_name.startswith(PIPELINE_BEAN_PREFIX):
+        return None
+    name = None
+    idx = bean_name.find('.', len(PIPELINE_BEAN_PREFIX))
+    while idx != -1:
+        if bean_name[len(PIPELINE_BEAN_PREFIX):idx] in pipelines:
+            name = bean_name[len(PIPELINE_BEAN_PREFIX):idx]
+        idx = bean_name.find('.', idx + 1)
+    return name
+
+
+def _set_pipelines_metrics(pipelines: dict, counter_values: dict, jmx: dict):
+    # pipelines are {pipeline_name: (labels, is_influx)}, beans of pipelines that are not in the agent are skipped
     for bean in jmx['beans']:
-        if bean['name'].endswith('source.batchProcessing.timer'):
-            metrics.PIPELINE_SOURCE_LATENCY.labels(*labels).set(bean['Mean'] / 1000)
-        elif bean['name'].endswith('source.outputRecords.counter') and not _is_influx(pipeline_):
-            _increase_counter(bean['Count'], metrics.PIPELINE_INCOMING_RECORDS.labels(*labels))
-        elif bean['name'].endswith('transform_records.outputRecords.counter') and _is_influx(pipeline_):
-            _increase_counter(bean['Count'], metrics.PIPELINE_INCOMING_RECORDS.labels(*labels))
-        elif bean['name'].endswith('destination.batchProcessing.timer'):
-            metrics.PIPELINE_DESTINATION_LATENCY.labels(*labels).set(bean['Mean'] / 1000)
-        elif bean['name'].endswith('destination.outputRecords.counter'):
-            _increase_counter(bean['Count'], metrics.PIPELINE_OUTGOING_RECORDS.labels(*labels))
-        elif bean['name'].endswith('pipeline.batchErrorRecords.counter'):
-            _increase_counter(bean['Count'], metrics.PIPELINE_ERROR_RECORDS.labels(*labels))
-
-
-def _pull_kafka_metrics(streamsets_: streamsets.StreamSets):
-    jmx = sdc_client.get_jmx(
-        streamsets_,
-        'kafka.consumer:type=consumer-fetch-manager-metrics,client-id=*,topic=*,partition=*'
-    )
+        handler = _PIPELINE_BEANS.get(_get_bean_suffix(bean['name']))
+        if handler is None:
+            continue
+        name = _get_pipeline_name(bean['name'], pipelines)
+        if name is None:
+            continue
+        labels, is_influx = pipelines[name]
+        set_metrics, for_influx = handler
+        if for_influx is None or for_influx == is_influx:
+            set_metrics(labels, bean, counter_values)
+
+
+def _set_kafka_metrics(jmx: dict):
     for bean in jmx['beans']:
         name = dict(item.split('=') for item in bean['name'].split(','))
-        metrics.KAFKA_CONSUMER_LAG.labels(name['topic']).set(bean['records-lag-avg'])
+        metrics.set_gauge(metrics.KAFKA_CONSUMER_LAG, bean['records-lag-avg'], name['topic'])
+
+
+def _has_interval_offset(pipeline_: pipeline.Pipeline) -> bool:
+    return pipeline_.source.type in _INTERVAL_OFFSET_SOURCES \
+        or pipeline_.uses_schema and pipeline_.source.type in _INTERVAL_OFFSET_SCHEMA_SOURCES
+
+
+def _get_offset_timestamp(offset: str) -> Optional[float]:
+    # the offset is saved as StreamSets returns it, {"version": 2, "offsets": {entity: offset}}, zabbix adds a suffix
+    # after `_` to the timestamp. If there are several entities the one that is the most behind is used
+    offset = json.loads(offset)
+    if not isinstance(offset, dict):
+        return None
+    timestamps = []
+    for entity, value in offset.get('offsets', {}).items():
+        # skip offset versions of StreamSets origins
+        if entity.startswith('$'):
+            continue
+        try:
+            timestamps.append(_to_timestamp(str(value).split('_')[0]))
+        except ValueError:
+            continue
+    return min(timestamps) if timestamps else None
 
 
-def pull_metrics():
+def _to_timestamp(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.strptime(value, _OFFSET_DATE_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+
+def _set_offset_lags(pipelines: List[pipeline.Pipeline]):
+    # the lag shows how far behind real time an interval-based pipeline is, based on the offset saved in the agent
+    now = time.time()
+    for pipeline_ in pipelines:
+        if not pipeline_.streamsets or not _has_interval_offset(pipeline_) or not pipeline_.get_offset():
+            continue
+        try:
+            timestamp = _get_offset_timestamp(pipeline_.get_offset())
+        except ValueError:
+            logger_.warning(f'Failed to parse offset of the pipeline {pipeline_.name}')
+            continue
+        if timestamp is not None:
+            labels = (pipeline_.streamsets.url, pipeline_.name, pipeline_.source.type)
+            metrics.set_gauge(metrics.PIPELINE_OFFSET_LAG, max(0.0, now - timestamp), *labels)
+
+
+def _get_requests(pipelines_: List[pipeline.Pipeline], counter_values: dict) -> list:
+    # returns [(streamsets, jmx_query, function that sets metrics from the jmx)], db objects are read here
+    # because the session can't be used by the threads that request jmx
+    jmx_requests = []
     for streamsets_ in streamsets.repository.get_all():
-        _pull_system_metrics(streamsets_)
-        _pull_kafka_metrics(streamsets_)
-    for pipeline_ in pipeline.repository.get_all():
-        _pull_pipeline_metrics(pipeline_)
+        jmx_requests.append((streamsets_, SYSTEM_QUERY, functools.partial(_set_system_metrics, streamsets_.url)))
+        jmx_requests.append((streamsets_, KAFKA_QUERY, _set_kafka_metrics))
+    # one request for all pipelines of a StreamSets
+    pipelines = {}
+    streamsets_by_id = {}
+    for pipeline_ in pipelines_:
+        if not pipeline_.streamsets:
+            continue
+        streamsets_by_id[pipeline_.streamsets_id] = pipeline_.streamsets
+        labels = (pipeline_.streamsets.url, pipeline_.name, pipeline_.source.type)
+        pipelines.setdefault(pipeline_.streamsets_id, {})[pipeline_.name] = (labels, _is_influx(pipeline_))
+    for streamsets_id, streamsets_pipelines in pipelines.items():
+        jmx_requests.append((
+            streamsets_by_id[streamsets_id],
+            PIPELINES_QUERY,
+            functools.partial(_set_pipelines_metrics, streamsets_pipelines, counter_values),
+        ))
+    return jmx_requests
+
+
+def pull_metrics(workers: int = constants.MONITORING_JMX_WORKERS_PER_STREAMSETS):
+    # every StreamSets has its own pool of workers, so a slow instance doesn't delay requests to the others and no
+    # instance gets more than `workers` jmx requests at once. Metrics are set by the calling thread as responses
+    # arrive, a failed request doesn't stop updating metrics of other pipelines
+    counter_values = metrics.get_counter_values(
+        metrics.PIPELINE_INCOMING_RECORDS, metrics.PIPELINE_OUTGOING_RECORDS, metrics.PIPELINE_ERROR_RECORDS
+    )
+    pipelines = pipeline.repository.get_all()
+    _set_offset_lags(pipelines)
+    jmx_requests = _get_requests(pipelines, counter_values)
+    with ExitStack() as stack:
+        executors = {}
+        futures = []
+        for streamsets_, query, set_metrics in jmx_requests:
+            if streamsets_.url not in executors:
+                executors[streamsets_.url] = stack.enter_context(ThreadPoolExecutor(workers))
+            futures.append((
+                executors[streamsets_.url].submit(sdc_client.get_jmx, streamsets_, query),
+                set_metrics,
+                query,
+            ))
+        for future, set_metrics, query in futures:
+            try:
+                set_metrics(future.result())
+            except Exception:
+                logger_.error(f'Failed to pull metrics for `{query}`: {traceback.format_exc()}')
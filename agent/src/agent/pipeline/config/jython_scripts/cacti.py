@@ -6,6 +6,7 @@ try:
     sdc.importLock()
     import sys
     import os
+    import json
     import time
     from datetime import datetime, timedelta
 
@@ -59,7 +60,9 @@ while True:
             'start': offset,
             'end': offset + get_interval(),
             'step': get_step(),
-        }
+            'format': 'ndjson',
+        },
+        stream=True,
     )
     if res.status_code == 204:
         # this means the rrd archive has been removed by the script that copies it via scp
@@ -71,16 +74,25 @@ while True:
         continue
     tries = 0
     res.raise_for_status()
-    for metric in res.json():
-        record = sdc.createRecord('record created ' + str(datetime.now()))
-        record.value = metric
-        batch.add(record)
-
-        if batch.size() == sdc.batchSize:
-            batch.process(entityName, str(end))
-            batch = sdc.createBatch()
-            if sdc.isStopped():
-                break
+    # metrics are streamed one per line, records are sent to the pipeline while the rest are still being received
+    try:
+        for line in res.iter_lines():
+            if not line:
+                continue
+            value = json.loads(line)
+            if 'error' in value:
+                raise Exception('extract_metrics endpoint failed while streaming metrics: ' + str(value['error']))
+            record = sdc.createRecord('record created ' + str(datetime.now()))
+            record.value = value
+            batch.add(record)
+
+            if batch.size() == sdc.batchSize:
+                batch.process(entityName, str(end))
+                batch = sdc.createBatch()
+                if sdc.isStopped():
+                    break
+    finally:
+        res.close()
 
     offset += get_interval()
     batch.process(entityName, str(offset))
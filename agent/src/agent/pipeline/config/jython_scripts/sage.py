@@ -7,6 +7,8 @@ try:
     import time
     import traceback
     import re
+    import threading
+    import Queue
 
     sys.path.append(os.path.join(os.environ['SDC_DIST'], 'python-libs'))
     import requests
@@ -20,6 +22,8 @@ entityName = ''
 DATEFORMAT = '%Y-%m-%dT%H:%M:%SZ'
 
 query_size = int(sdc.userParams.get('QUERY_SIZE', 1000))
+# an interval is split into this number of sub-windows which are queried concurrently
+query_windows = int(sdc.userParams.get('QUERY_WINDOWS', 1))
 
 # because user specifies the interval in minutes
 interval = timedelta(seconds=int(float(sdc.userParams['INTERVAL']) * 60))
@@ -28,6 +32,7 @@ days_to_backfill = timedelta(days=int(sdc.userParams['DAYS_TO_BACKFILL']))
 sdc.log.info('INTERVAL: ' + str(interval))
 sdc.log.info('DELAY: ' + str(delay))
 sdc.log.info('DAYS_TO_BACKFILL: ' + str(days_to_backfill))
+sdc.log.info('QUERY_WINDOWS: ' + str(query_windows))
 
 
 # Jython converts datetime objects to java.sql.Timestamp when assigning it to a variable
@@ -55,9 +60,170 @@ if sdc.userParams.containsKey('recordPrefix'):
 else:
     prefix = ''
 
-cur_batch = sdc.createBatch()
-
 N_REQUESTS_TRIES = 5
+# number of pages of a sub-window fetched ahead while the previous sub-windows are processed
+PAGES_QUEUE_SIZE = 10
+
+# events are created by query threads and added to the batch by the main thread
+pending_events = []
+events_lock = threading.Lock()
+
+
+def report_event(type_, what, value, properties=None):
+    value_properties = {
+        'what': what,
+        'target_type': 'counter',
+        'pipeline_name': sdc.userParams['PIPELINE_NAME']
+    }
+    value_properties.update(properties or {})
+    with events_lock:
+        pending_events.append((type_, {'value': value, 'properties': value_properties, 'timestamp': time.time()}))
+
+
+def add_events(batch):
+    with events_lock:
+        events = pending_events[:]
+        del pending_events[:]
+    for type_, value in events:
+        event = sdc.createEvent(type_, 1)
+        event.value = value
+        batch.addEvent(event)
+    return len(events) > 0
+
+
+def post(body):
+    # returns None if Sage timed out all the times, so the page is skipped
+    for i in range(1, N_REQUESTS_TRIES + 1):
+        try:
+            sdc.log.debug(str(body))
+            res = requests.post(sdc.userParams['SAGE_URL'],
+                                headers={'Authorization': 'Bearer ' + sdc.userParams['SAGE_TOKEN']},
+                                json=body, verify=False, timeout=180)
+
+            res.raise_for_status()
+            data = res.json()
+            sdc.log.debug(str(data))
+            return data
+        except requests.HTTPError as e:
+            report_event('sage_error', 'sage_http_error', 1, {'code': e.response.status_code})
+            sdc.log.error(str(e))
+            if i == N_REQUESTS_TRIES:
+                if e.response.status_code == 504:
+                    sdc.log.info(str(body))
+                    return None
+
+                raise
+
+            time.sleep(3 ** i)
+
+
+def get_pages(start, end):
+    # yields hits page by page, every next page is requested after the cursor returned with the previous one
+    last = None
+    fetched = 0
+    total = None
+    skipped = False
+    truncated = False
+    while True:
+        data = post({
+            "query": sdc.userParams['QUERY'],
+            "startTime": start,
+            "endTime": end,
+            "size": query_size,
+            "after": last
+        })
+        if data is None:
+            skipped = True
+            break
+
+        hits = data["hits"]
+        fetched += len(hits)
+        total = data.get('total', total)
+        if hits:
+            yield hits
+
+        last = data.get('last', None)
+        if len(hits) < query_size:
+            break
+        if last is None:
+            # the page is full but there's no cursor to request the rest
+            truncated = True
+            break
+
+    if isinstance(total, (int, long)) and total > fetched:
+        report_event('sage_truncated_hits', 'sage_truncated_hits', total - fetched)
+    elif truncated:
+        # the number of hits that were not fetched is unknown without the total, at least one is counted
+        report_event('sage_truncated_hits', 'sage_truncated_hits', 1)
+    if skipped or truncated or (total is not None and total > fetched):
+        sdc.log.warn('Hits from %s to %s might be incomplete, fetched %s of %s' % (start, end, fetched, total))
+
+
+def get_windows(start, end):
+    start_date = date_from_str(start)
+    seconds = (date_from_str(end) - start_date).total_seconds()
+    bounds = [start]
+    for i in range(1, query_windows):
+        bound = date_to_str(start_date + timedelta(seconds=int(seconds * i / query_windows)))
+        # the date format has seconds precision, short intervals are split into fewer windows
+        if bound != bounds[-1]:
+            bounds.append(bound)
+    if end != bounds[-1]:
+        bounds.append(end)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)] or [(start, end)]
+
+
+def query(start, end):
+    # yields pages of all sub-windows in the order of time, every sub-window is queried by a separate thread
+    # and pages are processed as soon as all the previous sub-windows are done
+    windows = get_windows(start, end)
+    if len(windows) == 1:
+        for hits in get_pages(start, end):
+            yield hits
+        return
+
+    queues = [Queue.Queue(PAGES_QUEUE_SIZE) for _ in windows]
+    # set when the pages are not consumed anymore, e.g. another window failed, so threads blocked
+    # on a full queue exit
+    stopped = threading.Event()
+
+    def put(queue, item):
+        while not stopped.is_set():
+            try:
+                queue.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                continue
+        return False
+
+    def worker(idx):
+        try:
+            for hits in get_pages(*windows[idx]):
+                if not put(queues[idx], hits):
+                    return
+            put(queues[idx], None)
+        except Exception as e:
+            sdc.log.error(traceback.format_exc())
+            put(queues[idx], e)
+
+    for idx in range(len(windows)):
+        thread = threading.Thread(target=worker, args=(idx,))
+        thread.daemon = True
+        thread.start()
+    try:
+        for queue in queues:
+            while True:
+                item = queue.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+    finally:
+        stopped.set()
+
+
+cur_batch = sdc.createBatch()
 
 while True:
     start_time = time.time()
@@ -69,57 +235,9 @@ while True:
             sdc.log.debug('Sleep time: ' + str(sleep))
             time.sleep(sleep)
 
-        last = None
-        while True:
-            body = {
-                "query": sdc.userParams['QUERY'],
-                "startTime": offset,
-                "endTime": end_time,
-                "size": query_size,
-                "after": last
-            }
-            skip = False
-            for i in range(1, N_REQUESTS_TRIES + 1):
-                try:
-                    sdc.log.debug(str(body))
-                    res = requests.post(sdc.userParams['SAGE_URL'],
-                                        headers={'Authorization': 'Bearer ' + sdc.userParams['SAGE_TOKEN']},
-                                        json=body, verify=False, timeout=180)
-
-                    res.raise_for_status()
-                    sdc.log.debug(str(res.json()))
-                    break
-                except requests.HTTPError as e:
-                    event = sdc.createEvent('sage_error', 1)
-                    event.value = {
-                        'value': 1,
-                        'properties': {
-                            'what': 'sage_http_error',
-                            'target_type': 'counter',
-                            'code': e.response.status_code,
-                            'pipeline_name': sdc.userParams['PIPELINE_NAME']
-                        },
-                        'timestamp': time.time()
-                    }
-                    cur_batch.addEvent(event)
-                    cur_batch.process(entityName, offset)
-                    cur_batch = sdc.createBatch()
-                    sdc.log.error(str(e))
-                    if i == N_REQUESTS_TRIES:
-                        if e.response.status_code == 504:
-                            sdc.log.info(str(body))
-                            skip = True
-                            break
-
-                        raise
-
-                    time.sleep(3 ** i)
-
-            if skip:
-                break
-
-            data = res.json()
-            for hit in data["hits"]:
+        for hits in query(offset, end_time):
+            add_events(cur_batch)
+            for hit in hits:
                 if '@timestamp' not in hit:
                     hit['@timestamp'] = offset
                 hit['@timestamp'] = re.sub(r'(\.[0-9]+)', '', hit['@timestamp'])
@@ -127,28 +245,26 @@ while True:
                 record.value = hit
                 cur_batch.add(record)
 
-            # last = data.get('last', None)
-            # if last is None:
-            #     break
-
-            # cur_batch.process(entityName, data["hits"][-1]['@timestamp'])
-            # cur_batch = sdc.createBatch()
-            break
+            # every page is sent with the start of the interval as the offset,
+            # so the whole interval is queried again if the pipeline restarts before it's done
+            cur_batch.process(entityName, offset)
+            cur_batch = sdc.createBatch()
 
         # send batch and save offset
+        add_events(cur_batch)
         offset = end_time
         cur_batch.process(entityName, offset)
         cur_batch = sdc.createBatch()
         # if the pipeline has been stopped, we should end the script
         if sdc.isStopped():
             break
-
-        # sleep_time = int(sdc.userParams['INTERVAL']) * 60 - (time.time() - time_start)
-        # sdc.log.info('Sleep time: ' + str(sleep_time))
-        # time.sleep(sleep_time)
     except Exception as e:
         sdc.log.error(traceback.format_exc())
+        # errors reported before the failure are still sent
+        if add_events(cur_batch):
+            cur_batch.process(entityName, offset)
+            cur_batch = sdc.createBatch()
         raise
 
 if cur_batch.size() + cur_batch.errorCount() + cur_batch.eventCount() > 0:
-    cur_batch.process(entityName, str(offset))
\ No newline at end of file
+    cur_batch.process(entityName, str(offset))
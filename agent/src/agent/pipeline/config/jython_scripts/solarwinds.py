@@ -6,11 +6,13 @@ try:
     import os
     import time
     import traceback
+    import threading
 
     sys.path.append(os.path.join(os.environ['SDC_DIST'], 'python-libs'))
     import requests
 
     from datetime import datetime, timedelta
+    from requests.adapters import HTTPAdapter
     from requests.auth import HTTPBasicAuth
 finally:
     sdc.importUnlock()
@@ -19,6 +21,7 @@ finally:
 entityName = ''
 DATEFORMAT = '%Y-%m-%dT%H:%M:%SZ'
 LAST_TIMESTAMP = '%last_timestamp%'
+END_TIMESTAMP = '%end_timestamp%'
 
 
 # Jython converts datetime objects to java.sql.Timestamp when assigning it to a variable
@@ -43,6 +46,83 @@ def get_interval():
     return int(sdc.userParams['INTERVAL_IN_SECONDS'])
 
 
+def get_query_threads():
+    # without the end of the interval in the query a window selects everything after its start,
+    # so windows would overlap and intervals are queried one by one
+    if END_TIMESTAMP not in sdc.userParams['QUERY']:
+        return 1
+    return int(sdc.userParams.get('QUERY_THREADS', 1))
+
+
+def create_session():
+    # one session is used for all requests, so connections are kept alive between intervals,
+    # the pool has a connection for every thread as intervals are queried concurrently while backfilling
+    session_ = requests.Session()
+    session_.auth = HTTPBasicAuth(sdc.userParams['API_USER'], sdc.userParams['API_PASSWORD'])
+    session_.mount(sdc.userParams['SOLARWINDS_API_URL'],
+                   HTTPAdapter(pool_connections=1, pool_maxsize=max(1, get_query_threads())))
+    session_.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+    return session_
+
+
+def get_windows_starts():
+    # the query selects one interval after the last timestamp, intervals that have already ended are queried
+    # concurrently by up to QUERY_THREADS threads, otherwise the script waits for the current interval to end
+    ended = (get_now_with_delay() - offset) // get_interval()
+    return [offset + i * get_interval() for i in range(max(1, min(get_query_threads(), ended)))]
+
+
+def fetch(start):
+    query = sdc.userParams['QUERY'] \
+        .replace(LAST_TIMESTAMP, date_to_str(datetime.fromtimestamp(start))) \
+        .replace(END_TIMESTAMP, date_to_str(datetime.fromtimestamp(start + get_interval())))
+    for i in range(1, N_REQUESTS_TRIES + 1):
+        try:
+            res = session.get(
+                sdc.userParams['SOLARWINDS_API_URL'],
+                params={'query': query},
+                verify=False,
+                timeout=sdc.userParams['QUERY_TIMEOUT'],
+            )
+            res.raise_for_status()
+            return res.json()['results']
+        except requests.HTTPError as e:
+            requests.post(sdc.userParams['MONITORING_URL'] + str(res.status_code))
+            sdc.log.error(str(e))
+            if i == N_REQUESTS_TRIES:
+                raise
+            time.sleep(2 ** i)
+
+
+def fetch_concurrently(starts):
+    # results are yielded in the order of windows as soon as the window is fetched, windows don't overlap and rows
+    # of every window are ordered by timestamp, so rows are processed in timestamp order
+    if len(starts) == 1:
+        yield fetch(starts[0])
+        return
+
+    results = [None] * len(starts)
+
+    def worker(idx):
+        try:
+            results[idx] = (True, fetch(starts[idx]))
+        except Exception as e:
+            sdc.log.error(traceback.format_exc())
+            results[idx] = (False, e)
+
+    threads = [threading.Thread(target=worker, args=(idx,)) for idx in range(len(starts))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for idx, thread in enumerate(threads):
+        thread.join()
+        succeeded, result = results[idx]
+        results[idx] = None
+        if not succeeded:
+            raise result
+        yield result
+
+
 if sdc.lastOffsets.containsKey(entityName):
     offset = int(float(sdc.lastOffsets.get(entityName)))
 elif sdc.userParams['DAYS_TO_BACKFILL']:
@@ -52,44 +132,27 @@ else:
 
 sdc.log.info('Start offset: ' + str(offset))
 
-cur_batch = sdc.createBatch()
-
 N_REQUESTS_TRIES = 3
 
+session = create_session()
+cur_batch = sdc.createBatch()
+
 while True:
     try:
         end = offset + get_interval()
         if end > get_now_with_delay():
             time.sleep(end - get_now_with_delay())
-        query = sdc.userParams['QUERY'].replace(LAST_TIMESTAMP, date_to_str(datetime.fromtimestamp(offset)))
-
-        for i in range(1, N_REQUESTS_TRIES + 1):
-            try:
-                res = requests.get(
-                    sdc.userParams['SOLARWINDS_API_URL'],
-                    auth=HTTPBasicAuth(sdc.userParams['API_USER'], sdc.userParams['API_PASSWORD']),
-                    params={'query': query},
-                    verify=False,
-                    timeout=sdc.userParams['QUERY_TIMEOUT'],
-                )
-                res.raise_for_status()
-                break
-            except requests.HTTPError as e:
-                requests.post(sdc.userParams['MONITORING_URL'] + str(res.status_code))
-                sdc.log.error(str(e))
-                if i == N_REQUESTS_TRIES:
-                    raise
-                time.sleep(2 ** i)
-
-        for row in res.json()['results']:
-            record = sdc.createRecord('record created ' + str(datetime.now()))
-            record.value = row
-            cur_batch.add(record)
-
-        # send batch and save offset
-        offset = end
-        cur_batch.process(entityName, str(offset))
-        cur_batch = sdc.createBatch()
+
+        for rows in fetch_concurrently(get_windows_starts()):
+            for row in rows:
+                record = sdc.createRecord('record created ' + str(datetime.now()))
+                record.value = row
+                cur_batch.add(record)
+
+            # send batch and save offset, the offset is moved only after all previous windows are sent
+            offset += get_interval()
+            cur_batch.process(entityName, str(offset))
+            cur_batch = sdc.createBatch()
         if sdc.isStopped():
             break
     except Exception as e:
@@ -97,4 +160,4 @@ while True:
         raise
 
 if cur_batch.size() + cur_batch.errorCount() + cur_batch.eventCount() > 0:
-    cur_batch.process(entityName, str(offset))
\ No newline at end of file
+    cur_batch.process(entityName, str(offset))
@@ -6,16 +6,25 @@ try:
     import os
     sys.path.append(os.path.join(os.environ['SDC_DIST'], 'python-libs'))
     import requests
+    from requests.adapters import HTTPAdapter
     import traceback
     import json
     import time
     import urllib
+    import re
+    import itertools
+    import threading
 finally:
     sdc.importUnlock()
 
 entityName = ''
 N_REQUESTS_TRIES = 3
 BATCH_SIZE = 1000
+RESPONSE_CHUNK_SIZE = 65536
+RESULT_START = re.compile(r'"result"\s*:\s*\[')
+RESULT_TYPE = re.compile(r'"resultType"\s*:\s*"(\w+)"')
+JSON_SPECIAL_CHARS = re.compile(r'[{}\[\]"]')
+JSON_STRING_SPECIAL_CHARS = re.compile(r'["\\]')
 
 
 def get_now_with_delay():
@@ -34,15 +43,23 @@ def get_interval():
     return int(sdc.userParams['INTERVAL'])
 
 
-def make_request(url_):
-    session = requests.Session()
+def create_session():
+    # one session is used for all requests, so connections are kept alive between intervals,
+    # the pool has a connection for every shard as they are queried concurrently
+    session_ = requests.Session()
     if sdc.userParams['USERNAME']:
-        session.auth = (sdc.userParams['USERNAME'], sdc.userParams['PASSWORD'])
+        session_.auth = (sdc.userParams['USERNAME'], sdc.userParams['PASSWORD'])
+    session_.mount(sdc.userParams['URL'], HTTPAdapter(pool_connections=1, pool_maxsize=max(1, len(shards))))
+    session_.headers.update({'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'})
+    return session_
+
+
+def make_request(url_):
     for i in range(1, N_REQUESTS_TRIES + 1):
         try:
             sdc.log.debug(url_)
-            res = session.get(url_, stream=True, headers={"Accept-Encoding": "deflate"},
-                              verify=bool(sdc.userParams['VERIFY_SSL']), timeout=sdc.userParams['QUERY_TIMEOUT'])
+            res = session.get(url_, stream=True, verify=bool(sdc.userParams['VERIFY_SSL']),
+                              timeout=sdc.userParams['QUERY_TIMEOUT'])
             res.raise_for_status()
         except Exception as e:
             if i == N_REQUESTS_TRIES:
@@ -54,8 +71,83 @@ def make_request(url_):
     return res
 
 
-def get_result_key(data):
-    return 'values' if data['data']['resultType'] == 'matrix' else 'value'
+def read_result(response):
+    # returns the result type and an iterator over series of the result that are decoded one by one
+    # while the response is read, so the whole response is never kept in memory
+    chunks = response.iter_content(RESPONSE_CHUNK_SIZE)
+    text = ''
+    match = None
+    for chunk in chunks:
+        text += chunk
+        match = RESULT_START.search(text)
+        if match:
+            break
+    if not match:
+        raise Exception('Victoria response does not contain a result: ' + text[:1000])
+    result_type = RESULT_TYPE.search(text, 0, match.start())
+    series = iter_series(chunks, text, match.end())
+    if result_type:
+        return result_type.group(1), series
+    # resultType goes after the result, it can be found out from the first series
+    first = next(series, None)
+    if first is None:
+        return 'vector', iter([])
+    return 'matrix' if 'values' in first else 'vector', itertools.chain([first], series)
+
+
+def iter_series(chunks, text, pos):
+    # text[pos:] is the content of the result array, only the text of the current series is kept
+    start = None
+    depth = 0
+    in_string = False
+    while True:
+        while True:
+            if in_string:
+                match = JSON_STRING_SPECIAL_CHARS.search(text, pos)
+                if match is None:
+                    pos = len(text)
+                    break
+                if match.group() == '\\':
+                    if match.end() == len(text):
+                        # the escaped character is in the next chunk
+                        pos = match.start()
+                        break
+                    pos = match.end() + 1
+                    continue
+                in_string = False
+                pos = match.end()
+                continue
+            match = JSON_SPECIAL_CHARS.search(text, pos)
+            if match is None:
+                pos = len(text)
+                break
+            char = match.group()
+            pos = match.end()
+            if char == '"':
+                in_string = True
+            elif char in '{[':
+                if depth == 0:
+                    start = match.start()
+                depth += 1
+            elif depth == 0:
+                # the end of the result array
+                return
+            else:
+                depth -= 1
+                if depth == 0:
+                    yield json.loads(text[start:pos])
+                    start = None
+        if start is None:
+            text = text[pos:]
+            pos = 0
+        else:
+            text = text[start:]
+            pos -= start
+            start = 0
+        chunk = next(chunks, None)
+        if chunk is None:
+            raise Exception('Victoria response ended before the end of the result')
+        text += chunk
 
 
 def get_metric_name(data):
@@ -77,16 +169,16 @@ def create_base_metric(metric_name):
     return base_metric_
 
 
-def process_matrix(result_, end_):
+def process_matrix(series, end_):
     i = 0
     cur_batch = sdc.createBatch()
-    for result_ in result_['data']['result']:
+    for result_ in series:
         base_metric = create_base_metric(get_metric_name(result_))
         for dimension, value in result_['metric'].items():
             dimension = dimension.strip().replace(" ", "_").replace(".", "_")
             value = value.strip().replace(" ", "_").replace(".", "_")
             base_metric['properties'][dimension] = value
-        for timestamp, value in result_[get_result_key(res)]:
+        for timestamp, value in result_['values']:
             metric = base_metric
             metric['timestamp'] = int(timestamp)
             metric['value'] = value
@@ -103,16 +195,16 @@ def process_matrix(result_, end_):
             cur_batch = sdc.createBatch()
 
 
-def process_vector(result_, end_):
+def process_vector(series, end_):
     i = 0
     cur_batch = sdc.createBatch()
-    for result_ in result_['data']['result']:
+    for result_ in series:
         base_metric = create_base_metric(get_metric_name(result_))
         for dimension, value in result_['metric'].items():
             dimension = dimension.replace(" ", "_").replace(".", "_")
             value = value.replace(" ", "_").replace(".", "_")
             base_metric['properties'][dimension] = value
-        timestamp, value = result_[get_result_key(res)]
+        timestamp, value = result_['value']
         metric = base_metric
         metric['timestamp'] = end_
         metric['value'] = value
@@ -128,24 +220,131 @@ def process_vector(result_, end_):
         cur_batch.process(entityName, str(end_))
 
 
+def get_step_index(timestamp, start):
+    # Victoria might align the start of the range down to a multiple of the step, points are then earlier than
+    # start + k * step, the k-th point of the range is assigned to the k-th interval either way
+    return -((start - int(float(timestamp))) // interval)
+
+
+def process_range(series, end_, intervals_count):
+    # query_range returns values of every series for every step, every step is sent with the timestamp of its
+    # interval the same way as if it was queried separately. Records are sent as series are decoded, so they are
+    # sent with the offset of the previous interval, and the offset of the range is saved when all of it is sent
+    last_end = end_ + (intervals_count - 1) * interval
+    i = 0
+    cur_batch = sdc.createBatch()
+    for result_ in series:
+        metric_name = get_metric_name(result_)
+        properties = {}
+        for dimension, value in result_['metric'].items():
+            dimension = dimension.replace(" ", "_").replace(".", "_")
+            value = value.replace(" ", "_").replace(".", "_")
+            properties[dimension] = value
+        for timestamp, value in result_['values']:
+            idx = get_step_index(timestamp, end_)
+            if not 0 <= idx < intervals_count:
+                continue
+            metric = create_base_metric(metric_name)
+            metric['properties'].update(properties)
+            metric['timestamp'] = end_ + idx * interval
+            metric['value'] = value
+            new_record = sdc.createRecord('record created ' + str(get_now_with_delay()))
+            new_record.value = metric
+            cur_batch.add(new_record)
+            i += 1
+            if i % BATCH_SIZE == 0:
+                cur_batch.process(entityName, str(end_ - interval))
+                cur_batch = sdc.createBatch()
+                if sdc.isStopped():
+                    return end_ - interval
+    cur_batch.process(entityName, str(last_end))
+    return last_end
+
+
+def query(url_, params_):
+    # every shard is queried by a separate thread, responses are returned in the order of shards and their bodies
+    # are read later one by one, so shards are evaluated by Victoria concurrently but processed sequentially
+    urls = [url_ + '&' + urllib.urlencode(params_)]
+    if shards:
+        urls = [urls[0] + '&' + urllib.urlencode({'extra_filters[]': shard}) for shard in shards]
+    if len(urls) == 1:
+        return [make_request(urls[0])]
+
+    responses = [None] * len(urls)
+    errors = []
+
+    def request(idx):
+        try:
+            responses[idx] = make_request(urls[idx])
+        except Exception as e:
+            sdc.log.error(traceback.format_exc())
+            errors.append(e)
+
+    threads = [threading.Thread(target=request, args=(idx,)) for idx in range(len(urls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        for res_ in responses:
+            if res_ is not None:
+                res_.close()
+        raise errors[0]
+    return responses
+
+
+def read_results(responses):
+    # returns the result type and series of all shards one after another
+    results = [read_result(res_) for res_ in responses]
+    return results[0][0], itertools.chain(*[series_ for _, series_ in results])
+
+
+def get_range_intervals_count():
+    # when the pipeline is behind, up to MAX_POINTS_PER_REQUEST intervals are queried with one query_range request,
+    # every interval is one point of every returned series
+    max_points = int(sdc.userParams['MAX_POINTS_PER_REQUEST'])
+    intervals_behind = (get_now_with_delay() - end) // interval + 1
+    return max(1, min(intervals_behind, max_points))
+
+
 interval = get_interval()
 end = get_backfill_offset() + interval
-url = sdc.userParams['URL'] + '/api/v1/query?' + urllib.urlencode({
+# series selectors that split the query into shards, they are passed to Victoria as extra_filters[]
+shards = json.loads(sdc.userParams['SHARDS'])
+session = create_session()
+params = {
     'query': sdc.userParams['QUERY'].encode('utf-8'),
     'timeout': sdc.userParams['QUERY_TIMEOUT'],
-})
+}
+url = sdc.userParams['URL'] + '/api/v1/query?' + urllib.urlencode(params)
+range_url = sdc.userParams['URL'] + '/api/v1/query_range?' + urllib.urlencode(params)
+# query_range can be used only for queries that return an instant vector, it's known after the first instant query
+range_supported = False
 
 while True:
     try:
-        curr_url = url + '&' + urllib.urlencode({'time': end})
         if end > get_now_with_delay():
             time.sleep(end - get_now_with_delay())
         if sdc.isStopped():
             break
-        sdc.log.debug(curr_url)
-        res = make_request(curr_url).json()
-        sdc.log.debug(str(res))
-        process_matrix(res, end) if res['data']['resultType'] == 'matrix' else process_vector(res, end)
+        intervals_count = get_range_intervals_count() if range_supported else 1
+        if intervals_count > 1:
+            # nocache disables aligning the range to the step, so points are at start + k * step
+            responses = query(range_url, {
+                'start': end,
+                'end': end + (intervals_count - 1) * interval,
+                'step': interval,
+                'nocache': 1,
+            })
+            _, series = read_results(responses)
+            end = process_range(series, end, intervals_count)
+        else:
+            responses = query(url, {'time': end})
+            result_type, series = read_results(responses)
+            range_supported = result_type == 'vector'
+            process_matrix(series, end) if result_type == 'matrix' else process_vector(series, end)
+        for res in responses:
+            res.close()
         end += interval
     except Exception as e:
         sdc.log.error(traceback.format_exc())
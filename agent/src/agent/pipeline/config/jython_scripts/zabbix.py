@@ -6,9 +6,12 @@ try:
     import os
     sys.path.append(os.path.join(os.environ['SDC_DIST'], 'python-libs'))
     import requests
+    from requests.adapters import HTTPAdapter
     import traceback
     import time
     import json
+    import threading
+    import Queue
 finally:
     sdc.importUnlock()
 
@@ -16,33 +19,64 @@ entityName = ''
 N_REQUESTS_TRIES = 3
 
 
+# messages of Zabbix API errors returned when the auth token expired or was invalidated
+SESSION_EXPIRED_ERRORS = ['Session terminated', 'Not authorised', 'Not authorized']
+
+
+class SessionExpiredException(Exception):
+    pass
+
+
 class Client:
-    def __init__(self, url, user, password):
+    def __init__(self, url, user, password, pool_size):
         self.url = url + '/api_jsonrpc.php'
+        self.user = user
+        self.password = password
         self.auth_token = None
-        self._authenticate(user, password)
+        self.auth_lock = threading.Lock()
+        # connections are kept alive and reused by all requests, one connection per query thread
+        self.session = requests.Session()
+        self.session.mount(self.url, HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+        self.session.headers.update({
+            'Content-Type': 'application/json-rpc',
+            'Accept-Encoding': 'gzip, deflate',
+            'Connection': 'keep-alive',
+        })
+        self._authenticate(None)
 
     def post(self, method, params):
+        auth_token = self.auth_token
+        try:
+            return self._post(method, params, auth_token)
+        except SessionExpiredException as e:
+            if method == 'user.login':
+                raise
+            sdc.log.info(str(e))
+            self._authenticate(auth_token)
+            return self._post(method, params, self.auth_token)
+
+    def _post(self, method, params, auth_token):
         for i in range(1, N_REQUESTS_TRIES + 1):
             try:
-                res = requests.post(
+                res = self.session.post(
                     self.url,
                     json={
                         'jsonrpc': '2.0',
                         'method': method,
                         'params': params,
                         'id': 1,
-                        'auth': self.auth_token
-                    },
-                    headers={
-                        'Content-Type': 'application/json-rpc'
+                        'auth': auth_token
                     },
                     timeout=sdc.userParams['QUERY_TIMEOUT']
                 )
                 res.raise_for_status()
                 result = res.json()
                 if 'error' in result:
+                    if is_session_expired(result['error']):
+                        raise SessionExpiredException(str(result))
                     raise Exception(str(result))
+            except SessionExpiredException:
+                raise
             except Exception as e:
                 if i == N_REQUESTS_TRIES:
                     raise
@@ -52,12 +86,26 @@ class Client:
             break
         return result['result']
 
-    def _authenticate(self, user, password):
-        self.auth_token = self.post('user.login', {'user': user, 'password': password})
-        sdc.log.info('user.login - success')
+    def _authenticate(self, expired_token):
+        with self.auth_lock:
+            # another thread might have already logged in again after the same token expired
+            if self.auth_token != expired_token:
+                return
+            self.auth_token = self._post('user.login', {'user': self.user, 'password': self.password}, None)
+            sdc.log.info('user.login - success')
+
 
+def is_session_expired(error):
+    message = str(error.get('data', '')) + str(error.get('message', ''))
+    return any(e in message for e in SESSION_EXPIRED_ERRORS)
 
-client = Client(sdc.userParams['URL'], sdc.userParams['USER'], sdc.userParams['PASSWORD'])
+
+client = Client(
+    sdc.userParams['URL'],
+    sdc.userParams['USER'],
+    sdc.userParams['PASSWORD'],
+    int(sdc.userParams['QUERY_THREADS']),
+)
 
 
 def get_now_with_delay():
@@ -85,22 +133,93 @@ def get_last_processed_id():
     return None
 
 
-def query_history(item_ids, value_type):
+def get_time_range(intervals_count):
+    # intervals include their start and exclude their end, so a record on the boundary of two intervals belongs
+    # to the later one only, both when intervals are processed one by one and in catch-up mode.
+    # time_till of history.get is inclusive
+    return end - interval, end + (intervals_count - 1) * interval - 1
+
+
+def get_interval_index(clock):
+    # index of the interval the record belongs to in catch-up mode, counting from the current one
+    return (int(clock) - (end - interval)) // interval
+
+
+def get_history_params(item_ids, value_type, intervals_count):
+    time_from, time_till = get_time_range(intervals_count)
     for ids_chunk in chunks(item_ids, int(sdc.userParams['HISTORIES_BATCH_SIZE'])):
-        history_params = {
+        yield {
             'history': value_type,
             'itemids': ids_chunk,
             'sortfield': 'clock',
             'sortorder': 'ASC',
-            'time_from': end - interval,
-            'time_till': end
+            'time_from': time_from,
+            'time_till': time_till
         }
-        histories = client.post('history.get', history_params)
-        # add fields from item to every history record
-        if len(histories) == 0:
-            sdc.log.info('history.get - No data for chunk - query: ' + str(history_params))
-            continue
-        yield histories
+
+
+def get_history_calls(itemids_value_types, intervals_count):
+    calls = []
+    for value_type, ids in group_ids_by_value_types(itemids_value_types).items():
+        calls += [(query_history, params) for params in get_history_params(ids, value_type, intervals_count)]
+    return calls
+
+
+def query_history(history_params):
+    histories = client.post('history.get', history_params)
+    if len(histories) == 0:
+        sdc.log.info('history.get - No data for chunk - query: ' + str(history_params))
+    return histories
+
+
+def run_concurrently(calls):
+    # calls are (function, argument) pairs, they are run by QUERY_THREADS threads and results are yielded
+    # in the order of calls, so records are processed in the same order as if the calls were sequential
+    threads_count = min(int(sdc.userParams['QUERY_THREADS']), len(calls))
+    if threads_count <= 1:
+        for func, arg in calls:
+            yield func(arg)
+        return
+
+    results = [None] * len(calls)
+    done = [threading.Event() for _ in calls]
+    tasks = Queue.Queue()
+    for idx in range(len(calls)):
+        tasks.put(idx)
+
+    def worker():
+        while True:
+            try:
+                idx = tasks.get_nowait()
+            except Queue.Empty:
+                return
+            func, arg = calls[idx]
+            try:
+                results[idx] = (True, func(arg))
+            except Exception as e:
+                sdc.log.error(traceback.format_exc())
+                results[idx] = (False, e)
+            done[idx].set()
+
+    for _ in range(threads_count):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+    try:
+        for idx in range(len(calls)):
+            done[idx].wait()
+            succeeded, result = results[idx]
+            results[idx] = None
+            if not succeeded:
+                raise result
+            yield result
+    finally:
+        # if the consumer stopped early, threads don't start remaining calls
+        while not tasks.empty():
+            try:
+                tasks.get_nowait()
+            except Queue.Empty:
+                break
 
 
 def chunks(lst, n):
@@ -115,9 +234,7 @@ def fetch_hosts():
     return {host['hostid']: host for host in res}
 
 
-def fetch_itemids_value_types():
-    global end
-
+def query_itemids_value_types():
     query = json.loads(sdc.userParams['QUERY'])
     query['output'] = ['itemid', 'value_type']
 
@@ -127,7 +244,13 @@ def fetch_itemids_value_types():
         sdc.log.info('item.get - No data - query: ' + str(json.loads(sdc.userParams['QUERY'])))
     sdc.log.debug('query_items() took ' + str(time.time() - start) + ' seconds')
     sdc.log.debug('we got ' + str(len(itemids_value_types)) + ' items')
+    return itemids_value_types
+
 
+def fetch_itemids_value_types():
+    global end
+
+    itemids_value_types = metadata.itemids_value_types
     last_processed_id = get_last_processed_id()
     if last_processed_id and int(last_processed_id) != int(itemids_value_types[-1]['itemid']):
         # this means we didn't finish processing the batch last time, because the pipeline
@@ -141,7 +264,6 @@ def fetch_itemids_value_types():
 
 
 def fetch_items_data(itemids):
-    global hosts
     start = time.time()
     items = {}
     params = {'itemids': itemids}
@@ -149,15 +271,63 @@ def fetch_items_data(itemids):
     if 'output' in query:
         params['output'] = query['output']
     for item in client.post('item.get', params):
-        # there are some template items that we should skip
-        if item['hostid'] not in hosts:
-            continue
-        item['host'] = hosts[item['hostid']]['name']
         items[item['itemid']] = item
     sdc.log.debug('fetch_items_data() took ' + str(time.time() - start) + ' seconds')
     return items
 
 
+class MetadataCache:
+    # hosts, the list of items and their details are refreshed every METADATA_TTL seconds instead of every interval.
+    # With METADATA_TTL 0 details of all items are requested every interval, otherwise the refresh is incremental:
+    # details are requested only for items that are new or changed their value type since the previous refresh,
+    # details of the other items are kept until the pipeline restarts
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.expires_at = 0
+        self.hosts = {}
+        # ordered by itemid asc
+        self.itemids_value_types = []
+        self.items = {}
+
+    def refresh_if_expired(self):
+        if time.time() < self.expires_at:
+            return
+        previous_value_types = dict((item['itemid'], item['value_type']) for item in self.itemids_value_types)
+        self.hosts = fetch_hosts()
+        self.itemids_value_types = query_itemids_value_types()
+
+        itemids = [item['itemid'] for item in self.itemids_value_types]
+        if self.ttl > 0:
+            # ids that are not in the list anymore are dropped
+            items = dict((itemid, self.items[itemid]) for itemid in itemids if itemid in self.items)
+            changed_ids = [
+                item['itemid'] for item in self.itemids_value_types
+                if item['itemid'] not in items or previous_value_types.get(item['itemid']) != item['value_type']
+            ]
+        else:
+            items = {}
+            changed_ids = itemids
+        calls = [(fetch_items_data, ids) for ids in chunks(changed_ids, int(sdc.userParams['ITEMS_BATCH_SIZE']))]
+        for items_chunk in run_concurrently(calls):
+            items.update(items_chunk)
+        self.items = items
+        sdc.log.debug(
+            'metadata refresh - ' + str(len(changed_ids)) + ' items requested, ' + str(len(self.items)) + ' total'
+        )
+        self.expires_at = time.time() + self.ttl
+
+    def get_items(self, itemids):
+        items = {}
+        for itemid in itemids:
+            item = self.items.get(itemid)
+            # there are some template items that we should skip
+            if item is None or item['hostid'] not in self.hosts:
+                continue
+            item['host'] = self.hosts[item['hostid']]['name']
+            items[itemid] = item
+        return items
+
+
 def group_ids_by_value_types(itemids_value_types):
     itemids_by_value_types = {}
     for item in itemids_value_types:
@@ -167,52 +337,119 @@ def group_ids_by_value_types(itemids_value_types):
     return itemids_by_value_types
 
 
+def get_catch_up_intervals_count(records_per_interval, previous_intervals_count):
+    # when the pipeline is behind, histories of several intervals are requested at once, as many as fit
+    # into CATCH_UP_MAX_RECORDS estimated by the number of records in the previous intervals. The window
+    # is at most twice as large as the previous one, so after empty intervals it grows gradually instead of
+    # covering all missed intervals with one request
+    max_records = int(sdc.userParams['CATCH_UP_MAX_RECORDS'])
+    intervals_behind = (get_now_with_delay() - end) // interval + 1
+    if max_records <= 0 or intervals_behind <= 1 or records_per_interval is None:
+        return 1
+    max_intervals_count = min(intervals_behind, previous_intervals_count * 2)
+    if records_per_interval == 0:
+        return int(max_intervals_count)
+    return int(max(1, min(max_intervals_count, max_records // records_per_interval)))
+
+
+def process_histories(histories_list, items, offset):
+    # returns the number of processed records, the last batch is always processed so that in case
+    # when there were no data, we save last processed itemid anyway
+    batch = sdc.createBatch()
+    records_count = 0
+    for histories in histories_list:
+        for history in histories:
+            # add fields from item to every history record
+            history.update(items[history['itemid']])
+            record = sdc.createRecord('record created ' + str(get_now_with_delay()))
+            record.value = history
+            batch.add(record)
+            records_count += 1
+
+            if batch.size() == sdc.batchSize:
+                batch.process(entityName, offset)
+                batch = sdc.createBatch()
+                if sdc.isPreview() and sdc.isStopped():
+                    break
+
+        if sdc.isStopped():
+            break
+    batch.process(entityName, offset)
+    return records_count
+
+
+def process_interval(itemids_value_types):
+    records_count = 0
+    for itemids_value_types_chunk in chunks(itemids_value_types, int(sdc.userParams['ITEMS_BATCH_SIZE'])):
+        itemids = [item['itemid'] for item in itemids_value_types_chunk]
+        items = metadata.get_items(itemids)
+        results = run_concurrently(get_history_calls(itemids_value_types_chunk, 1))
+        records_count += process_histories(results, items, str(end) + '_' + itemids[-1])
+        results.close()
+        if sdc.isStopped():
+            break
+    return records_count
+
+
+def catch_up(itemids_value_types, intervals_count):
+    # histories of all intervals are requested at once and split back by interval, records are processed
+    # in the same order and with the same offsets as if the intervals were processed one by one
+    batches = []
+    for itemids_value_types_chunk in chunks(itemids_value_types, int(sdc.userParams['ITEMS_BATCH_SIZE'])):
+        itemids = [item['itemid'] for item in itemids_value_types_chunk]
+        histories_by_interval = [[] for _ in range(intervals_count)]
+        for histories in run_concurrently(get_history_calls(itemids_value_types_chunk, intervals_count)):
+            split = [[] for _ in range(intervals_count)]
+            for history in histories:
+                idx = get_interval_index(history['clock'])
+                if 0 <= idx < intervals_count:
+                    split[idx].append(history)
+            for idx in range(intervals_count):
+                histories_by_interval[idx].append(split[idx])
+        batches.append((itemids, metadata.get_items(itemids), histories_by_interval))
+
+    records_count = 0
+    for idx in range(intervals_count):
+        interval_end = end + idx * interval
+        for itemids, items, histories_by_interval in batches:
+            records_count += process_histories(
+                histories_by_interval[idx], items, str(interval_end) + '_' + itemids[-1]
+            )
+            histories_by_interval[idx] = None
+            if sdc.isStopped():
+                return records_count
+    return records_count
+
+
 interval = get_interval()
 end = get_backfill_offset() + interval
 sdc.log.info('INTERVAL: ' + str(interval))
 sdc.log.info('TIME_TO: ' + str(end))
-hosts = {}
+metadata = MetadataCache(int(sdc.userParams['METADATA_TTL']))
+records_per_interval = None
+intervals_count = 1
 
 while True:
     try:
-        hosts = fetch_hosts()
+        metadata.refresh_if_expired()
         if end > get_now_with_delay():
             time.sleep(end - get_now_with_delay())
         if sdc.isStopped():
             break
 
         # they are ordered by itemid asc
-        for itemids_value_types in chunks(fetch_itemids_value_types(), int(sdc.userParams['ITEMS_BATCH_SIZE'])):
-            batch = sdc.createBatch()
-            itemids = list(map(
-                lambda x: x['itemid'],
-                itemids_value_types
-            ))
-            items = fetch_items_data(itemids)
-
-            for value_type, ids in group_ids_by_value_types(itemids_value_types).items():
-                for histories in query_history(ids, value_type):
-                    for history in histories:
-                        history.update(items[history['itemid']])
-                        record = sdc.createRecord('record created ' + str(get_now_with_delay()))
-                        record.value = history
-                        batch.add(record)
-
-                        if batch.size() == sdc.batchSize:
-                            batch.process(entityName, str(end) + '_' + itemids[-1])
-                            batch = sdc.createBatch()
-                            if sdc.isPreview() and sdc.isStopped():
-                                break
-
-                    if sdc.isStopped():
-                        break
-
-            # always process batch so that in case when there were no data, we save last processed itemid anyway
-            batch.process(entityName, str(end) + '_' + itemids[-1])
-            if sdc.isStopped():
-                break
-
-        end += interval
+        itemids_value_types = fetch_itemids_value_types()
+        intervals_count = get_catch_up_intervals_count(records_per_interval, intervals_count)
+        # the rest of a partially processed interval is always finished on its own
+        if intervals_count > 1 and len(itemids_value_types) == len(metadata.itemids_value_types):
+            sdc.log.info('Catching up ' + str(intervals_count) + ' intervals, TIME_TO: ' + str(end))
+            records_count = catch_up(itemids_value_types, intervals_count)
+        else:
+            intervals_count = 1
+            records_count = process_interval(itemids_value_types)
+        records_per_interval = records_count // intervals_count
+
+        end += interval * intervals_count
     except Exception as e:
         sdc.log.error(traceback.format_exc())
         raise
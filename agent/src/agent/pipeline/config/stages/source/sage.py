@@ -19,6 +19,7 @@ class SageScript(Stage):
                 {'key': 'DELAY', 'value': str(self.pipeline.delay)},
                 {'key': 'DAYS_TO_BACKFILL', 'value': self.pipeline.days_to_backfill},
                 {'key': 'QUERY_SIZE', 'value': str(self.pipeline.batch_size)},
+                {'key': 'QUERY_WINDOWS', 'value': str(self.pipeline.query_windows)},
             ],
             'script': script
         }
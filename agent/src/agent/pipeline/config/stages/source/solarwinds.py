@@ -28,6 +28,7 @@ class SolarWindsScript(JDBCSource):
                     {'key': 'DELAY_IN_SECONDS', 'value': str(self.pipeline.delay)},
                     {'key': 'DAYS_TO_BACKFILL', 'value': self.pipeline.days_to_backfill},
                     {'key': 'QUERY_TIMEOUT', 'value': str(self.pipeline.source.query_timeout)},
+                    {'key': 'QUERY_THREADS', 'value': str(self.pipeline.query_threads)},
                     {
                         'key': 'MONITORING_URL',
                         'value': urllib.parse.urljoin(
@@ -40,6 +41,5 @@ class SolarWindsScript(JDBCSource):
             }
 
     def _get_timestamp_condition(self) -> str:
-        date_time = f"DateTime('{self.LAST_TIMESTAMP}')"
-        return f'{self.pipeline.timestamp_path} > {date_time}' \
-               f' AND {self.pipeline.timestamp_path} <= AddSecond({self.pipeline.interval}, {date_time})'
+        return f"{self.pipeline.timestamp_path} > DateTime('{self.LAST_TIMESTAMP}')" \
+               f" AND {self.pipeline.timestamp_path} <= DateTime('{source.SolarWindsSource.END_TIMESTAMP}')"
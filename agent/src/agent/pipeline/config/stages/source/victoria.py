@@ -1,3 +1,5 @@
+import json
+
 from agent import source
 from agent.pipeline.config.stages.base import Stage
 
@@ -21,6 +23,9 @@ class VictoriaScript(Stage):
                     {'key': 'VERIFY_SSL', 'value': '1' if self.pipeline.source.config.get('verify_ssl', True) else ''},
                     {'key': 'QUERY_TIMEOUT', 'value': str(self.pipeline.source.query_timeout)},
                     {'key': 'AGGREGATED_METRIC_NAME', 'value': str(self.pipeline.config.get('aggregated_metric_name'))},
+                    {'key': 'MAX_POINTS_PER_REQUEST',
+                     'value': str(self.pipeline.config.get('max_points_per_request', 1))},
+                    {'key': 'SHARDS', 'value': json.dumps(self.pipeline.config.get('shards', []))},
                 ],
                 'script': f.read(),
             }
@@ -22,6 +22,9 @@ class ZabbixScript(Stage):
                     {'key': 'DELAY_IN_MINUTES', 'value': str(self.pipeline.delay)},
                     {'key': 'ITEMS_BATCH_SIZE', 'value': str(self.pipeline.batch_size)},
                     {'key': 'HISTORIES_BATCH_SIZE', 'value': str(self.pipeline.histories_batch_size)},
+                    {'key': 'QUERY_THREADS', 'value': str(self.pipeline.query_threads)},
+                    {'key': 'METADATA_TTL', 'value': str(self.pipeline.metadata_ttl)},
+                    {'key': 'CATCH_UP_MAX_RECORDS', 'value': str(self.pipeline.catch_up_max_records)},
                 ],
                 'script': f.read(),
             }
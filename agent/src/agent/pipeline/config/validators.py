@@ -1,6 +1,6 @@
 import click
 
-from agent.pipeline.validators import elastic_query, jdbc_query
+from agent.pipeline.validators import elastic_query, jdbc_query, solarwinds_query
 from agent import source
 
 
@@ -28,9 +28,19 @@ class JDBCValidator(BaseValidator):
             raise click.ClickException(errors)
 
 
+class SolarWindsValidator(BaseValidator):
+    @staticmethod
+    def validate(pipeline):
+        errors = solarwinds_query.get_errors(pipeline.query, pipeline.query_threads)
+        if errors:
+            raise click.ClickException(' '.join(errors))
+
+
 def get_config_validator(source_type: str) -> BaseValidator:
     if source_type == source.TYPE_ELASTIC:
         return ElasticValidator()
     if source_type in [source.TYPE_MYSQL, source.TYPE_POSTGRES, source.TYPE_CLICKHOUSE]:
         return JDBCValidator()
+    if source_type == source.TYPE_SOLARWINDS:
+        return SolarWindsValidator()
     return BaseValidator()
@@ -277,6 +277,22 @@ class Pipeline(Entity, sdc_client.IPipeline):
     def histories_batch_size(self) -> str:
         return self.config.get('histories_batch_size', 100)
 
+    @property
+    def query_threads(self) -> int:
+        return self.config.get('query_threads', 1)
+
+    @property
+    def metadata_ttl(self) -> int:
+        return self.config.get('metadata_ttl', 0)
+
+    @property
+    def catch_up_max_records(self) -> int:
+        return self.config.get('catch_up_max_records', 0)
+
+    @property
+    def query_windows(self) -> int:
+        return self.config.get('query_windows', 1)
+
     def get_streamsets_config(self) -> dict:
         return pipeline.manager.create_streamsets_pipeline_config(self)
 
@@ -0,0 +1,14 @@
+from agent import source
+
+
+def get_errors(query: str, query_threads: int):
+    errors = []
+    if query_threads > 1 and not is_bounded(query):
+        errors.append(f'Please add {source.JDBCSource.TIMESTAMP_CONDITION} or {source.SolarWindsSource.END_TIMESTAMP}'
+                      f' to the query to query intervals concurrently')
+    return errors
+
+
+def is_bounded(query: str) -> bool:
+    # every concurrently queried window must select only its own interval
+    return source.JDBCSource.TIMESTAMP_CONDITION in query or source.SolarWindsSource.END_TIMESTAMP in query
@@ -11,7 +11,13 @@ SCRIPT_NAME = 'cache_cacti_data'
 start = time.time()
 if __name__ == '__main__':
     try:
-        cacti.cacher.cache_data()
+        for pipeline_id, stats in cacti.cacher.cache_data().items():
+            if isinstance(stats, Exception):
+                # the error is logged by the cacher, other pipelines are refreshed anyway
+                monitoring.increase_scheduled_script_error_counter(SCRIPT_NAME)
+            elif stats:
+                # the duration of every pipeline is exposed by cacti_cache_refresh_time_seconds
+                monitoring.set_cacti_cache_refresh_stats(pipeline_id, *stats)
         monitoring.set_scheduled_script_execution_time(SCRIPT_NAME, time.time() - start)
     except Exception as e:
         logger_.error(str(e))
@@ -200,7 +200,8 @@ class VictoriaMetricsSource(APISource):
 
 
 class SolarWindsSource(APISource):
-    pass
+    # replaced with the end of the queried interval, intervals can be queried concurrently only if the query uses it
+    END_TIMESTAMP = '%end_timestamp%'
 
 
 class ZabbixSource(Source):
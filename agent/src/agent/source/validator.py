@@ -242,7 +242,7 @@ class ZabbixValidator(Validator):
             self.source.config[source.ZabbixSource.URL],
             self.source.config[source.ZabbixSource.USER],
             self.source.config[source.ZabbixSource.PASSWORD],
-        )
+        ).close()
 
 
 class SchemalessValidator(Validator):
@@ -0,0 +1,56 @@
+"""
+Benchmark of fetching a directory of rrd files with a different number of workers
+
+Usage: python -m tests.benchmarks.cacti_fetch [files_count] [workers ...]
+"""
+import os
+import sys
+import tempfile
+import time
+import rrdtool
+
+from agent.data_extractor.cacti import fetcher
+
+STEP = 300
+ROWS = 2016
+DATA_SOURCES = ['traffic_in', 'traffic_out']
+
+
+def create_rrd_files(directory: str, count: int, end: int) -> list:
+    start = end - STEP * ROWS
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f'synthetic_{i}.rrd')
+        rrdtool.create(
+            path,
+            '--start', str(start - STEP),
+            '--step', str(STEP),
+            *[f'DS:{name}:GAUGE:600:U:U' for name in DATA_SOURCES],
+            f'RRA:AVERAGE:0.5:1:{ROWS}',
+        )
+        rrdtool.update(path, *[
+            f'{start + row * STEP}:' + ':'.join(str(row * (idx + 1) + i) for idx in range(len(DATA_SOURCES)))
+            for row in range(ROWS)
+        ])
+        paths.append(path)
+    return paths
+
+
+def run(files_count: int, workers_list: list):
+    end = int(time.time()) // STEP * STEP
+    start = end - STEP * 12
+    with tempfile.TemporaryDirectory() as directory:
+        paths = create_rrd_files(directory, files_count, end)
+        for workers in workers_list:
+            started = time.perf_counter()
+            result = fetcher.fetch_files(paths, str(start), str(end), str(STEP), workers)
+            duration = time.perf_counter() - started
+            assert len(result) == files_count
+            print(f'files: {files_count}, workers: {workers}, duration: {duration:.3f}s')
+
+
+if __name__ == '__main__':
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+        [int(w) for w in sys.argv[2:]] or [1, 2, 4, 8],
+    )
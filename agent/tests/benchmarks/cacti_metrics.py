@@ -0,0 +1,59 @@
+"""
+Micro-benchmark of building and serializing Cacti metrics with deepcopy of a base metric per row
+compared to the Metric records that share item properties
+
+Usage: python -m tests.benchmarks.cacti_metrics [items_count] [rows_per_item]
+"""
+import json
+import sys
+import time
+
+from copy import deepcopy
+from types import MappingProxyType
+from agent.data_extractor.cacti.metric import Metric
+
+
+def get_properties(item_idx: int) -> dict:
+    return {
+        'host_description': f'host-{item_idx // 10}',
+        'graph_title': f'host-{item_idx // 10}-Gi0/{item_idx}-Traffic',
+        'item_title': 'Inbound',
+        'query_ifName': f'Gi0/{item_idx}',
+        'query_ifAlias': f'uplink-{item_idx}',
+        'query_ifIP': f'10.0.{item_idx // 256}.{item_idx % 256}',
+        'host_hostname': f'10.1.{item_idx // 256}.{item_idx % 256}',
+    }
+
+
+def deepcopy_metrics(items_count: int, rows: int):
+    for item_idx in range(items_count):
+        base_metric = {'target_type': 'gauge', 'properties': get_properties(item_idx)}
+        for row in range(rows):
+            metric = deepcopy(base_metric)
+            metric['properties']['what'] = 'traffic_in'
+            metric['value'] = row * 1.5
+            metric['timestamp'] = 1619085000 + row * 300
+            yield metric
+
+
+def record_metrics(items_count: int, rows: int):
+    for item_idx in range(items_count):
+        properties = MappingProxyType(get_properties(item_idx))
+        for row in range(rows):
+            yield Metric(properties, 'traffic_in', row * 1.5, 1619085000 + row * 300)
+
+
+def measure(name: str, metrics, serialize):
+    started = time.perf_counter()
+    count = 0
+    for metric in metrics:
+        serialize(metric)
+        count += 1
+    print(f'{name}: {count} metrics, {time.perf_counter() - started:.3f}s')
+
+
+if __name__ == '__main__':
+    items_count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    measure('deepcopy', deepcopy_metrics(items_count, rows), json.dumps)
+    measure('records', record_metrics(items_count, rows), lambda m: json.dumps(m.to_dict()))
@@ -0,0 +1,44 @@
+"""
+Benchmark of reading data sources of a directory of rrd files with rrdtool.fetch per file
+compared to batched rrdtool.xport calls
+
+Usage: python -m tests.benchmarks.cacti_xport [files_count] [workers]
+"""
+import sys
+import tempfile
+import time
+
+from agent.data_extractor import cacti
+from tests.benchmarks.cacti_fetch import create_rrd_files, DATA_SOURCES, STEP
+
+
+def fetch_engine(paths: list, start: str, end: str, step: str, workers: int) -> dict:
+    fetched = cacti.fetcher.fetch_files(paths, start, end, step, workers)
+    return {
+        path: cacti.fetcher.extract_columns(fetched[path], set(DATA_SOURCES), start, end, step)
+        for path in paths
+    }
+
+
+def xport_engine(paths: list, start: str, end: str, step: str, workers: int) -> dict:
+    return cacti.xport.fetch_columns({path: DATA_SOURCES for path in paths}, start, end, step, workers)
+
+
+def run(files_count: int, workers: int):
+    end = int(time.time()) // STEP * STEP
+    start = end - STEP * 12
+    with tempfile.TemporaryDirectory() as directory:
+        paths = create_rrd_files(directory, files_count, end)
+        results = []
+        for name, engine in [('fetch', fetch_engine), ('xport', xport_engine)]:
+            started = time.perf_counter()
+            results.append(engine(paths, str(start), str(end), str(STEP), workers))
+            print(f'{name}: files: {files_count}, workers: {workers}, duration: {time.perf_counter() - started:.3f}s')
+        assert results[0] == results[1]
+
+
+if __name__ == '__main__':
+    run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1,
+    )
@@ -0,0 +1,145 @@
+"""
+Benchmark of setting pipeline metrics from jmx requested per pipeline compared to one jmx of all pipelines
+of a StreamSets, the jmx is read from tests/input_files/jmx_pipelines.json.gz
+
+Usage: python -m tests.benchmarks.monitoring_jmx [repeats]
+       python -m tests.benchmarks.monitoring_jmx create [pipelines_count] - recreates the fixture
+"""
+import gzip
+import json
+import sys
+import time
+
+from agent.monitoring import metrics, streamsets
+from tests.conftest import get_input_file_path
+
+FIXTURE = 'jmx_pipelines.json.gz'
+STREAMSETS_URL = 'http://dc:18630'
+# stages of the base pipelines, every stage has the same set of beans
+STAGES = ['source', 'JavaScriptEvaluator_01', 'ExpressionEvaluator_02', 'transform_records', 'event_add_metadata_tags',
+          'events_destination', 'destination']
+TIMER_ATTRIBUTES = ['Count', 'Max', 'Mean', 'Min', 'StdDev', '50thPercentile', '75thPercentile', '95thPercentile',
+                    '98thPercentile', '99thPercentile', '999thPercentile', 'MeanRate', 'OneMinuteRate',
+                    'FiveMinuteRate', 'FifteenMinuteRate']
+METER_ATTRIBUTES = ['Count', 'MeanRate', 'OneMinuteRate', 'FiveMinuteRate', 'FifteenMinuteRate']
+
+
+def _bean(name: str, type_: str, idx: int) -> dict:
+    bean = {
+        'name': f'metrics:name={name}.{type_}',
+        'modelerType': f'com.codahale.metrics.JmxReporter$Jmx{type_.title()}',
+    }
+    if type_ == 'counter':
+        bean['Count'] = idx * 7
+    elif type_ == 'timer':
+        bean.update({attribute: float(idx % 100 + i) for i, attribute in enumerate(TIMER_ATTRIBUTES)})
+        bean['Count'] = idx * 3
+        bean['RateUnit'] = 'events/second'
+        bean['DurationUnit'] = 'milliseconds'
+    elif type_ == 'meter':
+        bean.update({attribute: float(idx % 10 + i) for i, attribute in enumerate(METER_ATTRIBUTES)})
+        bean['Count'] = idx * 5
+        bean['RateUnit'] = 'events/second'
+    return bean
+
+
+def create_jmx(pipelines_count: int) -> dict:
+    # the same beans as StreamSets returns for metrics:name=sdc.pipeline.*
+    beans = []
+    for idx in range(pipelines_count):
+        prefix = f'sdc.pipeline.test_jmx_{idx}.0'
+        for name in ['batchProcessing', 'batchInputRecords', 'batchOutputRecords', 'batchErrorRecords']:
+            beans.append(_bean(f'{prefix}.pipeline.{name}', 'timer' if name == 'batchProcessing' else 'meter', idx))
+            beans.append(_bean(f'{prefix}.pipeline.{name}', 'counter', idx))
+        for stage in STAGES:
+            beans.append(_bean(f'{prefix}.stage.{stage}.batchProcessing', 'timer', idx))
+            for name in ['inputRecords', 'outputRecords', 'errorRecords', 'stageErrors']:
+                beans.append(_bean(f'{prefix}.stage.{stage}.{name}', 'meter', idx))
+                beans.append(_bean(f'{prefix}.stage.{stage}.{name}', 'counter', idx))
+    return {'beans': beans}
+
+
+def load_jmx() -> dict:
+    with gzip.open(get_input_file_path(FIXTURE), 'rt') as f:
+        return json.load(f)
+
+
+def get_pipelines(jmx: dict) -> dict:
+    names = {bean['name'].split('.')[2] for bean in jmx['beans']}
+    return {name: ((STREAMSETS_URL, name, 'mysql'), False) for name in names}
+
+
+def split_by_pipeline(jmx: dict, pipelines: dict) -> dict:
+    # the same responses as StreamSets returns for metrics:name=sdc.pipeline.<name>.*
+    responses = {name: {'beans': []} for name in pipelines}
+    for bean in jmx['beans']:
+        responses[bean['name'].split('.')[2]]['beans'].append(bean)
+    return responses
+
+
+def per_pipeline(responses: dict, pipelines: dict):
+    # every response is checked with the endswith chain
+    values = _get_counter_values()
+    for name, (labels, is_influx) in pipelines.items():
+        for bean in responses[name]['beans']:
+            if bean['name'].endswith('source.batchProcessing.timer'):
+                streamsets._set_latency(metrics.PIPELINE_SOURCE_LATENCY, metrics.PIPELINE_SOURCE_LATENCY_QUANTILES,
+                                        labels, bean, values)
+            elif bean['name'].endswith('source.outputRecords.counter') and not is_influx:
+                streamsets._increase_counter(bean['Count'], metrics.PIPELINE_INCOMING_RECORDS, labels, values)
+            elif bean['name'].endswith('source.outputRecords.meter') and not is_influx:
+                streamsets._set_rate(metrics.PIPELINE_INCOMING_RECORDS_RATE, labels, bean, values)
+            elif bean['name'].endswith('transform_records.outputRecords.counter') and is_influx:
+                streamsets._increase_counter(bean['Count'], metrics.PIPELINE_INCOMING_RECORDS, labels, values)
+            elif bean['name'].endswith('transform_records.outputRecords.meter') and is_influx:
+                streamsets._set_rate(metrics.PIPELINE_INCOMING_RECORDS_RATE, labels, bean, values)
+            elif bean['name'].endswith('destination.batchProcessing.timer'):
+                streamsets._set_latency(metrics.PIPELINE_DESTINATION_LATENCY,
+                                        metrics.PIPELINE_DESTINATION_LATENCY_QUANTILES, labels, bean, values)
+            elif bean['name'].endswith('destination.outputRecords.counter'):
+                streamsets._increase_counter(bean['Count'], metrics.PIPELINE_OUTGOING_RECORDS, labels, values)
+            elif bean['name'].endswith('destination.outputRecords.meter'):
+                streamsets._set_rate(metrics.PIPELINE_OUTGOING_RECORDS_RATE, labels, bean, values)
+            elif bean['name'].endswith('pipeline.batchErrorRecords.counter'):
+                streamsets._increase_counter(bean['Count'], metrics.PIPELINE_ERROR_RECORDS, labels, values)
+
+
+def bulk(jmx: dict, pipelines: dict):
+    streamsets._set_pipelines_metrics(pipelines, _get_counter_values(), jmx)
+
+
+def _get_counter_values() -> dict:
+    return metrics.get_counter_values(
+        metrics.PIPELINE_INCOMING_RECORDS, metrics.PIPELINE_OUTGOING_RECORDS, metrics.PIPELINE_ERROR_RECORDS
+    )
+
+
+def get_samples() -> list:
+    return [sample for metric in metrics.get_registry().collect() for sample in metric.samples
+            if sample.labels.get('streamsets_url') == STREAMSETS_URL and not sample.name.endswith('_created')]
+
+
+def run(repeats: int):
+    jmx = load_jmx()
+    pipelines = get_pipelines(jmx)
+    results = []
+    for name, func, data in [
+        ('per pipeline', per_pipeline, split_by_pipeline(jmx, pipelines)),
+        ('bulk', bulk, jmx),
+    ]:
+        started = time.perf_counter()
+        for _ in range(repeats):
+            func(data, pipelines)
+        print(f'{name}: pipelines: {len(pipelines)}, beans: {len(jmx["beans"])}, '
+              f'duration: {(time.perf_counter() - started) / repeats:.4f}s')
+        results.append(get_samples())
+    # gauges are set to the same values and counters are not increased again
+    assert results[0] == results[1]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'create':
+        with gzip.open(get_input_file_path(FIXTURE), 'wt') as f:
+            json.dump(create_jmx(int(sys.argv[2]) if len(sys.argv) > 2 else 400), f)
+    else:
+        run(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
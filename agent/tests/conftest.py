@@ -1,10 +1,16 @@
+import ast
 import json
 import os
+import tempfile
 import pytest
 
+# loggers are created when agent modules are imported, so test runs don't write agent.log into the working directory
+os.environ.setdefault('LOG_FILE_PATH', os.path.join(tempfile.gettempdir(), 'agent_tests.log'))
+
 from click.testing import CliRunner
 from agent import di
 from agent.api import main
+from agent.modules import constants
 
 DUMMY_DESTINATION_OUTPUT_PATH = '/output'
 TEST_DATASETS_PATH = '/home'
@@ -37,6 +43,16 @@ def get_input_file_path(name):
     return os.path.join(INPUT_FILES_DIR, f'{name}')
 
 
+def load_jython_functions(script_name: str, names: list, **globals_) -> dict:
+    # jython scripts run their loop when they are executed, so only the needed functions are taken from them
+    path = os.path.join(constants.ROOT_DIR, 'pipeline', 'config', 'jython_scripts', script_name)
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    tree.body = [node for node in tree.body if isinstance(node, ast.FunctionDef) and node.name in names]
+    exec(compile(tree, path, 'exec'), globals_)
+    return globals_
+
+
 def pytest_generate_tests(metafunc):
     # called once per each test function
     if metafunc.cls is None or not hasattr(metafunc.cls, 'params') or metafunc.function.__name__ not in metafunc.cls.params:
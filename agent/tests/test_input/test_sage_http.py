@@ -9,7 +9,7 @@ class TestSage(TestInputBase):
     params = {
         'test_create': [
             {'name': 'test_sage_value_const', 'options': ['-a'], 'value': 'y\nclicksS\ny\n\n \n ',
-             'advanced_options': 'key1:val1\n\n\n'},
+             'advanced_options': 'key1:val1\n\n1\n'},
             {'name': 'test_sage', 'options': [], 'value': 'n\nClicks:gauge\nClicks:clicks',
              'advanced_options': '\n\n'}],
         'test_edit': [{'options': ['-a', 'test_sage_value_const'], 'value': 'y\nclicks\n\n\n\n'}],
@@ -35,7 +35,7 @@ class TestVictoria(TestInputBase):
         days_to_backfill = (datetime.now() - datetime(year=2020, month=7, day=7)).days + 1
         result = cli_runner.invoke(
             cli.pipeline.create, ["-a"], catch_exceptions=False,
-            input=f'test_victoria\n{name}\n{query}\naggregated_metric\n{days_to_backfill}\n{interval}\n\nstatic:dimension\ntag:value\n'
+            input=f'test_victoria\n{name}\n{query}\naggregated_metric\n{days_to_backfill}\n{interval}\n\n\n{{__name__=~".+"}}\nstatic:dimension\ntag:value\n'
         )
         assert result.exit_code == 0
 
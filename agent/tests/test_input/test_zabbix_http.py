@@ -55,6 +55,9 @@ class TestZabbix(TestInputBase):
             'query file': '',
             'items batch size': '',
             'histories batch size': 50,
+            'query threads': '',
+            'metadata ttl': '',
+            'catch up max records': '',
             'days to backfill': days_to_backfill,
             'query interval': '',
             'data preview': 'y',
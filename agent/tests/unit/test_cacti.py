@@ -0,0 +1,319 @@
+import json
+import os
+import tarfile
+import pytest
+
+from types import SimpleNamespace
+
+from agent.api.routes import cacti_source
+from agent.data_extractor import cacti
+
+
+def _get_graphs(graphs: dict) -> list:
+    return [cacti.cacher.CactiCacheGraph('test_cacti', int(graph_id), graph) for graph_id, graph in graphs.items()]
+
+
+def _item(data_source_path: str, data_source_name: str) -> dict:
+    return {'data_source_path': data_source_path, 'data_source_name': data_source_name, 'item_title': ''}
+
+
+def test_plan_groups_items_by_file_and_data_source(tmp_path):
+    (tmp_path / 'a.rrd').touch()
+    (tmp_path / 'b.rrd').touch()
+    graphs = [
+        {'items': {
+            '11': _item('<path_rra>/a.rrd', 'traffic_in'),
+            '12': _item('<path_rra>/a.rrd', 'traffic_out'),
+            '13': _item('<path_rra>/missing.rrd', 'traffic_in'),
+        }},
+        {'items': {
+            '21': _item('<path_rra>/b.rrd', 'traffic_in'),
+            '22': _item('<path_rra>/a.rrd', 'traffic_in'),
+            '23': _item('/not/in/rra/a.rrd', 'traffic_in'),
+            '24': _item('', 'traffic_in'),
+        }},
+    ]
+    plan = cacti.planner.build(graphs, str(tmp_path))
+
+    a, b = str(tmp_path / 'a.rrd'), str(tmp_path / 'b.rrd')
+    assert list(plan.files.keys()) == [a, b]
+    assert {name: len(items) for name, items in plan.files[a].items()} == {'traffic_in': 2, 'traffic_out': 1}
+    assert {name: len(items) for name, items in plan.files[b].items()} == {'traffic_in': 1}
+    assert [path for path, _, _ in plan.items] == [a, a, b, a]
+
+
+def test_plan_contains_a_page_of_items(tmp_path):
+    (tmp_path / 'a.rrd').touch()
+    (tmp_path / 'b.rrd').touch()
+    (tmp_path / 'c.rrd').touch()
+    graphs = [
+        {'items': {
+            '11': _item('<path_rra>/a.rrd', 'traffic_in'),
+            '12': _item('<path_rra>/missing.rrd', 'traffic_in'),
+            '13': _item('<path_rra>/b.rrd', 'traffic_in'),
+        }},
+        {'items': {
+            '21': _item('<path_rra>/c.rrd', 'traffic_in'),
+        }},
+    ]
+    first_page = cacti.planner.build(graphs, str(tmp_path), 0, 2)
+    last_page = cacti.planner.build(graphs, str(tmp_path), 2, 2)
+
+    assert [path for path, _, _ in first_page.items] == [str(tmp_path / 'a.rrd'), str(tmp_path / 'b.rrd')]
+    assert first_page.next_cursor == 2
+    assert list(last_page.files.keys()) == [str(tmp_path / 'c.rrd')]
+    assert last_page.next_cursor is None
+
+
+@pytest.mark.parametrize("result, data_source_names, expected_result", [
+    (
+        ((900, 2100, 300), ('in', 'out', 'other'), [(1, 2, 3), (None, 5, 6), (7, 8, 9), (10, 11, 12)]),
+        {'in', 'out'},
+        {'in': [(1500, 7)], 'out': [(1200, 5), (1500, 8)]},
+    ),
+    (
+        ((600, 2100, 300), ('in',), [(1,), (2,), (3,), (4,), (5,)]),
+        {'in'},
+        {'in': [(1200, 3), (1500, 4)]},
+    ),
+    (
+        ((900, 2100, 60), ('in',), [(1,), (2,)]),
+        {'in'},
+        {},
+    ),
+])
+def test_extract_columns(result, data_source_names, expected_result):
+    assert cacti.fetcher.extract_columns(result, data_source_names, '1000', '1800', '300') == expected_result
+
+
+def test_metric_to_dict_does_not_modify_shared_properties():
+    properties = {'host_description': 'host'}
+    metrics = [cacti.metric.Metric(properties, 'traffic_in', value, 1200) for value in [1, 2]]
+
+    assert [metric.to_dict() for metric in metrics] == [
+        {'target_type': 'gauge', 'properties': {'host_description': 'host', 'what': 'traffic_in'}, 'value': 1, 'timestamp': 1200},
+        {'target_type': 'gauge', 'properties': {'host_description': 'host', 'what': 'traffic_in'}, 'value': 2, 'timestamp': 1200},
+    ]
+    assert properties == {'host_description': 'host'}
+
+
+@pytest.mark.parametrize("add_graph_name_dimension, expected_result", [
+    (False, {'host_description': 'Host_1', 'query_ifName': 'eth0', 'item_title': 'In_eth0'}),
+    (True, {'host_description': 'Host_1', 'query_ifName': 'eth0', 'graph_title': 'Host_1_-_eth0', 'item_title': 'In_eth0'}),
+])
+def test_cache_dimensions(add_graph_name_dimension, expected_result):
+    item = {**_item('<path_rra>/a.rrd', 'traffic_in'), 'item_title': 'In |query_ifName|', 'variables': {'ifName': 'eth0'}}
+    graphs = {1: {
+        'title': '|host_description| - |query_ifName|',
+        'host_id': '1',
+        'variables': {'ifName': 'eth0'},
+        'items': {'11': item},
+    }}
+
+    cacti.cacher._add_dimensions(graphs, {1: {'description': 'Host 1'}}, add_graph_name_dimension)
+
+    assert item[cacti.cacher.CactiCache.DIMENSIONS] == expected_result
+
+
+def test_cache_has_dimensions():
+    cache = cacti.cacher.CactiCache('test_cacti', {'hosts': {}}, None)
+    assert not cache.has_dimensions(False)
+
+    cache.data[cacti.cacher.CactiCache.ADD_GRAPH_NAME_DIMENSION] = True
+    assert cache.has_dimensions(True)
+    assert not cache.has_dimensions(False)
+
+
+def test_lru_evicts_least_recently_used():
+    cacti.lru.clear()
+    graphs = {1: {'items': {'11': {}, '12': {}}}}
+    cacti.lru.put('a', (1, True), graphs, max_size=4)
+    cacti.lru.put('b', (1, True), graphs, max_size=4)
+    assert cacti.lru.get('a', (1, True)) is graphs
+    assert cacti.lru.get('a', (2, True)) is None
+
+    cacti.lru.put('c', (1, True), graphs, max_size=4)
+    assert cacti.lru.get('b', (1, True)) is None
+    assert cacti.lru.get('a', (1, True)) is graphs
+    assert cacti.lru.get('c', (1, True)) is graphs
+
+    cacti.lru.put('d', (1, True), {1: {'items': {str(i): {} for i in range(5)}}}, max_size=4)
+    assert cacti.lru.get('d', (1, True)) is None
+    assert cacti.lru.is_oversized('d', (1, True))
+    assert not cacti.lru.is_oversized('d', (2, True))
+    assert not cacti.lru.is_oversized('a', (1, True))
+    cacti.lru.clear()
+
+
+class FakeCacher:
+    def __init__(self, delta: dict):
+        self.delta = delta
+        self.requested = None
+
+    def get_data(self, graph_ids=None, host_ids=None):
+        self.requested = (sorted(graph_ids), sorted(host_ids))
+        return self.delta
+
+
+class FakeGraphsRepository:
+    def __init__(self, graphs: dict):
+        self.graphs = {graph.graph_id: graph for graph in _get_graphs(graphs)}
+
+    def get_graphs(self, pipeline_, graph_ids=None, host_ids=None):
+        return [
+            graph for graph in self.graphs.values()
+            if (graph_ids is None or graph.graph_id in graph_ids) and (host_ids is None or graph.host_id in host_ids)
+        ]
+
+    def update_graphs(self, pipeline_id, graphs, changed_graph_ids):
+        for graph_id in changed_graph_ids:
+            self.graphs.pop(graph_id, None)
+        self.graphs.update({graph.graph_id: graph for graph in _get_graphs(graphs)})
+
+
+def test_cache_patch_fetches_only_changed_graphs_and_hosts(monkeypatch):
+    def graph(title, host_id):
+        return {'title': title, 'host_id': host_id, 'items': {'1': _item('<path_rra>/a.rrd', 'traffic_in')}}
+
+    hosts = {'1': {'description': 'Host 1'}, '2': {'description': 'Host 2'}}
+    graphs = {'1': graph('unchanged', '1'), '2': graph('changed', '1'), '3': graph('removed', '1'), '4': graph('|host_description|', '2')}
+    cacti.cacher._add_dimensions(graphs, hosts, False)
+    repository = FakeGraphsRepository(graphs)
+    monkeypatch.setattr(cacti.repository, 'get_graphs', repository.get_graphs)
+    monkeypatch.setattr(cacti.repository, 'update_graphs', repository.update_graphs)
+    data = {
+        'hosts': hosts,
+        'checksums': {'graphs': {'1': 1, '2': 2, '3': 3, '4': 4}, 'hosts': {'1': 1, '2': 2}},
+        'add_graph_name_dimension': False,
+    }
+    cacher_ = FakeCacher({'graphs': {2: graph('new title', '1'), 5: graph('added', '1')}, 'hosts': {2: {'description': 'Host 2 new'}}})
+    checksums = {'graphs': {'1': 1, '2': 22, '4': 4, '5': 5}, 'hosts': {'1': 1, '2': 22}}
+
+    assert cacti.cacher._patch(SimpleNamespace(name='test_cacti'), data, cacher_, checksums, False) == (3, 1)
+    assert cacher_.requested == (['2', '3', '5'], ['2'])
+    assert {graph_id: graph.data['title'] for graph_id, graph in repository.graphs.items()} == \
+           {1: 'unchanged', 2: 'new title', 4: '|host_description|', 5: 'added'}
+    assert repository.graphs[4].items['1']['dimensions'] == {'host_description': 'Host_2_new'}
+    assert repository.graphs[5].items['1']['dimensions'] == {'host_description': 'Host_1'}
+    assert data['hosts'] == {'1': {'description': 'Host 1'}, '2': {'description': 'Host 2 new'}}
+
+
+class FakeEngine:
+    def __init__(self, connection_string):
+        self.connection_string = connection_string
+        self.disposed = False
+
+    def dispose(self):
+        self.disposed = True
+
+
+def test_cache_data_shares_engines_and_isolates_failures(monkeypatch):
+    def pipeline_(name, connection_string):
+        return SimpleNamespace(name=name, source=SimpleNamespace(config={'mysql_connection_string': connection_string}))
+
+    def cache_pipeline_data(p, *, engine):
+        if p.name == 'failing':
+            raise Exception('Cacti db is not available')
+        return cacti.cacher.RefreshStats(1, 1, 1, False), engine
+
+    engines = []
+    monkeypatch.setattr(cacti.cacher.pipeline.repository, 'get_by_type', lambda type_: [
+        pipeline_('a', 'mysql://one'), pipeline_('failing', 'mysql://one'), pipeline_('b', 'mysql://two'),
+    ])
+    monkeypatch.setattr(cacti.repository, 'create_cacti_engine', lambda cs, size: engines.append(FakeEngine(cs)) or engines[-1])
+    monkeypatch.setattr(cacti.cacher, 'cache_pipeline_data', cache_pipeline_data)
+
+    result = cacti.cacher.cache_data(workers=2)
+
+    assert [engine.connection_string for engine in engines] == ['mysql://one', 'mysql://two']
+    assert all(engine.disposed for engine in engines)
+    assert result['a'] == (cacti.cacher.RefreshStats(1, 1, 1, False), engines[0])
+    assert result['b'] == (cacti.cacher.RefreshStats(1, 1, 1, False), engines[1])
+    assert isinstance(result['failing'], Exception)
+
+
+def test_cache_data_skips_misconfigured_pipelines(monkeypatch):
+    def create_cacti_engine(connection_string, size):
+        if connection_string == 'mysql://unavailable':
+            raise Exception('Invalid connection string')
+        engines.append(FakeEngine(connection_string))
+        return engines[-1]
+
+    engines = []
+    monkeypatch.setattr(cacti.cacher.pipeline.repository, 'get_by_type', lambda type_: [
+        SimpleNamespace(name='a', source=SimpleNamespace(config={'mysql_connection_string': 'mysql://one'})),
+        SimpleNamespace(name='no_connection', source=SimpleNamespace(config={})),
+        SimpleNamespace(name='unavailable', source=SimpleNamespace(config={'mysql_connection_string': 'mysql://unavailable'})),
+    ])
+    monkeypatch.setattr(cacti.repository, 'create_cacti_engine', create_cacti_engine)
+    monkeypatch.setattr(cacti.cacher, 'cache_pipeline_data', lambda p, *, engine: engine)
+
+    result = cacti.cacher.cache_data(workers=2)
+
+    assert result['a'] is engines[0]
+    assert engines[0].disposed
+    assert isinstance(result['no_connection'], KeyError)
+    assert isinstance(result['unavailable'], Exception)
+
+
+def _make_archive(path, files: dict):
+    # files are name -> (content, mtime)
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, (content, mtime) in files.items():
+            file_path = path.parent / name
+            file_path.write_text(content)
+            os.utime(file_path, (mtime, mtime))
+            tar.add(file_path, arcname=name)
+
+
+def test_archive_extracts_only_changed_members(tmp_path):
+    archive_path, target = tmp_path / 'rrd.tar.gz', str(tmp_path / 'rrd' / 'pipeline')
+    _make_archive(archive_path, {'a.rrd': ('a', 1000), 'b.rrd': ('b', 1000)})
+    cacti.archive.extract(str(archive_path), target)
+    first_generation = os.readlink(target)
+    unchanged_inode = os.stat(os.path.join(target, 'a.rrd')).st_ino
+
+    cacti.archive.extract(str(archive_path), target)
+    assert os.readlink(target) == first_generation
+
+    _make_archive(archive_path, {'a.rrd': ('a', 1000), 'b.rrd': ('b2', 2000)})
+    os.utime(archive_path, (3000, 3000))
+    cacti.archive.extract(str(archive_path), target)
+
+    assert os.readlink(target) != first_generation
+    assert os.stat(os.path.join(target, 'a.rrd')).st_ino == unchanged_inode
+    assert open(os.path.join(target, 'b.rrd')).read() == 'b2'
+    # the previous generation is kept for readers that still use it
+    assert open(os.path.join(first_generation, 'b.rrd')).read() == 'b'
+
+
+def test_xport_columns_match_fetch_columns(monkeypatch):
+    # the second file doesn't have the 300s step, so the batch is consolidated to 600s and fetched file by file
+    fetch_results = {
+        'a.rrd': ((900, 2100, 300), ('in', 'out'), [(1, 2), (None, 5), (7, 8), (10, 11)]),
+        'b.rrd': ((600, 2400, 600), ('in',), [(1,), (2,), (3,)]),
+    }
+    exports = [
+        {'meta': {'start': 900, 'step': 300}, 'data': [(1, 2), (None, 5), (7, 8), (10, 11)]},
+        {'meta': {'start': 600, 'step': 600}, 'data': [(1, 2, 1), (7, 8, 2)]},
+    ]
+    monkeypatch.setattr(cacti.xport.rrdtool, 'xport', lambda *args: exports.pop(0), raising=False)
+    monkeypatch.setattr(cacti.xport.rrdtool, 'fetch', lambda path, cf, args: fetch_results[path], raising=False)
+
+    expected = {'a.rrd': {'in': [(1500, 7)], 'out': [(1200, 5), (1500, 8)]}}
+    assert cacti.xport._export([('a.rrd', ['in', 'out']), ('c.rrd', [])], '1000', '1800', '300') == {**expected, 'c.rrd': {}}
+    assert cacti.xport._export([('a.rrd', ['in', 'out']), ('b.rrd', ['in'])], '1000', '1800', '300') == {**expected, 'b.rrd': {}}
+
+
+def test_streamed_response_ends_with_error():
+    def metrics():
+        yield cacti.metric.Metric({}, 'traffic_in', 1, 1200)
+        raise Exception('rrd file is corrupted')
+
+    assert json.loads(''.join(cacti_source._to_json_array(metrics()))) == [
+        {'target_type': 'gauge', 'properties': {'what': 'traffic_in'}, 'value': 1, 'timestamp': 1200},
+        {'error': 'rrd file is corrupted'},
+    ]
+    assert [json.loads(line) for line in ''.join(cacti_source._to_ndjson(metrics())).splitlines()][-1] == \
+        {'error': 'rrd file is corrupted'}
+
@@ -0,0 +1,176 @@
+import gzip
+import json
+import time
+import pytest
+import sdc_client
+
+from types import SimpleNamespace
+from prometheus_client.metrics_core import Metric
+from agent import monitoring, pipeline, streamsets
+from agent.monitoring import metrics
+
+
+def _patch(monkeypatch, jmx: dict):
+    streamsets_ = SimpleNamespace(id=1, url='http://dc:18630')
+    pipelines = [
+        SimpleNamespace(name=name, streamsets_id=1, streamsets=streamsets_, source=SimpleNamespace(type=type_),
+                        uses_schema=False, get_offset=lambda offset=offset: offset)
+        for name, type_, offset in [
+            ('test_monitoring', 'mysql', '{"version": 2, "offsets": {"": "100"}}'),
+            ('test_monitoring.2', 'mysql', None),
+            ('test_monitoring_zabbix', 'zabbix', '{"version": 2, "offsets": {"": "%d_15"}}' % (time.time() - 60)),
+            ('test_monitoring_sage', 'sage', '{"version": 2, "offsets": {"": "2020-01-01T00:00:00Z"}}'),
+        ]
+    ]
+    requests = []
+
+    def get_jmx(streamsets__, query):
+        requests.append(query)
+        if query not in jmx:
+            raise Exception(f'No jmx for {query}')
+        return jmx[query]
+
+    monkeypatch.setattr(streamsets.repository, 'get_all', lambda: [streamsets_])
+    monkeypatch.setattr(pipeline.repository, 'get_all', lambda: pipelines)
+    monkeypatch.setattr(sdc_client, 'get_jmx', get_jmx)
+    return requests
+
+
+def test_pull_metrics(monkeypatch):
+    # kafka jmx fails, metrics of pipelines are still set, beans of both pipelines are returned by one request
+    requests = _patch(monkeypatch, {
+        monitoring.streamsets.SYSTEM_QUERY: {'beans': [
+            {'name': 'java.lang:type=OperatingSystem', 'ProcessCpuLoad': 0.5},
+        ]},
+        monitoring.streamsets.PIPELINES_QUERY: {'beans': [
+            {'name': 'metrics:name=sdc.pipeline.test_monitoring.0.stage.source.batchProcessing.timer', 'Mean': 1500},
+            {'name': 'metrics:name=sdc.pipeline.test_monitoring.2.0.stage.source.batchProcessing.timer', 'Mean': 500},
+            {'name': 'metrics:name=sdc.pipeline.test_monitoring.2.0.stage.destination.outputRecords.counter',
+             'Count': 10},
+            {'name': 'metrics:name=sdc.pipeline.test_monitoring.0.stage.source.inputRecords.counter', 'Count': 10},
+            {'name': 'metrics:name=sdc.pipeline.test_monitoring.0.stage.destination.batchProcessing.timer',
+             'Mean': 2000, '50thPercentile': 1000, '99thPercentile': 5000},
+            {'name': 'metrics:name=sdc.pipeline.test_monitoring.0.stage.source.outputRecords.meter',
+             'OneMinuteRate': 2.5},
+            {'name': 'metrics:name=sdc.pipeline.unknown.0.stage.source.batchProcessing.timer', 'Mean': 100},
+        ]},
+    })
+    monitoring.streamsets.pull_metrics(workers=2)
+
+    assert sorted(requests) == sorted([
+        monitoring.streamsets.SYSTEM_QUERY, monitoring.streamsets.KAFKA_QUERY, monitoring.streamsets.PIPELINES_QUERY
+    ])
+    assert metrics.STREAMSETS_CPU.labels('http://dc:18630')._value.get() == 0.5
+    assert metrics.PIPELINE_SOURCE_LATENCY.labels('http://dc:18630', 'test_monitoring', 'mysql')._value.get() == 1.5
+    assert metrics.PIPELINE_SOURCE_LATENCY.labels('http://dc:18630', 'test_monitoring.2', 'mysql')._value.get() == 0.5
+    assert metrics.PIPELINE_OUTGOING_RECORDS.labels('http://dc:18630', 'test_monitoring.2', 'mysql')._value.get() == 10
+    assert metrics.PIPELINE_OUTGOING_RECORDS.labels('http://dc:18630', 'test_monitoring', 'mysql')._value.get() == 0
+
+    labels = ('http://dc:18630', 'test_monitoring', 'mysql')
+    assert metrics.PIPELINE_DESTINATION_LATENCY_QUANTILES.labels(*labels, '0.99')._value.get() == 5
+    assert metrics.PIPELINE_DESTINATION_LATENCY_QUANTILES.labels(*labels, '0.5')._value.get() == 1
+    assert metrics.PIPELINE_INCOMING_RECORDS_RATE.labels(*labels)._value.get() == 2.5
+
+
+def test_offset_lag(monkeypatch):
+    # the lag is set only for pipelines with interval-based offsets
+    _patch(monkeypatch, {})
+    monitoring.streamsets.pull_metrics()
+
+    lags = {
+        sample.labels['pipeline_id']: sample.value
+        for sample in metrics.PIPELINE_OFFSET_LAG.collect()[0].samples
+    }
+    assert 'test_monitoring' not in lags
+    assert 60 <= lags['test_monitoring_zabbix'] < 70
+    assert lags['test_monitoring_sage'] == pytest.approx(time.time() - 1577836800, abs=10)
+
+
+def test_collect(monkeypatch):
+    _patch(monkeypatch, {})
+    monitoring.collector.collect()
+    monitoring.collector.set_snapshot_age()
+
+    assert metrics.MONITORING_COLLECTION_DURATION._value.get() >= 0
+    assert 0 <= metrics.MONITORING_SNAPSHOT_AGE._value.get() < 1
+
+
+def test_get_last_values():
+    # the value of the process that set the gauge last is kept, the pid label is removed
+    family = Metric('pipeline_source_latency_seconds', 'Pipeline source latency', 'gauge')
+    updated = Metric('pipeline_source_latency_seconds_updated', 'Time it was set', 'gauge')
+    for pid, value, updated_at in [('1', 1.5, 100), ('2', 0.5, 200), ('3', 2.5, 150)]:
+        family.add_sample(family.name, {'pipeline_id': 'test', 'pid': pid}, value)
+        updated.add_sample(updated.name, {'pipeline_id': 'test', 'pid': pid}, updated_at)
+    family.add_sample(family.name, {'pipeline_id': 'test_2', 'pid': '1'}, 3)
+
+    merged = metrics._get_last_values(family, updated)
+
+    assert sorted((sample.labels['pipeline_id'], sample.value) for sample in merged.samples) == [
+        ('test', 0.5), ('test_2', 3)
+    ]
+    assert all('pid' not in sample.labels for sample in merged.samples)
+
+
+def _sample(name: str, value: float, target_type: str = 'gauge') -> dict:
+    return {'value': value, 'timestamp': 0, 'properties': {'what': name, 'ver': 1, 'target_type': target_type}}
+
+
+def test_send(monkeypatch):
+    # data is sent in gzipped chunks, after a failure the rest is sent first with the next data
+    responses = [SimpleNamespace(status_code=200, text='')] * 2 + [SimpleNamespace(status_code=503, text='')] \
+        + [SimpleNamespace(status_code=200, text='')] * 4
+    bodies = []
+
+    def post(url, data, headers, proxies, timeout):
+        bodies.append(json.loads(gzip.decompress(data)))
+        return responses[len(bodies) - 1]
+
+    monkeypatch.setattr(monitoring.sender, '_get_session', lambda: SimpleNamespace(post=post))
+    monkeypatch.setattr(monitoring.sender, '_retry_queues', {})
+    monkeypatch.setattr(monitoring.sender.constants, 'MONITORING_SEND_CHUNK_SIZE', 2)
+    data = [_sample(f'metric_{i}', i) for i in range(5)]
+
+    assert monitoring.sender.send(data, 'http://anodot', {}) == ['Error 503 from http://anodot']
+    assert bodies == [data[:2], data[2:4], data[4:]]
+
+    assert monitoring.sender.send(data[:1], 'http://anodot', {}) == []
+    assert bodies[3:] == [data[4:], data[:1]]
+
+
+def test_send_changed_gauges_only(monkeypatch):
+    bodies = []
+
+    def post(url, data, headers, proxies, timeout):
+        bodies.append(json.loads(gzip.decompress(data)))
+        return SimpleNamespace(status_code=200, text='')
+
+    monkeypatch.setattr(monitoring.sender, '_get_session', lambda: SimpleNamespace(post=post))
+    monkeypatch.setattr(monitoring.sender, '_sent_gauges', {})
+    monkeypatch.setattr(monitoring.sender.constants, 'MONITORING_SEND_CHANGED_GAUGES_ONLY', True)
+
+    monitoring.sender.send([_sample('gauge', 1), _sample('counter', 1, 'counter')], 'http://anodot', {})
+    monitoring.sender.send([_sample('gauge', 1), _sample('counter', 1, 'counter')], 'http://anodot', {})
+    monitoring.sender.send([_sample('gauge', 2), _sample('counter', 1, 'counter')], 'http://anodot', {})
+
+    assert [[sample['properties']['what'] for sample in body] for body in bodies] == [
+        ['gauge', 'counter'], ['counter'], ['gauge', 'counter']
+    ]
+
+
+def test_send_changed_gauges_after_failure(monkeypatch):
+    responses = [SimpleNamespace(status_code=400, text=''), SimpleNamespace(status_code=200, text='')]
+    bodies = []
+
+    def post(url, data, headers, proxies, timeout):
+        bodies.append(json.loads(gzip.decompress(data)))
+        return responses[len(bodies) - 1]
+
+    monkeypatch.setattr(monitoring.sender, '_get_session', lambda: SimpleNamespace(post=post))
+    monkeypatch.setattr(monitoring.sender, '_retry_queues', {})
+    monkeypatch.setattr(monitoring.sender, '_sent_gauges', {})
+    monkeypatch.setattr(monitoring.sender.constants, 'MONITORING_SEND_CHANGED_GAUGES_ONLY', True)
+
+    assert monitoring.sender.send([_sample('gauge', 1)], 'http://anodot', {}) == ['Error 400 from http://anodot']
+    assert monitoring.sender.send([_sample('gauge', 1)], 'http://anodot', {}) == []
+    assert bodies == [[_sample('gauge', 1)], [_sample('gauge', 1)]]
@@ -0,0 +1,15 @@
+import pytest
+
+from agent.pipeline.validators import solarwinds_query
+
+
+@pytest.mark.parametrize("query, query_threads, er", [
+    ("SELECT DateTime FROM Orion.CPULoad WHERE {TIMESTAMP_CONDITION}", 2, True),
+    ("SELECT DateTime FROM Orion.CPULoad WHERE DateTime > DateTime('%last_timestamp%')"
+     " AND DateTime <= DateTime('%end_timestamp%')", 2, True),
+    ("SELECT DateTime FROM Orion.CPULoad WHERE DateTime > DateTime('%last_timestamp%')", 1, True),
+    ("SELECT DateTime FROM Orion.CPULoad WHERE DateTime > DateTime('%last_timestamp%')"
+     " AND DateTime <= AddSecond(86400, DateTime('%last_timestamp%'))", 2, False),
+])
+def test_query_threads_validation(query, query_threads, er):
+    assert (not solarwinds_query.get_errors(query, query_threads)) == er
@@ -0,0 +1,16 @@
+import pytest
+
+from ..conftest import load_jython_functions
+
+
+@pytest.mark.parametrize("start, timestamps", [
+    # points at start + k * step
+    (1000, [1000, 1060, 1120]),
+    # Victoria aligned the start of the range down to a multiple of the step
+    (1030, [1020, 1080, 1140]),
+    (1030, ['1020.5', '1080', '1140']),
+])
+def test_range_points_are_assigned_to_their_intervals(start, timestamps):
+    script = load_jython_functions('victoria.py', ['get_step_index'], interval=60)
+
+    assert [script['get_step_index'](timestamp, start) for timestamp in timestamps] == [0, 1, 2]
@@ -0,0 +1,60 @@
+from agent.modules import zabbix
+from ..conftest import load_jython_functions
+
+
+class FakeResponse:
+    def __init__(self, result: dict):
+        self.result = result
+
+    def raise_for_status(self):
+        pass
+
+    def json(self) -> dict:
+        return self.result
+
+
+class FakeSession:
+    def __init__(self):
+        self.headers = {}
+        self.requests = []
+        self.tokens = iter(['token_1', 'token_2'])
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def post(self, url, json):
+        self.requests.append((json['method'], json['auth']))
+        if json['method'] == 'user.login':
+            return FakeResponse({'result': next(self.tokens)})
+        if json['auth'] == 'token_1':
+            return FakeResponse({'error': {'code': -32602, 'data': 'Session terminated, re-login, please.'}})
+        return FakeResponse({'result': [{'itemid': '1'}]})
+
+
+def test_client_authenticates_again_when_session_expires(monkeypatch):
+    session = FakeSession()
+    monkeypatch.setattr(zabbix.requests, 'Session', lambda: session)
+    client = zabbix.Client('http://zabbix', 'user', 'password')
+
+    assert client.post('item.get', {}) == [{'itemid': '1'}]
+    assert session.requests == [
+        ('user.login', None),
+        ('item.get', 'token_1'),
+        ('user.login', None),
+        ('item.get', 'token_2'),
+    ]
+
+
+def test_boundary_records_belong_to_the_later_interval_in_both_modes():
+    script = load_jython_functions('zabbix.py', ['get_time_range', 'get_interval_index'], end=1000, interval=100)
+
+    # intervals processed one by one are requested as [end - interval, end - 1]
+    assert script['get_time_range'](1) == (900, 999)
+    # catch-up requests the same records and assigns every one to the interval that would have requested it
+    time_from, time_till = script['get_time_range'](3)
+    assert (time_from, time_till) == (900, 1199)
+    for clock in range(time_from, time_till + 1):
+        idx = script['get_interval_index'](clock)
+        assert time_from + idx * 100 <= clock <= time_from + idx * 100 + 99
+    assert [script['get_interval_index'](clock) for clock in [900, 999, 1000, 1100, 1199]] == [0, 0, 1, 2, 2]
+